@@ -1,8 +1,7 @@
 """PDF 分析 API"""
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Optional
-import io
+from typing import List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,6 +26,8 @@ class AnalysisResult(BaseModel):
     pages: int
     pages_with_text: int
     pages_need_ocr: int
+    # 大型文件抽樣估計時，有文字層頁數的信賴區間 [low, high]
+    pages_with_text_range: Optional[List[int]] = None
     original_size: OriginalSize
     orientation: str  # "portrait", "landscape"
     is_notebooklm: bool
@@ -71,46 +72,50 @@ def detect_paper_size(width_mm: float, height_mm: float) -> str:
 
 @router.get("/analyze/{file_id}", response_model=AnalyzeResponse)
 async def analyze_pdf(file_id: str):
-    """分析 PDF 類型和費用預估"""
+    """分析 PDF 類型和費用預估（查詢上傳時建立的中繼資料，不重新解析檔案）"""
     from api.upload import get_file_info
-    from pypdf import PdfReader
-    from PIL import Image
+    from services.executor_service import run_cpu, run_io
+    from services.pdf_metadata import get_metadata
+    from services.watermark_service import detect_file_watermark
     
     # 取得檔案資訊
-    file_info = get_file_info(file_id)
+    file_info = await run_io(get_file_info, file_id)
     if not file_info:
         raise HTTPException(status_code=404, detail="檔案不存在")
     
-    content = file_info.get("content")
-    filename = file_info.get("filename", "").lower()
-    
     # 預設值
     pages = 1
     width_mm = 210
     height_mm = 297
     pdf_type = "image_pdf"
     pages_with_text = 0
+    pages_with_text_range = None
+    has_watermark = False
     
     try:
-        if filename.endswith('.pdf'):
-            # 分析 PDF
-            pdf = PdfReader(io.BytesIO(content))
-            pages = len(pdf.pages)
-            
-            # 取得第一頁尺寸
-            if pages > 0:
-                page = pdf.pages[0]
-                # PDF 單位是 points (1 point = 1/72 inch = 0.3528 mm)
-                width_pt = float(page.mediabox.width)
-                height_pt = float(page.mediabox.height)
-                width_mm = round(width_pt * 0.3528, 1)
-                height_mm = round(height_pt * 0.3528, 1)
-                
-                # 檢查是否有文字
-                for p in pdf.pages:
-                    text = p.extract_text()
-                    if text and len(text.strip()) > 10:
-                        pages_with_text += 1
+        meta = await run_io(get_metadata, file_info["path"])
+        pages = meta["page_count"]
+        
+        # 取得第一頁尺寸
+        if meta["kind"] == "image":
+            # 圖片假設 96 DPI
+            image = meta["pages"][0]["images"][0]
+            width_mm = round(image["width"] / 96 * 25.4, 1)
+            height_mm = round(image["height"] / 96 * 25.4, 1)
+        elif pages > 0:
+            page = meta["pages"][0]
+            # PDF 單位是 points (1 point = 1/72 inch = 0.3528 mm)
+            width_mm = round(page["width"] * 0.3528, 1)
+            height_mm = round(page["height"] * 0.3528, 1)
+        
+        if meta["kind"] == "pdf":
+            # 有文字層的頁數（大型文件可能只抽樣估計）
+            estimate = meta.get("text_estimate")
+            if estimate:
+                pages_with_text = estimate["pages_with_text"]
+                pages_with_text_range = [estimate["low"], estimate["high"]]
+            else:
+                pages_with_text = sum(1 for p in meta["pages"] if p["has_text"])
             
             # 判斷 PDF 類型
             if pages_with_text == pages:
@@ -119,14 +124,10 @@ async def analyze_pdf(file_id: str):
                 pdf_type = "image_pdf"
             else:
                 pdf_type = "mixed"
-                
-        elif filename.endswith(('.png', '.jpg', '.jpeg')):
-            # 分析圖片
-            img = Image.open(io.BytesIO(content))
-            # 假設 96 DPI
-            width_mm = round(img.width / 96 * 25.4, 1)
-            height_mm = round(img.height / 96 * 25.4, 1)
-            pdf_type = "image_pdf"
+        
+        # 右下角浮水印：本地比對前幾頁（整頁圖片直接取出，不呼叫視覺模型）
+        if pages > 0:
+            has_watermark = await run_cpu(detect_file_watermark, file_info["path"], meta)
             
     except Exception as e:
         logger.error(f"分析錯誤: {e}")
@@ -140,9 +141,9 @@ async def analyze_pdf(file_id: str):
     # 計算需要 OCR 的頁數
     pages_need_ocr = pages - pages_with_text
     
-    # 估算費用（Gemini 2.0 Flash）
-    # 每頁約 $0.0004
-    ocr_cost = pages_need_ocr * 0.0004
+    # 估算費用（雲端 OCR 後端宣告的每頁費用）
+    from services.ocr_backend import DEFAULT_CLOUD_BACKEND, get_backend_class
+    ocr_cost = pages_need_ocr * get_backend_class(DEFAULT_CLOUD_BACKEND).capabilities.cost_per_page
     
     return AnalyzeResponse(
         success=True,
@@ -152,14 +153,15 @@ async def analyze_pdf(file_id: str):
             pages=pages,
             pages_with_text=pages_with_text,
             pages_need_ocr=pages_need_ocr,
+            pages_with_text_range=pages_with_text_range,
             original_size=OriginalSize(
                 width_mm=width_mm,
                 height_mm=height_mm,
                 name=paper_name
             ),
             orientation=orientation,
-            is_notebooklm=pdf_type == "image_pdf",  # 簡單判斷
-            has_watermark=False,  # TODO: 實際偵測
+            is_notebooklm=pdf_type == "image_pdf" or has_watermark,  # 簡單判斷
+            has_watermark=has_watermark,
             estimated_cost=EstimatedCost(
                 ocr=round(ocr_cost, 4),
                 inpainting=0,
@@ -1,33 +1,152 @@
 """下載 API"""
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import Response
+import os
+from typing import Optional, Tuple
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 
 router = APIRouter()
 
+PPTX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+# 分段串流時每次讀取的大小
+CHUNK_SIZE = 256 * 1024
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析單一 Range 標頭，返回 (start, end)（含 end）
+
+    Returns:
+        None: 沒有 Range、格式錯誤或不支援（多段範圍），依 RFC 9110 忽略標頭並回傳完整檔案
+    Raises:
+        ValueError: 格式正確但範圍無法滿足（416）
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        return None  # 不支援多段範圍，回傳完整檔案
+
+    start_s, dash, end_s = spec.partition("-")
+    start_s, end_s = start_s.strip(), end_s.strip()
+    if not dash or not all(part.isdigit() for part in (start_s, end_s) if part) or not (start_s or end_s):
+        return None
+
+    if not start_s:
+        # bytes=-N：最後 N bytes
+        length = int(end_s)
+        if length <= 0:
+            raise ValueError("Unsatisfiable range")
+        start, end = max(0, size - length), size - 1
+    else:
+        start = int(start_s)
+        if end_s and int(end_s) < start:
+            return None  # 結束位置在開始之前：格式錯誤
+        end = int(end_s) if end_s else size - 1
+
+    end = min(end, size - 1)
+    if start >= size:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+def make_etag(task_id: str, size: int, inode: int) -> str:
+    """結果檔案不會被改寫，以任務 ID、大小與 inode 作為 ETag
+
+    不使用 mtime：結果可能與轉換快取共用 hard link，快取命中時會更新 mtime
+    """
+    return f'"{task_id[:8]}-{size:x}-{inode:x}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """比對 If-None-Match / If-Range（允許 weak 比對）"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = [t.strip() for t in header.split(",")]
+    return etag in tags or f"W/{etag}" in tags
+
+
+async def _iter_file(path: str, start: int, end: int):
+    """分段讀取檔案範圍"""
+    import aiofiles
+
+    remaining = end - start + 1
+    async with aiofiles.open(path, 'rb') as f:
+        await f.seek(start)
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
 
 @router.get("/download/{task_id}")
-async def download_result(task_id: str):
-    """下載處理結果"""
-    from api.process import get_task_result, task_status
-    
+async def download_result(task_id: str, request: Request):
+    """下載處理結果
+
+    支援 Range（續傳）、ETag / If-None-Match（重複下載回 304）；
+    結果在記憶體快取時直接回傳，否則從磁碟串流（伺服器支援時使用 sendfile）
+    """
+    from services.executor_service import run_io
+    from services.job_queue import get_job_queue
+    from services.result_store import get_result_store
+
     # 檢查任務狀態
-    if task_id not in task_status:
+    status = await run_io(get_job_queue().get, task_id)
+    if not status:
         raise HTTPException(status_code=404, detail="任務不存在")
-    
-    status = task_status[task_id]
+
     if status.get("status") != "done":
         raise HTTPException(status_code=400, detail="任務尚未完成")
-    
+
     # 取得結果
-    result = get_task_result(task_id)
-    if not result:
+    path = status.get("result_path")
+    try:
+        stat = os.stat(path) if path else None
+    except FileNotFoundError:
+        stat = None
+    if not stat:
         raise HTTPException(status_code=404, detail="結果不存在")
-    
-    # 返回 PPTX 檔案
-    return Response(
-        content=result,
-        media_type="application/vnd.openxmlformats-officedocument.presentationml.presentation",
-        headers={
-            "Content-Disposition": f"attachment; filename=94repdf_{task_id[:8]}.pptx"
-        }
-    )
+
+    size = stat.st_size
+    etag = make_etag(task_id, size, stat.st_ino)
+    headers = {
+        "Content-Disposition": f"attachment; filename=94repdf_{task_id[:8]}.pptx",
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": "private, max-age=3600",
+    }
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    # If-Range 不符（檔案已變更）時忽略 Range，回傳完整檔案
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and not etag_matches(if_range, etag):
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    # 小型結果使用記憶體層（命中時不讀磁碟）
+    store = get_result_store()
+    data = None
+    if size <= store.spill_threshold:
+        data = await run_io(store.get, task_id, path)
+
+    if byte_range is None:
+        if data is not None:
+            return Response(content=data, media_type=PPTX_MEDIA_TYPE, headers=headers)
+        return FileResponse(path, media_type=PPTX_MEDIA_TYPE, headers=headers, stat_result=stat)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    if data is not None:
+        return Response(content=data[start:end + 1], status_code=206, media_type=PPTX_MEDIA_TYPE, headers=headers)
+    return StreamingResponse(_iter_file(path, start, end), status_code=206, media_type=PPTX_MEDIA_TYPE, headers=headers)
@@ -1,36 +1,45 @@
 """PDF 處理 API"""
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict
 import uuid
-import asyncio
 import os
-import io
-import time
+import json
+import asyncio
 import logging
 
+from services.conversion_cache import conversion_key, get_conversion_cache
+from services.job_queue import get_job_queue
+from services.ocr_cache import get_ocr_cache
+from services.result_store import get_result_store
+
 # 設定日誌
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# 任務狀態儲存（含 TTL 自動清理）
-task_status: Dict[str, dict] = {}
-task_results: Dict[str, bytes] = {}
-TASK_TTL_SECONDS = 3600  # 任務保留 1 小時
+# SSE 讀取佇列的間隔與 keep-alive 間隔（秒）；每個連線每次讀取都會查詢 SQLite（在執行緒池進行）
+SSE_POLL_INTERVAL = float(os.getenv("SSE_POLL_INTERVAL", "1.0"))
+SSE_KEEPALIVE_SECONDS = 15
 
+# 任務狀態儲存在共用的 SQLite 佇列（多個 API / worker 行程可同時存取）
+# 佇列查詢可能等待其他行程的寫入鎖，一律經 run_io 在執行緒池執行，不阻塞 event loop
+# 過期任務由 main.py 的背景清理處理，不在查詢狀態時掃描
 
-def cleanup_old_tasks():
-    """清理過期的任務"""
-    now = time.time()
-    expired = [
-        task_id for task_id, data in task_status.items()
-        if now - data.get("created_at", now) > TASK_TTL_SECONDS
-    ]
-    for task_id in expired:
-        task_status.pop(task_id, None)
-        task_results.pop(task_id, None)
-        logger.info(f"Cleaned up expired task: {task_id}")
+
+def cleanup_old_tasks() -> int:
+    """清理過期的任務、結果與上傳檔案（依到期索引，只處理已到期的部分）"""
+    from services.upload_store import get_upload_store
+    
+    get_upload_store().sweep()
+    store = get_result_store()
+    expired = get_job_queue().delete_expired()
+    for job in expired:
+        store.delete(job["task_id"], job.get("result_path"))
+        logger.info(f"Cleaned up expired task: {job['task_id']}")
+    store.sweep()
+    return len(expired)
 
 
 class ProcessPptxRequest(BaseModel):
@@ -39,6 +48,8 @@ class ProcessPptxRequest(BaseModel):
     remove_watermark: bool = False
     pages: Optional[List[int]] = None
     use_local: bool = True  # True = 本地 Ollama，False = Gemini API
+    backend: Optional[str] = None  # 指定 OCR 後端名稱（見 /backends），優先於 use_local
+    tile_ocr: bool = False  # 分塊 OCR：高解析度頁面切成重疊方塊分別辨識（小字較清楚，請求數較多）
 
 
 class ProcessImageRequest(BaseModel):
@@ -60,139 +71,205 @@ class TaskStatus(BaseModel):
     status: str
     progress: dict
     result_url: Optional[str] = None
+    error: Optional[str] = None
 
 
-async def process_pdf_to_pptx(task_id: str, file_id: str, output_ratio: str, remove_watermark: bool, pages: Optional[List[int]], use_local: bool = True):
-    """背景任務：處理 PDF 轉 PPTX
+async def process_pdf_to_pptx(task_id: str, params: Dict, progress: Dict,
+                              on_step: Optional[Callable[[int, str], None]] = None) -> str:
+    """背景任務：處理 PDF 轉 PPTX（由 worker 行程執行）
     
     Args:
-        use_local: True = 本地 Ollama 模型（默認），False = Gemini API
+        params: 任務參數（file_id, path, filename, output_ratio, remove_watermark, pages, use_local, backend, tile_ocr）
+            backend: OCR 後端名稱；未指定時 use_local=True 為本地 Ollama（默認），False 為 Gemini API
+        progress: 進度 dict，就地更新，由 worker 定期寫回佇列
+        on_step: 逐頁步驟轉換回呼 on_step(頁碼, 步驟)，頁碼 0 表示整份文件
+    
+    Returns:
+        結果 PPTX 檔案路徑
     """
-    from api.upload import get_file_content, get_file_info
-    from services.pdf_service import PdfService
+    from services.pdf_service import RENDER_WINDOW, PdfService
     from services.pptx_service import PptxService
+    from services.pipeline_service import PagePipeline
+    from services.executor_service import run_io
+    from services.ocr_backend import get_backend, resolve_backend_name
+    from services.pdf_metadata import get_metadata
     from PIL import Image
     
-    # 選擇 OCR 服務
-    if use_local:
-        from services.ollama_service import OllamaService
-        ocr_service = OllamaService()
-    else:
-        from services.gemini_service import GeminiService
-        ocr_service = GeminiService()
+    output_ratio = params.get("output_ratio", "16:9")
+    pages = params.get("pages")
     
-    try:
-        task_status[task_id] = {
-            "status": "processing",
-            "progress": {"current_page": 0, "total_pages": 0, "current_step": "init", "percent": 0, "mode": "local" if use_local else "cloud"},
-            "created_at": time.time()
-        }
-        
-        # 取得檔案
-        file_info = get_file_info(file_id)
-        if not file_info:
-            raise Exception("檔案不存在")
-        
-        content = file_info.get("content")
-        if not content:
-            raise Exception("檔案內容為空")
-        
-        filename = file_info.get("filename", "").lower()
-        
-        # 根據檔案類型處理
-        task_status[task_id]["progress"]["current_step"] = "converting"
-        
-        if filename.endswith(('.png', '.jpg', '.jpeg')):
-            # 圖片直接打開
-            img = Image.open(io.BytesIO(content))
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            images = [img]
-        else:
-            # PDF 轉圖片
-            pdf_service = PdfService()
-            images = pdf_service.pdf_to_images(content)
-        
-        total_pages = len(images)
-        task_status[task_id]["progress"]["total_pages"] = total_pages
-        
-        # 篩選頁面
+    # 選擇 OCR 後端（註冊表）
+    backend = resolve_backend_name(params.get("backend"), params.get("use_local", True))
+    ocr_service = get_backend(backend)
+    
+    progress.update({
+        "current_page": 0, "total_pages": 0, "current_step": "init", "percent": 0,
+        "mode": "local" if ocr_service.capabilities.local else "cloud", "backend": backend,
+    })
+    
+    # 取得檔案
+    path = params.get("path")
+    if not path:
+        raise Exception("檔案不存在")
+    
+    # 檔案只從磁碟路徑讀取，不整份載入記憶體
+    if not os.path.exists(path):
+        raise Exception("檔案不存在")
+    if os.path.getsize(path) == 0:
+        raise Exception("檔案內容為空")
+    
+    filename = params.get("filename", "").lower()
+    
+    # 根據檔案類型處理
+    progress["current_step"] = "converting"
+    
+    meta = None
+    pdf_service = None
+    if filename.endswith(('.png', '.jpg', '.jpeg')):
+        # 圖片直接打開
+        img = await run_io(Image.open, path)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        images = iter([img])
+        total_pages = 1
+        pages = None
+    else:
+        # PDF 逐頁轉圖片（只渲染指定的頁面，連續頁面每 RENDER_WINDOW 頁渲染一次）；頁數與尺寸取自上傳時建立的中繼資料
+        pdf_service = PdfService()
+        meta = await run_io(get_metadata, path)
+        total_pages = meta["page_count"]
         if pages:
-            images = [images[i-1] for i in pages if 0 < i <= len(images)]
-            total_pages = len(images)
-        
-        # 初始化 PPTX 服務
-        pptx = PptxService(ratio=output_ratio)
-        
-        for i, img in enumerate(images):
-            page_num = i + 1
-            task_status[task_id]["progress"]["current_page"] = page_num
-            task_status[task_id]["progress"]["percent"] = int((i / total_pages) * 90)
-            
-            # 轉換圖片為 bytes
-            img_bytes = io.BytesIO()
-            img.save(img_bytes, format='PNG')
-            img_bytes = img_bytes.getvalue()
-            
-            # Step 1: OCR（本地或雲端）
-            task_status[task_id]["progress"]["current_step"] = "ocr"
-            ocr_result = await ocr_service.ocr_image(img_bytes, img.width, img.height)
-            texts = ocr_result.get("texts", [])
-            
-            # Step 2: Inpainting（移除文字區域）
-            task_status[task_id]["progress"]["current_step"] = "inpainting"
-            if texts:
-                bg_bytes = await ocr_service.inpaint_background(img_bytes, texts)
-                bg_img = Image.open(io.BytesIO(bg_bytes))
-            else:
-                bg_img = img
-            
-            # Step 3: 加入 PPTX
-            task_status[task_id]["progress"]["current_step"] = "pptx"
-            pptx.add_slide_with_background(bg_img, texts)
-        
-        # 儲存結果
-        task_status[task_id]["progress"]["percent"] = 95
-        task_status[task_id]["progress"]["current_step"] = "saving"
+            pages = [i for i in pages if 0 < i <= total_pages]
+            total_pages = len(pages)
+        else:
+            pages = None
+        images = pdf_service.iter_images(path, window=RENDER_WINDOW, pages=pages, meta=meta)
+    
+    progress["total_pages"] = total_pages
+    
+    # 初始化 PPTX 服務
+    pptx = PptxService(ratio=output_ratio)
+    
+    # 有文字層的頁面直接擷取文字，不需 OCR（混合文件逐頁判斷）
+    extractor = None
+    native_text = None
+    if meta and any(p["has_text"] is not False for p in meta["pages"]):
+        from services.native_text import NativeTextExtractor
         
-        pptx_bytes = pptx.save()
-        task_results[task_id] = pptx_bytes
+        extractor = await run_io(NativeTextExtractor, path, meta, pptx.prs.slide_height.pt)
+        page_numbers = pages or list(range(1, total_pages + 1))
         
-        task_status[task_id]["progress"]["percent"] = 100
-        task_status[task_id]["status"] = "done"
-        task_status[task_id]["result_url"] = f"/api/download/{task_id}"
+        def _native_text_for(index: int, width: int, height: int):
+            return extractor.texts(page_numbers[index], width, height)
         
-    except Exception as e:
-        logger.error(f"Process error for task {task_id}: {e}", exc_info=True)
-        task_status[task_id]["status"] = "failed"
-        task_status[task_id]["error"] = str(e)
+        native_text = _native_text_for
+    
+    # 並行處理頁面（OCR 並行數依後端限制，投影片依序加入）
+    pipeline = PagePipeline(
+        ocr_service,
+        pptx,
+        progress,
+        on_step=on_step,
+        native_text=native_text,
+        remove_watermark=params.get("remove_watermark", False),
+        tile_ocr=params.get("tile_ocr", False),
+        page_numbers=pages
+    )
+    try:
+        await pipeline.run(images, total_pages)
+    finally:
+        if extractor:
+            extractor.close()
+    
+    # 儲存結果
+    progress["percent"] = 95
+    progress["current_step"] = "saving"
+    if on_step:
+        on_step(0, "saving")
+    
+    pptx_bytes = await run_io(pptx.save)
+    result_path = await run_io(get_result_store().save, task_id, pptx_bytes)
+    
+    # 渲染失敗的頁面以空白圖片替代（沒有文字也沒有 OCR 錯誤），回報在進度中
+    fallback_pages = pdf_service.fallback_pages if pdf_service else []
+    if fallback_pages:
+        progress["render_fallback_pages"] = sorted(set(fallback_pages))
+        logger.warning(f"Rendered {len(fallback_pages)} pages as blank fallback images for task {task_id}")
+    
+    # 所有頁面都成功渲染與 OCR 才放入轉換快取，避免重複使用不完整的結果
+    cache_key = params.get("cache_key")
+    if cache_key and not pipeline.ocr_errors and not fallback_pages:
+        await run_io(get_conversion_cache().put_file, cache_key, result_path)
+    
+    progress["percent"] = 100
+    return result_path
 
 
 @router.post("/pptx", response_model=ProcessResponse)
-async def process_to_pptx(request: ProcessPptxRequest, background_tasks: BackgroundTasks):
+async def process_to_pptx(request: ProcessPptxRequest):
     """將 PDF 轉換為可編輯的 PPTX
     
     use_local=True（默認）: 使用本地 Ollama 視覺模型
     use_local=False: 使用 Gemini API
+    backend: 指定其他已註冊的 OCR 後端
+    
+    任務排入共用佇列，由 worker 行程處理；相同檔案與參數已轉換過時直接使用快取結果
     """
+    from api.upload import get_file_info
+    from services.executor_service import run_io
+    from services.ocr_backend import resolve_backend_name
+    
+    try:
+        backend = resolve_backend_name(request.backend, request.use_local)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"不支援的 OCR 後端: {request.backend}")
+    
     task_id = str(uuid.uuid4())
+    file_info = await run_io(get_file_info, request.file_id)
+    if not file_info:
+        raise HTTPException(status_code=404, detail="檔案不存在或已過期，請重新上傳")
+    
+    cache_key = None
+    if file_info.get("sha256"):
+        cache_key = conversion_key(
+            file_info["sha256"],
+            request.output_ratio,
+            request.pages,
+            request.remove_watermark,
+            backend,
+            request.tile_ocr
+        )
+        cached_path = await run_io(get_conversion_cache().get_path, cache_key)
+        if cached_path:
+            result_path = await run_io(get_result_store().link, task_id, cached_path)
+            progress = {"current_page": 0, "total_pages": 0, "current_step": "cached", "percent": 100}
+            await run_io(_record_cached, task_id, result_path, progress)
+            logger.info(f"Conversion cache hit for task {task_id}")
+            return ProcessResponse(
+                success=True,
+                task_id=task_id,
+                status="done"
+            )
     
-    # 加入背景任務
-    background_tasks.add_task(
-        process_pdf_to_pptx,
+    # 加入佇列
+    await run_io(
+        get_job_queue().enqueue,
         task_id,
-        request.file_id,
-        request.output_ratio,
-        request.remove_watermark,
-        request.pages,
-        request.use_local
+        {
+            "file_id": request.file_id,
+            "path": file_info.get("path"),
+            "filename": file_info.get("filename", ""),
+            "output_ratio": request.output_ratio,
+            "remove_watermark": request.remove_watermark,
+            "pages": request.pages,
+            "use_local": request.use_local,
+            "backend": backend,
+            "tile_ocr": request.tile_ocr,
+            "cache_key": cache_key,
+        },
+        {"current_page": 0, "total_pages": 0, "current_step": "queued", "percent": 0}
     )
     
-    task_status[task_id] = {
-        "status": "pending",
-        "progress": {"current_page": 0, "total_pages": 0, "current_step": "queued", "percent": 0}
-    }
-    
     return ProcessResponse(
         success=True,
         task_id=task_id,
@@ -200,16 +277,27 @@ async def process_to_pptx(request: ProcessPptxRequest, background_tasks: Backgro
     )
 
 
+def _record_cached(task_id: str, result_path: str, progress: Dict) -> None:
+    """快取命中：直接記錄為已完成的任務"""
+    queue = get_job_queue()
+    queue.create(task_id, "processing", progress)
+    queue.complete(task_id, result_path, progress, os.path.getsize(result_path))
+
+
 @router.post("/image", response_model=ProcessResponse)
-async def process_to_image(request: ProcessImageRequest, background_tasks: BackgroundTasks):
+async def process_to_image(request: ProcessImageRequest):
     """將 PDF 轉換為圖片"""
+    from services.executor_service import run_io
+    
     task_id = str(uuid.uuid4())
     
     # TODO: 實作圖片轉換
-    task_status[task_id] = {
-        "status": "processing",
-        "progress": {"current_page": 0, "total_pages": 0, "current_step": "converting", "percent": 0}
-    }
+    await run_io(
+        get_job_queue().create,
+        task_id,
+        "processing",
+        {"current_page": 0, "total_pages": 0, "current_step": "converting", "percent": 0}
+    )
     
     return ProcessResponse(
         success=True,
@@ -221,23 +309,137 @@ async def process_to_image(request: ProcessImageRequest, background_tasks: Backg
 @router.get("/status/{task_id}", response_model=TaskStatus)
 async def get_task_status(task_id: str):
     """查詢處理狀態"""
-    # 定期清理過期任務
-    cleanup_old_tasks()
+    from services.executor_service import run_io
     
-    if task_id not in task_status:
+    job = await run_io(get_job_queue().get, task_id)
+    if not job:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    status = task_status[task_id]
-    
     return TaskStatus(
         success=True,
         task_id=task_id,
-        status=status.get("status", "unknown"),
-        progress=status.get("progress", {}),
-        result_url=status.get("result_url")
+        status=job.get("status", "unknown"),
+        progress=job.get("progress", {}),
+        result_url=f"/api/download/{task_id}" if job.get("status") == "done" else None,
+        error=job.get("error")
     )
 
 
-def get_task_result(task_id: str) -> bytes:
+def _sse(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """格式化一則 SSE 訊息"""
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.get("/events/{task_id}")
+async def stream_task_events(task_id: str, request: Request):
+    """以 Server-Sent Events 推送進度，任務結束後關閉連線
+    
+    事件：
+    - step: 逐頁步驟轉換 {page, step}（ocr / inpainting / pptx / saving）
+    - progress: 進度有變化時推送完整 progress
+    - done / failed: 任務結束
+    """
+    from services.executor_service import run_io
+    
+    queue = get_job_queue()
+    if not await run_io(queue.get, task_id):
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    # 斷線重連時從上次收到的事件繼續
+    try:
+        last_seq = int(request.headers.get("last-event-id", "0"))
+    except ValueError:
+        last_seq = 0
+    
+    async def event_stream():
+        nonlocal last_seq
+        last_progress = None
+        idle = 0.0
+        while True:
+            job, events = await run_io(_poll_job, queue, task_id, last_seq)
+            if job is None:
+                yield _sse("failed", {"error": "任務不存在"})
+                return
+            
+            for event in events:
+                last_seq = event.pop("seq")
+                yield _sse("step", event, last_seq)
+                idle = 0.0
+            
+            if job["progress"] != last_progress:
+                last_progress = job["progress"]
+                yield _sse("progress", last_progress)
+                idle = 0.0
+            
+            if job["status"] == "done":
+                yield _sse("done", {"result_url": f"/api/download/{task_id}"})
+                return
+            if job["status"] == "failed":
+                yield _sse("failed", {"error": job.get("error") or "未知錯誤"})
+                return
+            
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(SSE_POLL_INTERVAL)
+            idle += SSE_POLL_INTERVAL
+            if idle >= SSE_KEEPALIVE_SECONDS:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _poll_job(queue, task_id: str, after_seq: int):
+    """一次讀取任務狀態與新的步驟事件（在執行緒池執行）"""
+    job = queue.get(task_id)
+    if job is None:
+        return None, []
+    return job, queue.get_events(task_id, after_seq)
+
+
+@router.get("/backends")
+async def list_backends():
+    """已註冊的 OCR 後端、能力與健康狀態"""
+    from services.ocr_backend import check_backends
+    
+    return {"success": True, "backends": await check_backends()}
+
+
+@router.get("/stats")
+async def get_task_stats():
+    """任務、結果儲存、快取、上傳檔案的使用量與各 worker 的速率限制"""
+    from services.executor_service import run_io
+    from services.rate_limiter import limiter_stats
+    from services.upload_store import get_upload_store
+    
+    # 速率限制在各 worker 行程內，取其隨 heartbeat 回報的狀態（API 行程本身有使用時一併列出）
+    workers = await run_io(get_job_queue().worker_stats)
+    rate_limiters = {worker_id: stats.get("rate_limiters", {}) for worker_id, stats in workers.items()}
+    local = limiter_stats()
+    if local:
+        rate_limiters["api"] = local
+    
+    return {
+        "success": True,
+        "jobs": await run_io(get_job_queue().stats),
+        "results": get_result_store().stats(),
+        "conversion_cache": get_conversion_cache().stats(),
+        "ocr_cache": get_ocr_cache().stats(),
+        "uploads": await run_io(get_upload_store().stats),
+        "rate_limiters": rate_limiters,
+    }
+
+
+def get_task_result(task_id: str) -> Optional[bytes]:
     """取得任務結果"""
-    return task_results.get(task_id)
+    job = get_job_queue().get(task_id)
+    if not job or not job.get("result_path"):
+        return None
+    return get_result_store().get(task_id, job["result_path"])
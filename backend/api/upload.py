@@ -1,23 +1,22 @@
 """檔案上傳 API"""
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from pydantic import BaseModel
+from typing import List, Optional
 import uuid
 import os
-import tempfile
+import hashlib
 import logging
-from pypdf import PdfReader
-from PIL import Image
-import io
+
+from services.pdf_metadata import build_metadata
+from services.upload_store import CapacityExhausted, TooManySessions, get_upload_store
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-# 暫存目錄
-UPLOAD_DIR = tempfile.gettempdir() + "/94repdf_uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-# 檔案暫存（實際應用應使用 Redis 或資料庫）
-file_storage: dict = {}
+# 容量不足時的回應（507 Insufficient Storage）
+CAPACITY_EXHAUSTED_DETAIL = "伺服器暫存空間已滿，請稍後再試"
+# 進行中的分段上傳過多（429）
+TOO_MANY_SESSIONS_DETAIL = "進行中的上傳過多，請稍後再試"
 
 
 class UploadResponse(BaseModel):
@@ -28,77 +27,298 @@ class UploadResponse(BaseModel):
     pages: int
 
 
+class ChunkedUploadInit(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None  # 提供時於完成時驗證
+    chunk_size: Optional[int] = None
+
+
+class ChunkedUploadStatus(BaseModel):
+    success: bool
+    upload_id: str
+    chunk_size: int
+    total_chunks: int
+    received: List[int]
+
+
+# 上傳大小上限與串流寫入的區塊大小
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# 分段上傳的預設與允許的分段大小
+RESUMABLE_CHUNK_SIZE = 5 * 1024 * 1024
+MIN_RESUMABLE_CHUNK_SIZE = 256 * 1024
+
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_file(file: UploadFile = File(...)):
-    """上傳 PDF 檔案"""
+    """上傳 PDF 檔案（分段寫入磁碟並同時計算 SHA-256）"""
+    import aiofiles
+    from services.executor_service import run_io
+    
     # 檢查檔案類型
-    filename_lower = file.filename.lower()
-    if not filename_lower.endswith(('.pdf', '.png', '.jpg', '.jpeg')):
-        raise HTTPException(status_code=400, detail="只支援 PDF、PNG、JPG 格式")
+    _check_filename(file.filename)
+    store = get_upload_store()
     
-    # 讀取檔案
-    content = await file.read()
-    file_size = len(content)
+    # 已知大小時先確認容量，避免寫到一半才失敗
+    if not await run_io(store.has_room, file.size or 0):
+        raise HTTPException(status_code=507, detail=CAPACITY_EXHAUSTED_DETAIL)
     
-    # 檢查檔案是否為空
-    if file_size == 0:
-        raise HTTPException(status_code=400, detail="檔案是空的")
+    # 串流寫入暫存檔，不把整個檔案讀進記憶體
+    tmp_path = store.temp_path(str(uuid.uuid4()))
+    hasher = hashlib.sha256()
+    file_size = 0
+    try:
+        async with aiofiles.open(tmp_path, 'wb') as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file_size += len(chunk)
+                # 檢查檔案大小 (50MB)
+                if file_size > MAX_UPLOAD_SIZE:
+                    raise HTTPException(status_code=400, detail="檔案超過 50MB 限制")
+                hasher.update(chunk)
+                await f.write(chunk)
+        
+        # 檢查檔案是否為空
+        if file_size == 0:
+            raise HTTPException(status_code=400, detail="檔案是空的")
+        
+        sha256 = hasher.hexdigest()
+        return await _finalize_upload(tmp_path, file.filename, file_size, sha256)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+@router.post("/upload/init", response_model=ChunkedUploadStatus)
+async def init_chunked_upload(request: ChunkedUploadInit):
+    """
+    建立分段上傳
     
-    # 檢查檔案大小 (50MB)
-    if file_size > 50 * 1024 * 1024:
+    用戶端以 PUT /upload/{upload_id}?offset=N 逐段上傳（可並行、可重送），
+    中斷後以 GET /upload/{upload_id} 查詢已收到的分段，最後呼叫 complete
+    """
+    import aiofiles
+    from services.executor_service import run_io
+    
+    _check_filename(request.filename)
+    if request.size <= 0:
+        raise HTTPException(status_code=400, detail="檔案是空的")
+    if request.size > MAX_UPLOAD_SIZE:
         raise HTTPException(status_code=400, detail="檔案超過 50MB 限制")
     
-    # 生成檔案 ID
-    file_id = str(uuid.uuid4())
-    
-    # 分析頁數
-    pages = 1
-    if filename_lower.endswith('.pdf'):
-        try:
-            pdf = PdfReader(io.BytesIO(content))
-            # 檢查是否加密
-            if pdf.is_encrypted:
-                raise HTTPException(status_code=400, detail="不支援密碼保護的 PDF，請先解除密碼")
-            pages = len(pdf.pages)
-            if pages == 0:
-                raise HTTPException(status_code=400, detail="PDF 沒有頁面")
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"PDF 分析錯誤: {e}")
-            raise HTTPException(status_code=400, detail=f"無法讀取 PDF: {str(e)}")
-    
-    # 儲存檔案到暫存目錄
-    ext = os.path.splitext(file.filename)[1]
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}{ext}")
-    with open(file_path, 'wb') as f:
-        f.write(content)
-    
-    # 記錄檔案資訊
-    file_storage[file_id] = {
-        "path": file_path,
-        "filename": file.filename,
-        "size": file_size,
-        "pages": pages,
-        "content": content  # 暫存內容以便後續處理
+    chunk_size = request.chunk_size or RESUMABLE_CHUNK_SIZE
+    if not MIN_RESUMABLE_CHUNK_SIZE <= chunk_size <= MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=400, detail="分段大小不正確")
+    
+    store = get_upload_store()
+    upload_id = str(uuid.uuid4())
+    session = {
+        "path": store.temp_path(upload_id),
+        "filename": request.filename,
+        "size": request.size,
+        "sha256": request.sha256.lower() if request.sha256 else None,
+        "chunk_size": chunk_size,
+        "total_chunks": -(-request.size // chunk_size),
     }
+    try:
+        await run_io(store.begin_session, upload_id, session)
+    except TooManySessions:
+        raise HTTPException(status_code=429, detail=TOO_MANY_SESSIONS_DETAIL)
+    except CapacityExhausted:
+        raise HTTPException(status_code=507, detail=CAPACITY_EXHAUSTED_DETAIL)
+    
+    # 預先建立完整大小的檔案，分段直接寫入各自的位置
+    async with aiofiles.open(session["path"], 'wb') as f:
+        await f.truncate(request.size)
+    
+    return _session_status(upload_id, {**session, "received": set()})
+
+
+@router.put("/upload/{upload_id}", response_model=ChunkedUploadStatus)
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """寫入一個分段（請求 body 為原始 bytes，offset 需對齊分段大小）"""
+    import aiofiles
+    from services.executor_service import run_io
+    
+    session = await _get_session(upload_id)
+    chunk_size = session["chunk_size"]
+    if offset < 0 or offset >= session["size"] or offset % chunk_size:
+        raise HTTPException(status_code=400, detail="offset 不正確")
     
+    index = offset // chunk_size
+    expected = min(chunk_size, session["size"] - offset)
+    
+    # 邊收邊寫入檔案中的對應位置，不在記憶體中組合整個分段
+    written = 0
+    async with aiofiles.open(session["path"], 'r+b') as f:
+        await f.seek(offset)
+        async for data in request.stream():
+            written += len(data)
+            if written > expected:
+                break
+            await f.write(data)
+    
+    if written != expected:
+        raise HTTPException(status_code=400, detail=f"分段大小不符（預期 {expected} bytes）")
+    
+    # 工作階段存在共用資料庫，其他行程收到的分段也會列入
+    store = get_upload_store()
+    if not await run_io(store.mark_received, upload_id, index):
+        raise HTTPException(status_code=404, detail="上傳不存在或已過期")
+    return _session_status(upload_id, await _get_session(upload_id))
+
+
+@router.get("/upload/{upload_id}", response_model=ChunkedUploadStatus)
+async def get_chunked_upload(upload_id: str):
+    """查詢已收到的分段（續傳時只需補送缺少的分段）"""
+    return _session_status(upload_id, await _get_session(upload_id))
+
+
+@router.post("/upload/{upload_id}/complete", response_model=UploadResponse)
+async def complete_chunked_upload(upload_id: str):
+    """所有分段到齊後驗證並登記檔案"""
+    from services.executor_service import run_io
+    
+    session = await _get_session(upload_id)
+    missing = session["total_chunks"] - len(session["received"])
+    if missing:
+        raise HTTPException(status_code=409, detail=f"尚有 {missing} 個分段未上傳")
+    
+    # 同時送出的 complete 只有一個取得工作階段
+    session = await run_io(get_upload_store().end_session, upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="上傳不存在或已過期")
+    tmp_path = session["path"]
+    try:
+        sha256 = await run_io(_hash_file, tmp_path)
+        if session["sha256"] and session["sha256"] != sha256:
+            raise HTTPException(status_code=400, detail="檔案驗證失敗（SHA-256 不符），請重新上傳")
+        return await _finalize_upload(tmp_path, session["filename"], session["size"], sha256)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+async def _finalize_upload(tmp_path: str, filename: str, size: int, sha256: str) -> UploadResponse:
+    """已寫入暫存檔的上傳：去重、檢查 PDF、移到正式位置並登記"""
+    from services.executor_service import run_io
+    
+    store = get_upload_store()
+    
+    # 相同內容已上傳過：直接使用既有的檔案
+    existing_id = await run_io(store.find, sha256)
+    if existing_id:
+        return await run_io(_upload_response, existing_id)
+    
+    # 以內容 hash 命名，相同內容只存一份
+    file_path = store.path_for(sha256, os.path.splitext(filename)[1].lower())
+    os.replace(tmp_path, file_path)
+    
+    # 解析一次並建立中繼資料（頁數、尺寸、文字層…），之後分析與處理直接查詢
+    try:
+        meta = await run_io(_build_metadata, file_path)
+    except HTTPException:
+        store.discard(file_path)
+        raise
+    pages = meta["page_count"]
+    
+    # 登記檔案資訊（內容只存在磁碟），容量不足時淘汰最久未使用的上傳
+    try:
+        file_id = await run_io(store.add, str(uuid.uuid4()), {
+            "path": file_path,
+            "filename": filename,
+            "size": size,
+            "pages": pages,
+            "sha256": sha256  # 轉換快取 key
+        })
+    except CapacityExhausted:
+        store.discard(file_path)
+        raise HTTPException(status_code=507, detail=CAPACITY_EXHAUSTED_DETAIL)
+    
+    return await run_io(_upload_response, file_id)
+
+
+def _check_filename(filename: str) -> None:
+    """檢查檔案類型"""
+    if not filename.lower().endswith(('.pdf', '.png', '.jpg', '.jpeg')):
+        raise HTTPException(status_code=400, detail="只支援 PDF、PNG、JPG 格式")
+
+
+async def _get_session(upload_id: str) -> dict:
+    from services.executor_service import run_io
+    
+    session = await run_io(get_upload_store().get_session, upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="上傳不存在或已過期")
+    return session
+
+
+def _session_status(upload_id: str, session: dict) -> ChunkedUploadStatus:
+    return ChunkedUploadStatus(
+        success=True,
+        upload_id=upload_id,
+        chunk_size=session["chunk_size"],
+        total_chunks=session["total_chunks"],
+        received=sorted(session["received"])
+    )
+
+
+def _hash_file(path: str) -> str:
+    """分段計算檔案 SHA-256"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _upload_response(file_id: str) -> UploadResponse:
+    info = get_upload_store().get(file_id)
     return UploadResponse(
         success=True,
         file_id=file_id,
-        filename=file.filename,
-        size=file_size,
-        pages=pages
+        filename=info["filename"],
+        size=info["size"],
+        pages=info["pages"]
     )
 
 
+def _build_metadata(path: str) -> dict:
+    """建立中繼資料並檢查檔案是否可處理"""
+    try:
+        meta = build_metadata(path)
+    except Exception as e:
+        logger.error(f"檔案分析錯誤: {e}")
+        raise HTTPException(status_code=400, detail=f"無法讀取檔案: {str(e)}")
+    
+    # 檢查是否加密
+    if meta["encrypted"]:
+        raise HTTPException(status_code=400, detail="不支援密碼保護的 PDF，請先解除密碼")
+    if meta["page_count"] == 0:
+        raise HTTPException(status_code=400, detail="PDF 沒有頁面")
+    return meta
+
+
 def get_file_content(file_id: str) -> bytes:
-    """取得檔案內容"""
-    if file_id not in file_storage:
+    """取得檔案內容（從磁碟讀取；大型檔案建議使用 get_file_path）"""
+    path = get_file_path(file_id)
+    if not path:
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def get_file_path(file_id: str) -> str:
+    """取得檔案在磁碟上的路徑"""
+    info = get_upload_store().get(file_id)
+    if not info:
         return None
-    return file_storage[file_id].get("content")
+    return info.get("path")
 
 
 def get_file_info(file_id: str) -> dict:
-    """取得檔案資訊"""
-    return file_storage.get(file_id)
+    """取得檔案資訊（同時更新最後使用時間）"""
+    return get_upload_store().get(file_id)
@@ -0,0 +1,212 @@
+"""
+OCR 圖片前處理基準測試 - 比較不同像素預算、編碼與品質的前處理時間、傳輸量、OCR 延遲與文字框準確度
+
+    python bench_image_prep.py                                   # 合成投影片，只比較前處理時間與傳輸量
+    python bench_image_prep.py --backend ollama                  # 加上 OCR 延遲與文字框準確度
+    python bench_image_prep.py --pdf slides.pdf --pages 5 --backend gemini
+    python bench_image_prep.py --settings PNG:0:0,JPEG:1003520:90,WEBP:1003520:80
+
+設定格式為 格式:像素預算:品質[:最長邊]（0 表示不限制 / 預設品質）。
+合成投影片以繪製時的文字框為標準答案；PDF 頁面以第一個設定（通常是原圖 PNG）的 OCR 結果為標準答案。
+準確度：以 IoU >= 0.5 配對文字框，回報召回率、平均 IoU 與內容相符比例（座標已換算回原圖）。
+"""
+import io
+import sys
+import time
+import base64
+import asyncio
+import argparse
+import statistics
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from services.image_prep import prepare_ocr_image, needs_prep, scale_texts
+
+DEFAULT_SETTINGS = "PNG:0:0,PNG:1003520:0,JPEG:1003520:90,JPEG:1003520:75,WEBP:1003520:80,JPEG:2359296:85"
+MATCH_IOU = 0.5
+
+_LINES = [
+    "季度營運報告 Quarterly Review",
+    "營收成長 18%，毛利率維持 42%",
+    "新市場：東南亞與日本",
+    "Next steps: hiring, pricing, launch",
+    "附註：數字為未經審計之初步結果",
+]
+
+
+class Setting(NamedTuple):
+    image_format: str
+    max_pixels: int
+    quality: int
+    max_side: int
+
+    @classmethod
+    def parse(cls, text: str) -> "Setting":
+        parts = text.split(":")
+        fmt = parts[0].upper()
+        numbers = [int(p) for p in parts[1:]] + [0, 0, 0]
+        return cls(fmt, numbers[0], numbers[1], numbers[2])
+
+    def label(self) -> str:
+        budget = f"{self.max_pixels / 1e6:.2f}MP" if self.max_pixels else "full"
+        quality = f" q{self.quality}" if self.quality else ""
+        side = f" ≤{self.max_side}px" if self.max_side else ""
+        return f"{self.image_format} {budget}{quality}{side}"
+
+
+def synthetic_page(index: int, width: int = 2500, height: int = 1406) -> Tuple[bytes, List[Dict]]:
+    """產生投影片 PNG（約 150 DPI 的 16:9 頁面，漸層背景與插圖區塊）與其文字框標準答案"""
+    import numpy as np
+
+    rng = np.random.default_rng(index)
+    ramp = np.linspace(0, 1, width)[None, :, None]
+    base = np.array([248, 244, 232]) * (1 - ramp) + np.array([220, 232, 246]) * ramp
+    pixels = np.broadcast_to(base, (height, width, 3)).copy()
+    # 右側插圖：平滑色塊加上雜訊（模擬生成圖片）
+    left = width * 2 // 3
+    yy, xx = np.mgrid[0:height, left:width]
+    pixels[:, left:] = (128 + 60 * np.sin(xx[..., None] / 90 + index + np.array([0, 1, 2]))
+                        * np.cos(yy[..., None] / 70) + rng.normal(0, 6, (height, width - left, 3)))
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, width, height // 7), fill=(40, 60, 110))
+    truth = []
+    y = height // 28
+    for i, line in enumerate(_LINES[index % 2:]):
+        size = 84 if i == 0 else 48 - 4 * (i % 3)
+        font = ImageFont.load_default(size=size)
+        color = (255, 255, 255) if i == 0 else (30 + 40 * (i % 3), 30, 30)
+        x = width // 20 + (index * 37) % 120
+        draw.text((x, y), line, font=font, fill=color)
+        left, top, right, bottom = draw.textbbox((x, y), line, font=font)
+        truth.append({"content": line, "x": left, "y": top, "width": right - left, "height": bottom - top})
+        y = (height // 7 + height // 20) if i == 0 else y + int(size * 2.2)
+    output = io.BytesIO()
+    img.save(output, format="PNG")
+    return output.getvalue(), truth
+
+
+def pdf_pages(path: str, count: int) -> List[bytes]:
+    from services.pdf_metadata import get_metadata
+    from services.pdf_service import PdfService
+
+    # 傳入中繼資料：整頁圖片直接取出，不需渲染
+    meta = get_metadata(path)
+    pages = []
+    for img in PdfService().iter_images(path, pages=list(range(1, min(count, meta["page_count"]) + 1)), meta=meta):
+        output = io.BytesIO()
+        img.save(output, format="PNG")
+        pages.append(output.getvalue())
+    return pages
+
+
+def _iou(a: Dict, b: Dict) -> float:
+    x1, y1 = max(a["x"], b["x"]), max(a["y"], b["y"])
+    x2 = min(a["x"] + a["width"], b["x"] + b["width"])
+    y2 = min(a["y"] + a["height"], b["y"] + b["height"])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = a["width"] * a["height"] + b["width"] * b["height"] - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _normalize(text: str) -> str:
+    return "".join(str(text).split()).lower()
+
+
+def score_boxes(found: List[Dict], truth: List[Dict]) -> Dict:
+    """以 IoU 貪婪配對文字框：召回率、平均 IoU、內容相符比例"""
+    boxes = [t for t in found if all(isinstance(t.get(k), (int, float)) for k in ("x", "y", "width", "height"))]
+    pairs = sorted(((_iou(f, t), fi, ti) for fi, f in enumerate(boxes) for ti, t in enumerate(truth)), reverse=True)
+    used_found, used_truth, matches = set(), set(), []
+    for iou, fi, ti in pairs:
+        if iou < MATCH_IOU:
+            break
+        if fi in used_found or ti in used_truth:
+            continue
+        used_found.add(fi)
+        used_truth.add(ti)
+        matches.append((iou, boxes[fi], truth[ti]))
+    total = max(1, len(truth))
+    return {
+        "recall": len(matches) / total,
+        "iou": statistics.mean(m[0] for m in matches) if matches else 0.0,
+        "text": sum(_normalize(f.get("content", "")) == _normalize(t["content"]) for _, f, t in matches) / total,
+    }
+
+
+def prepare(page: bytes, setting: Setting) -> Tuple[bytes, int, int, float]:
+    """前處理一頁，返回 (bytes, 寬, 高, 秒數)"""
+    width, height = Image.open(io.BytesIO(page)).size
+    start = time.perf_counter()
+    if needs_prep(width, height, setting.max_side, setting.image_format, setting.max_pixels):
+        data, w, h = prepare_ocr_image(page, setting.max_side, setting.image_format, setting.max_pixels, setting.quality)
+    else:
+        data, w, h = page, width, height
+    return data, w, h, time.perf_counter() - start
+
+
+async def run(args) -> None:
+    settings = [Setting.parse(s) for s in args.settings.split(",") if s]
+    if args.pdf:
+        pages = pdf_pages(args.pdf, args.pages)
+        truths: List[Optional[List[Dict]]] = [None] * len(pages)
+    else:
+        generated = [synthetic_page(i) for i in range(args.pages)]
+        pages = [page for page, _ in generated]
+        truths = [truth for _, truth in generated]
+
+    backend = None
+    if args.backend:
+        from services.ocr_backend import get_backend
+        backend = get_backend(args.backend)
+
+    first = Image.open(io.BytesIO(pages[0])).size
+    print(f"{len(pages)} 頁，頁面尺寸 {first[0]}x{first[1]}，後端：{args.backend or '（不呼叫 OCR）'}\n")
+    header = f"{'設定':<24}{'送出尺寸':>12}{'前處理 ms':>11}{'base64 KB':>11}"
+    if backend:
+        header += f"{'OCR 秒':>9}{'召回率':>8}{'IoU':>7}{'內容':>7}"
+    print(header)
+
+    for setting in settings:
+        prep_times, payloads, latencies, scores, size = [], [], [], [], None
+        for index, page in enumerate(pages):
+            data, w, h, elapsed = prepare(page, setting)
+            prep_times.append(elapsed)
+            payloads.append(len(base64.b64encode(data)))
+            size = f"{w}x{h}"
+            if not backend:
+                continue
+
+            width, height = Image.open(io.BytesIO(page)).size
+            start = time.perf_counter()
+            try:
+                result = await backend.recognize(data, w, h)
+            except Exception as e:
+                print(f"  第 {index + 1} 頁 OCR 失敗：{e}", file=sys.stderr)
+                continue
+            latencies.append(time.perf_counter() - start)
+            texts = scale_texts(result.get("texts", []), width / w, height / h)
+            if truths[index] is None:
+                # PDF 頁面：第一個設定的結果作為標準答案
+                truths[index] = texts
+            scores.append(score_boxes(texts, truths[index]))
+
+        row = (f"{setting.label():<24}{size:>12}{statistics.mean(prep_times) * 1000:>11.1f}"
+               f"{statistics.mean(payloads) / 1024:>11.1f}")
+        if backend:
+            if latencies:
+                row += (f"{statistics.mean(latencies):>9.2f}"
+                        + "".join(f"{statistics.mean(s[key] for s in scores):>8.2f}" for key in ("recall", "iou", "text")))
+            else:
+                row += f"{'失敗':>9}"
+        print(row)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCR 圖片前處理基準測試")
+    parser.add_argument("--pdf", help="使用 PDF 頁面（預設使用合成投影片）")
+    parser.add_argument("--pages", type=int, default=5, help="頁數")
+    parser.add_argument("--backend", help="OCR 後端名稱（如 ollama、gemini；不指定則不呼叫 OCR）")
+    parser.add_argument("--settings", default=DEFAULT_SETTINGS, help="逗號分隔的 格式:像素預算:品質[:最長邊]")
+    asyncio.run(run(parser.parse_args()))
@@ -2,7 +2,10 @@
 94RePdf - 就是讓 PDF 重生
 FastAPI 後端入口
 """
+import asyncio
 import logging
+import multiprocessing
+import os
 import sys
 
 # 設定日誌
@@ -18,15 +21,64 @@ logger = logging.getLogger(__name__)
 from dotenv import load_dotenv
 load_dotenv()
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from api import auth, upload, analyze, process, download
+from services import executor_service, ollama_service
+
+
+# 隨 API 啟動的 worker 行程數（設為 0 則需另外執行 python worker.py）
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+# 背景清理過期任務的間隔（秒）
+TASK_SWEEP_INTERVAL = int(os.getenv("TASK_SWEEP_INTERVAL", "60"))
+
+
+async def sweep_expired_tasks():
+    """背景清理過期任務（不在請求路徑上執行）"""
+    while True:
+        await asyncio.sleep(TASK_SWEEP_INTERVAL)
+        try:
+            await executor_service.run_io(process.cleanup_old_tasks)
+        except Exception as e:
+            logger.error(f"Task sweep error: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """應用程式生命週期：啟動 worker 行程與共用 HTTP 連線池，結束時停止 worker 並關閉執行池與連線"""
+    import worker
+    
+    ctx = multiprocessing.get_context("spawn")
+    workers = []
+    for i in range(JOB_WORKERS):
+        proc = ctx.Process(target=worker.main, name=f"94repdf-worker-{i}")
+        proc.start()
+        workers.append(proc)
+    sweeper = asyncio.create_task(sweep_expired_tasks())
+    ollama_service.get_ollama_client()
+    
+    yield
+    
+    sweeper.cancel()
+    # SIGTERM 讓 worker 將處理中的任務歸還佇列
+    for proc in workers:
+        proc.terminate()
+    for proc in workers:
+        proc.join(timeout=10)
+        if proc.is_alive():
+            proc.kill()
+    await ollama_service.close_ollama_client()
+    executor_service.shutdown()
+
 
 app = FastAPI(
     title="94RePdf API",
     description="PDF 轉 PPTX、文字編輯、格式轉換",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS 設定
@@ -0,0 +1,199 @@
+"""兩層快取（記憶體 LRU + 磁碟），供轉換結果與 OCR 結果使用"""
+import os
+import time
+import shutil
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TieredCache:
+    """
+    以 key（hex 字串）存放 bytes：
+    - 記憶體：LRU，總大小不超過 memory_budget（0 表示停用）
+    - 磁碟：cache_dir 下每個 key 一個檔案，依 mtime 做 LRU，超過 disk_budget 或 max_age 即淘汰
+
+    磁碟層可由多個行程共用；記憶體層與計數器為各行程獨立。
+    """
+
+    def __init__(self, name: str, cache_dir: str, memory_budget: int, disk_budget: int,
+                 max_age: int = 0, suffix: str = ""):
+        self.name = name
+        self.cache_dir = cache_dir
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.max_age = max_age
+        self.suffix = suffix
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        # 磁碟用量估計值（淘汰時重新計算）
+        self._disk_bytes: Optional[int] = None
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+
+    def path_for(self, key: str) -> str:
+        """磁碟快取檔案路徑（以前兩字元分目錄，避免單一目錄檔案過多）"""
+        return os.path.join(self.cache_dir, key[:2], f"{key}{self.suffix}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """讀取快取：記憶體 → 磁碟，磁碟命中時提升到記憶體"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return data
+
+        path = self.get_path(key, count=False)
+        if path is None:
+            with self._lock:
+                self._counters["misses"] += 1
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._counters["misses"] += 1
+            return None
+
+        with self._lock:
+            self._counters["disk_hits"] += 1
+        self._remember(key, data)
+        return data
+
+    def get_path(self, key: str, count: bool = True) -> Optional[str]:
+        """只查磁碟層，命中時返回檔案路徑（並更新 mtime 作為 LRU 依據）"""
+        path = self.path_for(key)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            if count:
+                with self._lock:
+                    self._counters["misses"] += 1
+            return None
+
+        now = time.time()
+        if self.max_age and now - mtime > self.max_age:
+            self._unlink(path)
+            if count:
+                with self._lock:
+                    self._counters["misses"] += 1
+            return None
+
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            return None
+        if count:
+            with self._lock:
+                self._counters["disk_hits"] += 1
+        return path
+
+    def put(self, key: str, data: bytes) -> None:
+        """寫入快取（記憶體與磁碟）"""
+        self._remember(key, data)
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._after_put(len(data))
+
+    def put_file(self, key: str, src_path: str) -> None:
+        """由既有檔案寫入磁碟層（優先使用 hard link，不複製內容）"""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        link_or_copy(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        self._after_put(os.path.getsize(path))
+
+    def stats(self) -> Dict:
+        """使用量與命中率"""
+        with self._lock:
+            hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+            lookups = hits + self._counters["misses"]
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                **self._counters,
+            }
+
+    def _remember(self, key: str, data: bytes) -> None:
+        """放入記憶體層，超過預算時淘汰最久未使用的項目"""
+        if len(data) > self.memory_budget:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old)
+            while self._memory and self._memory_bytes + len(data) > self.memory_budget:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+
+    def _after_put(self, size: int) -> None:
+        with self._lock:
+            self._counters["puts"] += 1
+            if self._disk_bytes is not None:
+                self._disk_bytes += size
+            over_budget = self._disk_bytes is None or self._disk_bytes > self.disk_budget
+        if over_budget:
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """依 mtime 淘汰磁碟層：先刪除過期項目，再刪最舊的直到低於預算"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        evicted = 0
+        for mtime, size, path in entries:
+            expired = self.max_age and now - mtime > self.max_age
+            if not expired and total <= self.disk_budget:
+                break
+            self._unlink(path)
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self._disk_bytes = total
+            self._counters["evictions"] += evicted
+        if evicted:
+            logger.info(f"{self.name} cache evicted {evicted} entries ({total} bytes on disk)")
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def link_or_copy(src_path: str, dst_path: str) -> None:
+    """建立 hard link（同一檔案系統時不複製內容），失敗則複製"""
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copyfile(src_path, dst_path)
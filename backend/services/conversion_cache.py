@@ -0,0 +1,67 @@
+"""轉換結果快取 - 相同 PDF 與參數直接使用先前的 PPTX"""
+import os
+import json
+import hashlib
+import tempfile
+import logging
+from typing import List, Optional
+
+from services.cache_service import TieredCache
+
+logger = logging.getLogger(__name__)
+
+CONVERSION_CACHE_DIR = os.getenv(
+    "CONVERSION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "94repdf_cache", "conversions")
+)
+CONVERSION_CACHE_DISK_MB = int(os.getenv("CONVERSION_CACHE_DISK_MB", "1024"))
+CONVERSION_CACHE_MAX_AGE = int(os.getenv("CONVERSION_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+
+# 轉換流程（版面、inpainting 等）變更時遞增，使舊快取失效
+PIPELINE_VERSION = "4"
+
+
+def backend_fingerprint(backend: str) -> str:
+    """OCR 後端、模型、prompt 版本與送出圖片設定"""
+    from services.ocr_backend import get_backend
+    return get_backend(backend).fingerprint
+
+
+def tiling_fingerprint(backend: str) -> str:
+    """分塊 OCR 設定（方塊邊長依後端能力）"""
+    from services.ocr_backend import get_backend
+    from services.ocr_tiling import tile_size_for, tiling_variant
+    return tiling_variant(tile_size_for(get_backend(backend).capabilities))
+
+
+def conversion_key(file_hash: str, output_ratio: str, pages: Optional[List[int]],
+                   remove_watermark: bool, backend: str, tile_ocr: bool = False) -> str:
+    """由檔案 SHA-256 與處理參數組成快取 key"""
+    params = {
+        "file": file_hash,
+        "ratio": output_ratio,
+        "pages": pages or None,
+        "watermark": remove_watermark,
+        "backend": backend_fingerprint(backend),
+        "tiles": tiling_fingerprint(backend) if tile_ocr else None,
+        "pipeline": PIPELINE_VERSION,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+_cache: Optional[TieredCache] = None
+
+
+def get_conversion_cache() -> TieredCache:
+    """取得行程內共用的轉換快取"""
+    global _cache
+    if _cache is None:
+        # 命中時以 hard link 建立結果檔，不需要記憶體層
+        _cache = TieredCache(
+            "conversion",
+            CONVERSION_CACHE_DIR,
+            memory_budget=0,
+            disk_budget=CONVERSION_CACHE_DISK_MB * 1024 * 1024,
+            max_age=CONVERSION_CACHE_MAX_AGE,
+            suffix=".pptx",
+        )
+    return _cache
@@ -0,0 +1,78 @@
+"""執行緒 / 行程池管理 - 將 CPU 密集工作移出 event loop"""
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, NamedTuple, Optional
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 行程池：重度圖片處理（inpainting、PNG 編碼）
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0")) or (os.cpu_count() or 1)
+# 執行緒池：輕量或 I/O 為主的工作（渲染呼叫 poppler、pptx 存檔）
+IO_WORKERS = int(os.getenv("IO_WORKERS", "4"))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_thread_pool: Optional[ThreadPoolExecutor] = None
+
+
+class PagePayload(NamedTuple):
+    """可 pickle 的頁面圖片（原始像素），傳給行程池時不需先編碼"""
+    mode: str
+    size: tuple
+    data: bytes
+
+    @classmethod
+    def from_image(cls, img: Image.Image) -> "PagePayload":
+        return cls(img.mode, img.size, img.tobytes())
+
+    def to_image(self) -> Image.Image:
+        return Image.frombytes(self.mode, self.size, self.data)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """取得共用行程池（延遲建立）"""
+    global _process_pool
+    if _process_pool is None:
+        # 使用 spawn，避免在多執行緒的 uvicorn 中 fork
+        _process_pool = ProcessPoolExecutor(
+            max_workers=CPU_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"Process pool started with {CPU_WORKERS} workers")
+    return _process_pool
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """取得共用執行緒池（延遲建立）"""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="94repdf-io")
+    return _thread_pool
+
+
+async def run_cpu(func: Callable, *args, **kwargs):
+    """在行程池執行 CPU 密集函數（func 與參數必須可 pickle）"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), partial(func, *args, **kwargs))
+
+
+async def run_io(func: Callable, *args, **kwargs):
+    """在執行緒池執行阻塞函數"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_thread_pool(), partial(func, *args, **kwargs))
+
+
+def shutdown(wait: bool = True) -> None:
+    """關閉所有執行池（應用程式結束時呼叫）"""
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=wait, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=wait, cancel_futures=True)
+        _thread_pool = None
+    logger.info("Executors shut down")
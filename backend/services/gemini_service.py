@@ -1,9 +1,11 @@
 """Gemini API 服務 - OCR 和 Inpainting"""
 import os
-import json
+import math
 import base64
+import asyncio
 import logging
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,199 +14,150 @@ import google.generativeai as genai
 
 logger = logging.getLogger(__name__)
 
+from services.image_prep import image_mime
+from services.ocr_backend import OcrBackend, OcrCapabilities
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# 每個行程同時進行中的 OCR 請求上限
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "4"))
+# 送出圖片的最長邊（px，0 不縮小）與編碼；JPEG 大幅減少上傳量
+GEMINI_MAX_IMAGE_SIDE = int(os.getenv("GEMINI_MAX_IMAGE_SIDE", "3072"))
+GEMINI_IMAGE_FORMAT = os.getenv("GEMINI_IMAGE_FORMAT", "JPEG").upper()
+GEMINI_IMAGE_QUALITY = int(os.getenv("GEMINI_IMAGE_QUALITY", "85"))
+# 像素預算（0 不限制）：大圖以 768x768 為單位計費（每塊 258 token），預設約 4 塊的面積
+GEMINI_MAX_PIXELS = int(os.getenv("GEMINI_MAX_PIXELS", str(1536 * 1536)))
+# 每頁預估費用（USD，Gemini 2.0 Flash 約 $0.0004）
+GEMINI_COST_PER_PAGE = float(os.getenv("GEMINI_COST_PER_PAGE", "0.0004"))
+
+# 自訂 API 端點（本地 stub 或代理，例如 http://localhost:8790），設定時改用 REST
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT", "")
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT", "rest" if GEMINI_API_ENDPOINT else "grpc")
+# 配額（整個部署合計）：每分鐘請求數與 token 數，0 表示不限制
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "1000"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+# 共用配額的行程數：每個行程的 bucket 取得 1/N 的額度（預設為 main.py 啟動的 worker 數；
+# 另外執行 worker.py 或多個實例時需設為所有 worker 行程的總數）
+GEMINI_RATE_SHARES = max(1, int(os.getenv("GEMINI_RATE_SHARES", os.getenv("JOB_WORKERS", "1")) or 1))
+# 送出前估計的輸出 token 數（回應後依實際用量補正）
+GEMINI_OUTPUT_TOKENS = int(os.getenv("GEMINI_OUTPUT_TOKENS", "1024"))
+# 伺服器回報配額用盡（429）時暫停秒數與重新排隊次數
+GEMINI_QUOTA_PAUSE = float(os.getenv("GEMINI_QUOTA_PAUSE", "10"))
+GEMINI_QUOTA_RETRIES = int(os.getenv("GEMINI_QUOTA_RETRIES", "3"))
+# REST 傳輸沒有非同步客戶端，改在專用執行緒池呼叫（大小同 OCR 並行數）
+GEMINI_THREADS = GEMINI_CONCURRENCY
+# 圖片 token 計算：兩邊都不超過 384px 算 258 token，否則以 768px 切塊、每塊 258 token
+_IMAGE_TOKENS = 258
+_IMAGE_SMALL = 384
+_IMAGE_TILE = 768
+
 # 設定 API Key
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+    genai.configure(
+        api_key=GEMINI_API_KEY,
+        transport=GEMINI_TRANSPORT,
+        client_options={"api_endpoint": GEMINI_API_ENDPOINT} if GEMINI_API_ENDPOINT else None,
+    )
 else:
     logger.warning("GEMINI_API_KEY not set - Gemini OCR will not work")
 
+_limiter = None
+_thread_pool: Optional[ThreadPoolExecutor] = None
 
-class GeminiService:
-    """Gemini API 服務類"""
-    
-    def __init__(self, model_name: str = "gemini-2.0-flash"):
-        self.model = genai.GenerativeModel(model_name)
-    
-    async def ocr_image(self, image_bytes: bytes, width: int, height: int) -> Dict:
-        """
-        OCR 辨識圖片中的文字
-        
-        Returns:
-            {
-                "texts": [
-                    {
-                        "content": "文字內容",
-                        "x": 100, "y": 50,
-                        "width": 400, "height": 60,
-                        "font_size": 36,
-                        "font_weight": "bold",
-                        "color": "#333333",
-                        "confidence": 0.98
-                    }
-                ]
-            }
-        """
-        prompt = f"""分析這張投影片圖片，請：
 
-1. 辨識所有文字，輸出每個文字區塊的：
-   - content: 文字內容
-   - x, y: 左上角座標（像素）
-   - width, height: 區塊尺寸（像素）
-   - font_size: 字體大小（估計值）
-   - font_weight: "bold" 或 "normal"
-   - color: 顏色（hex 格式，如 #333333）
-   - confidence: 辨識信心度（0-1）
+def get_gemini_limiter():
+    """取得行程內共用的 Gemini 速率限制（跨任務共用，額度為配額的 1/GEMINI_RATE_SHARES）"""
+    from services.rate_limiter import TokenBucketLimiter, budget_share
 
-2. 只輸出 JSON 格式，不要其他文字
-3. 確保座標位置精確
+    global _limiter
+    if _limiter is None:
+        _limiter = TokenBucketLimiter(
+            budget_share(GEMINI_RPM, GEMINI_RATE_SHARES),
+            budget_share(GEMINI_TPM, GEMINI_RATE_SHARES),
+            name="gemini"
+        )
+    return _limiter
 
-圖片尺寸：{width} x {height} 像素
 
-輸出格式：
-{{"texts": [...]}}
-"""
-        
-        # 將圖片轉為 base64
-        image_data = base64.b64encode(image_bytes).decode('utf-8')
-        
-        # 建立圖片 part
+def _get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=max(1, GEMINI_THREADS), thread_name_prefix="94repdf-gemini")
+    return _thread_pool
+
+
+def estimate_tokens(prompt: str, width: int, height: int) -> int:
+    """估計一次請求的 token 數（prompt 以每字元一個 token 保守估計）"""
+    if width <= _IMAGE_SMALL and height <= _IMAGE_SMALL:
+        image_tokens = _IMAGE_TOKENS
+    else:
+        image_tokens = math.ceil(width / _IMAGE_TILE) * math.ceil(height / _IMAGE_TILE) * _IMAGE_TOKENS
+    return len(prompt) + image_tokens + GEMINI_OUTPUT_TOKENS
+
+
+class GeminiService(OcrBackend):
+    """Gemini API 服務類"""
+    
+    name = "gemini"
+    model_name = GEMINI_MODEL
+    capabilities = OcrCapabilities(
+        max_concurrency=GEMINI_CONCURRENCY,
+        max_image_side=GEMINI_MAX_IMAGE_SIDE,
+        max_pixels=GEMINI_MAX_PIXELS,
+        image_format=GEMINI_IMAGE_FORMAT,
+        image_quality=GEMINI_IMAGE_QUALITY,
+        cost_per_page=GEMINI_COST_PER_PAGE,
+        local=False,
+    )
+    
+    def __init__(self, model_name: str = GEMINI_MODEL):
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+    
+    async def generate(self, prompt: str, image_bytes: bytes, width: int, height: int,
+                       max_tokens: Optional[int] = None) -> str:
+        """送出 prompt 與圖片（依檔頭判斷 MIME type）"""
         image_part = {
-            "mime_type": "image/png",
-            "data": image_data
+            "mime_type": image_mime(image_bytes),
+            "data": base64.b64encode(image_bytes).decode('utf-8')
         }
-        
-        try:
-            response = self.model.generate_content([prompt, image_part])
-            result_text = response.text.strip()
-            
-            # 解析 JSON（處理 markdown code block）
-            if result_text.startswith("```"):
-                result_text = result_text.split("```")[1]
-                if result_text.startswith("json"):
-                    result_text = result_text[4:]
-            result_text = result_text.strip()
-            
-            return json.loads(result_text)
-        except Exception as e:
-            logger.error(f"OCR Error: {e}", exc_info=True)
-            return {"texts": [], "error": str(e)}
+        response = await self._generate([prompt, image_part], estimate_tokens(prompt, width, height))
+        return response.text.strip()
+    
+    async def health(self) -> Dict:
+        """只檢查是否設定 API 金鑰（不呼叫 API，避免產生費用）"""
+        if not GEMINI_API_KEY:
+            return {"ok": False, "detail": "GEMINI_API_KEY 未設定"}
+        return {"ok": True, "detail": ""}
     
-    async def inpaint_background(self, image_bytes: bytes, text_regions: List[Dict]) -> bytes:
+    async def _generate(self, contents: list, tokens: int):
         """
-        使用 Gemini 描述背景，然後用簡單方法填補
-        （真正的 inpainting 需要用 Imagen 或其他圖像生成 API）
+        呼叫 generate_content，不阻塞 event loop
         
-        這裡用簡化方案：分析背景顏色，用純色填補文字區域
+        先向共用的速率限制取得額度（不足時排隊）；gRPC 使用 generate_content_async，
+        REST（自訂端點）在專用執行緒池呼叫。伺服器回報配額用盡時暫停限制器並重新排隊。
         """
-        from PIL import Image
-        import io
-        
-        # 開啟圖片
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        # 對每個文字區域進行填補
-        for region in text_regions:
-            x = int(region.get('x', 0))
-            y = int(region.get('y', 0))
-            w = int(region.get('width', 0))
-            h = int(region.get('height', 0))
-            
-            if w <= 0 or h <= 0:
+        from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+        
+        limiter = get_gemini_limiter()
+        for attempt in range(GEMINI_QUOTA_RETRIES + 1):
+            await limiter.acquire(tokens)
+            try:
+                if GEMINI_TRANSPORT == "rest":
+                    loop = asyncio.get_running_loop()
+                    response = await loop.run_in_executor(_get_thread_pool(), self.model.generate_content, contents)
+                else:
+                    response = await self.model.generate_content_async(contents)
+            except (ResourceExhausted, TooManyRequests):  # gRPC / REST 的 429
+                if attempt == GEMINI_QUOTA_RETRIES:
+                    raise
+                logger.warning(f"Gemini quota exhausted, pausing {GEMINI_QUOTA_PAUSE}s")
+                limiter.pause(GEMINI_QUOTA_PAUSE)
                 continue
             
-            # 取樣周圍像素來估計背景色
-            bg_color = self._sample_background_color(img, x, y, w, h)
-            
-            # 用背景色填補
-            for px in range(max(0, x), min(img.width, x + w)):
-                for py in range(max(0, y), min(img.height, y + h)):
-                    img.putpixel((px, py), bg_color)
-        
-        # 轉回 bytes
-        output = io.BytesIO()
-        img.save(output, format='PNG')
-        return output.getvalue()
-    
-    def _sample_background_color(self, img, x: int, y: int, w: int, h: int) -> tuple:
-        """從區域周圍取樣背景顏色"""
-        samples = []
-        
-        # 取樣區域上方
-        if y > 5:
-            for px in range(max(0, x), min(img.width, x + w), 10):
-                samples.append(img.getpixel((px, y - 5)))
-        
-        # 取樣區域下方
-        if y + h + 5 < img.height:
-            for px in range(max(0, x), min(img.width, x + w), 10):
-                samples.append(img.getpixel((px, y + h + 5)))
-        
-        # 取樣區域左側
-        if x > 5:
-            for py in range(max(0, y), min(img.height, y + h), 10):
-                samples.append(img.getpixel((x - 5, py)))
-        
-        # 取樣區域右側
-        if x + w + 5 < img.width:
-            for py in range(max(0, y), min(img.height, y + h), 10):
-                samples.append(img.getpixel((x + w + 5, py)))
-        
-        if not samples:
-            return (255, 255, 255)  # 預設白色
-        
-        # 計算平均顏色
-        if isinstance(samples[0], tuple):
-            r = sum(s[0] for s in samples) // len(samples)
-            g = sum(s[1] for s in samples) // len(samples)
-            b = sum(s[2] for s in samples) // len(samples)
-            return (r, g, b)
-        else:
-            return (255, 255, 255)
-    
-    async def analyze_slide(self, image_bytes: bytes) -> Dict:
-        """
-        分析投影片，判斷是否為 NotebookLM 生成、是否有浮水印等
-        """
-        prompt = """分析這張投影片圖片，請判斷：
-
-1. is_notebooklm: 是否像是 NotebookLM/Nano Banana Pro 生成的（布局、風格判斷）
-2. has_watermark: 是否有右下角的星星浮水印
-3. background_type: 背景類型（"solid", "gradient", "image", "pattern"）
-4. dominant_colors: 主要顏色（hex 格式，最多 3 個）
-5. layout_type: 版面類型（"title", "content", "two_column", "image_heavy"）
-
-只輸出 JSON 格式：
-{"is_notebooklm": true/false, "has_watermark": true/false, "background_type": "...", "dominant_colors": [...], "layout_type": "..."}
-"""
-        
-        image_data = base64.b64encode(image_bytes).decode('utf-8')
-        image_part = {
-            "mime_type": "image/png",
-            "data": image_data
-        }
-        
-        try:
-            response = self.model.generate_content([prompt, image_part])
-            result_text = response.text.strip()
-            
-            if result_text.startswith("```"):
-                result_text = result_text.split("```")[1]
-                if result_text.startswith("json"):
-                    result_text = result_text[4:]
-            result_text = result_text.strip()
-            
-            return json.loads(result_text)
-        except Exception as e:
-            logger.error(f"Analyze Error: {e}", exc_info=True)
-            return {
-                "is_notebooklm": False,
-                "has_watermark": False,
-                "background_type": "unknown",
-                "dominant_colors": [],
-                "layout_type": "unknown",
-                "error": str(e)
-            }
+            usage = getattr(response, "usage_metadata", None)
+            limiter.settle(tokens, usage.total_token_count if usage else tokens)
+            return response
 
 
 # 測試函數
@@ -0,0 +1,103 @@
+"""OCR 圖片前處理 - 依後端能力縮小與重新編碼，結果座標換算回頁面圖片（模組層級函數，可於行程池執行）"""
+import io
+import math
+from typing import Dict, List, Tuple
+from PIL import Image
+
+# 有損格式的預設編碼品質（後端能力未指定時）
+JPEG_QUALITY = 90
+
+_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def target_size(width: int, height: int, max_side: int = 0, max_pixels: int = 0) -> Tuple[int, int]:
+    """
+    依最長邊上限與像素預算（寬 x 高）計算送出尺寸，維持長寬比、只縮小不放大（0 表示不限制）
+    """
+    ratio = 1.0
+    if max_side and max(width, height) > max_side:
+        ratio = max_side / max(width, height)
+    if max_pixels and width * height > max_pixels:
+        ratio = min(ratio, math.sqrt(max_pixels / (width * height)))
+    if ratio >= 1.0:
+        return width, height
+    return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+
+def needs_prep(width: int, height: int, max_side: int, image_format: str, max_pixels: int = 0) -> bool:
+    """頁面 PNG 是否需要縮小或轉換格式才能送給後端"""
+    return image_format != "PNG" or target_size(width, height, max_side, max_pixels) != (width, height)
+
+
+def prepare_ocr_image(image_bytes: bytes, max_side: int, image_format: str,
+                      max_pixels: int = 0, quality: int = 0) -> Tuple[bytes, int, int]:
+    """
+    將頁面 PNG 縮小到最長邊 max_side 與像素預算 max_pixels 內（0 不限制），並編碼為 image_format
+
+    - 縮小使用 reducing_gap：先以整數倍快速縮小，再以 LANCZOS 取樣，大圖快數倍且文字邊緣品質相近
+    - JPEG 不做色度抽樣（4:4:4），彩色細字較不易糊掉
+    - quality 為有損格式的品質（0 使用 JPEG_QUALITY）
+
+    Returns:
+        (圖片 bytes, 寬, 高)
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    return _fit_and_encode(img, max_side, image_format, max_pixels, quality)
+
+
+def prepare_ocr_tiles(image_bytes: bytes, tiles: List[Tuple[int, int, int, int]], max_side: int,
+                      image_format: str, max_pixels: int = 0, quality: int = 0) -> List[Tuple[bytes, int, int]]:
+    """
+    從頁面 PNG 裁出多個方塊（x, y, 寬, 高），各自依後端能力縮小與編碼（頁面只解碼一次）
+
+    Returns:
+        [(圖片 bytes, 寬, 高)]，順序與 tiles 相同
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    return [
+        _fit_and_encode(img.crop((x, y, x + w, y + h)), max_side, image_format, max_pixels, quality)
+        for x, y, w, h in tiles
+    ]
+
+
+def _fit_and_encode(img: Image.Image, max_side: int, image_format: str,
+                    max_pixels: int, quality: int) -> Tuple[bytes, int, int]:
+    size = target_size(img.width, img.height, max_side, max_pixels)
+    if size != img.size:
+        img = img.resize(size, Image.LANCZOS, reducing_gap=2.0)
+    if image_format in ("JPEG", "WEBP") and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    output = io.BytesIO()
+    quality = quality or JPEG_QUALITY
+    if image_format == "PNG":
+        img.save(output, format="PNG")
+    elif image_format == "JPEG":
+        img.save(output, format="JPEG", quality=quality, subsampling=0)
+    else:
+        img.save(output, format=image_format, quality=quality)
+    return output.getvalue(), img.width, img.height
+
+
+def scale_texts(texts: List[Dict], scale_x: float, scale_y: float) -> List[Dict]:
+    """將 OCR 結果的座標與字型大小換算回頁面圖片（scale = 頁面尺寸 / 送出尺寸）"""
+    scaled = []
+    for text in texts:
+        text = dict(text)
+        for key, scale in (("x", scale_x), ("width", scale_x), ("y", scale_y), ("height", scale_y)):
+            if isinstance(text.get(key), (int, float)):
+                text[key] = round(text[key] * scale)
+        if isinstance(text.get("font_size"), (int, float)):
+            text["font_size"] = round(text["font_size"] * scale_y, 1)
+        scaled.append(text)
+    return scaled
+
+
+def image_mime(image_bytes: bytes) -> str:
+    """依檔頭判斷圖片 MIME type"""
+    if image_bytes.startswith(b"\xff\xd8"):
+        return _MIME_TYPES["JPEG"]
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return _MIME_TYPES["WEBP"]
+    return _MIME_TYPES["PNG"]
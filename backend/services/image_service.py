@@ -0,0 +1,87 @@
+"""圖片處理函數 - 於行程池中執行（皆為模組層級函數，可被 pickle）"""
+import io
+from typing import Dict, List
+import numpy as np
+from PIL import Image
+
+from services.executor_service import PagePayload
+
+
+def encode_png(payload: PagePayload) -> bytes:
+    """將原始像素編碼為 PNG bytes"""
+    output = io.BytesIO()
+    payload.to_image().save(output, format='PNG')
+    return output.getvalue()
+
+
+def inpaint_regions(image_bytes: bytes, text_regions: List[Dict], remove_watermark: bool = False) -> bytes:
+    """
+    用背景色填補文字區域，返回 PNG bytes
+
+    分析區域周圍的背景顏色，以純色填補整個區域；remove_watermark 時在同一次
+    陣列填補中一併擦除右下角浮水印。沒有需要填補的區域時直接返回原圖。
+    """
+    from services.watermark_service import find_watermark
+
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    arr = np.array(img)
+    del img
+
+    regions = list(text_regions)
+    if remove_watermark:
+        mark = find_watermark(arr)
+        if mark:
+            regions.append(mark)
+
+    height, width = arr.shape[:2]
+    filled = False
+    for region in regions:
+        x = int(region.get('x', 0))
+        y = int(region.get('y', 0))
+        w = int(region.get('width', 0))
+        h = int(region.get('height', 0))
+
+        if w <= 0 or h <= 0:
+            continue
+
+        # 取樣周圍像素來估計背景色
+        bg_color = sample_background_color(arr, x, y, w, h)
+
+        # 用背景色填補（一次填滿整個矩形）
+        x0, y0, x1, y1 = max(0, x), max(0, y), min(width, x + w), min(height, y + h)
+        if x1 > x0 and y1 > y0:
+            arr[y0:y1, x0:x1] = bg_color
+            filled = True
+
+    if not filled:
+        return image_bytes
+    output = io.BytesIO()
+    Image.fromarray(arr).save(output, format='PNG')
+    return output.getvalue()
+
+
+def sample_background_color(arr: np.ndarray, x: int, y: int, w: int, h: int) -> tuple:
+    """從區域周圍取樣背景顏色（上下左右各距離 5px，每 10px 取一點）"""
+    height, width = arr.shape[:2]
+    cols = slice(max(0, x), min(width, x + w), 10)
+    rows = slice(max(0, y), min(height, y + h), 10)
+    samples = []
+
+    # 取樣區域上方、下方、左側、右側
+    if y > 5:
+        samples.append(arr[y - 5, cols])
+    if y + h + 5 < height:
+        samples.append(arr[y + h + 5, cols])
+    if x > 5:
+        samples.append(arr[rows, x - 5])
+    if x + w + 5 < width:
+        samples.append(arr[rows, x + w + 5])
+
+    samples = np.concatenate(samples) if samples else np.empty((0, 3))
+    if not len(samples):
+        return (255, 255, 255)  # 預設白色
+
+    # 計算平均顏色
+    return tuple(int(v) for v in samples.mean(axis=0))
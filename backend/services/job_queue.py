@@ -0,0 +1,327 @@
+"""任務佇列 - SQLite 持久化，供 API 與 worker 行程共用"""
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 佇列資料庫與結果目錄（多個 API / worker 行程共用同一路徑）
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "94repdf_jobs.db"))
+RESULT_DIR = os.getenv("RESULT_DIR", os.path.join(tempfile.gettempdir(), "94repdf_results"))
+
+# worker 超過此秒數沒有 heartbeat 視為當機，任務重新排入佇列
+HEARTBEAT_TIMEOUT = int(os.getenv("JOB_HEARTBEAT_TIMEOUT", "60"))
+# 每個任務最多嘗試次數（含當機後重試）
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# 任務結束（完成或失敗）後的保留時間（秒），到期後由背景清理刪除；排隊與處理中的任務不會到期
+TASK_TTL_SECONDS = int(os.getenv("TASK_TTL_SECONDS", "3600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    task_id      TEXT PRIMARY KEY,
+    status       TEXT NOT NULL,
+    params       TEXT NOT NULL DEFAULT '{}',
+    progress     TEXT NOT NULL DEFAULT '{}',
+    error        TEXT,
+    result_path  TEXT,
+    result_size  INTEGER NOT NULL DEFAULT 0,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    worker_id    TEXT,
+    heartbeat_at REAL,
+    created_at   REAL NOT NULL,
+    updated_at   REAL NOT NULL,
+    expires_at   REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+"""
+
+# 舊版資料庫補欄位（CREATE TABLE IF NOT EXISTS 不會新增欄位）
+_MIGRATIONS = {
+    "result_size": "ALTER TABLE jobs ADD COLUMN result_size INTEGER NOT NULL DEFAULT 0",
+    "expires_at": "ALTER TABLE jobs ADD COLUMN expires_at REAL NOT NULL DEFAULT 0",
+}
+
+# 到期索引：清理時只掃描已到期的範圍，不需全表掃描
+# job_events：逐頁步驟轉換，供 SSE 推送（seq 遞增，可從斷線處續傳）
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_jobs_expires ON jobs (expires_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id    TEXT NOT NULL,
+    event      TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_job_events_task ON job_events (task_id, seq);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id  TEXT PRIMARY KEY,
+    stats      TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def connect(db_path: str = JOB_DB_PATH) -> sqlite3.Connection:
+    """開啟共用資料庫連線（autocommit，交易以 BEGIN 明確開始；WAL 供多行程同時讀寫）"""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def init_schema(conn: sqlite3.Connection) -> None:
+    """建立任務相關資料表並補上舊版缺少的欄位（上傳儲存也會查詢 jobs，同樣先呼叫）"""
+    conn.executescript(_SCHEMA)
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    for column, statement in _MIGRATIONS.items():
+        if column not in columns:
+            conn.execute(statement)
+    conn.executescript(_INDEXES)
+
+
+class JobQueue:
+    """SQLite 任務佇列：排入、領取、heartbeat、進度與結果"""
+
+    def __init__(self, db_path: str = JOB_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        os.makedirs(RESULT_DIR, exist_ok=True)
+        init_schema(self._conn())
+
+    def _conn(self) -> sqlite3.Connection:
+        """每個執行緒一個連線（autocommit，交易以 BEGIN 明確開始）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.db_path)
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, task_id: str, params: Dict, progress: Optional[Dict] = None) -> None:
+        """排入待處理任務"""
+        self.create(task_id, "pending", progress or {}, params)
+
+    def create(self, task_id: str, status: str, progress: Dict, params: Optional[Dict] = None) -> None:
+        """建立任務記錄"""
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (task_id, status, params, progress, created_at, updated_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (task_id, status, json.dumps(params or {}), json.dumps(progress), now, now, now + TASK_TTL_SECONDS)
+        )
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """領取最早的待處理任務（原子操作），沒有則返回 None"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT task_id, params, attempts FROM jobs WHERE status = 'pending' "
+                "ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'processing', worker_id = ?, attempts = attempts + 1, "
+                "heartbeat_at = ?, updated_at = ? WHERE task_id = ?",
+                (worker_id, now, now, row["task_id"])
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return {
+            "task_id": row["task_id"],
+            "params": json.loads(row["params"]),
+            "attempts": row["attempts"] + 1,
+        }
+
+    def heartbeat(self, worker_id: str, task_ids: List[str]) -> None:
+        """更新 worker 正在處理的任務 heartbeat"""
+        if not task_ids:
+            return
+        now = time.time()
+        marks = ",".join("?" * len(task_ids))
+        self._conn().execute(
+            f"UPDATE jobs SET heartbeat_at = ? WHERE worker_id = ? AND status = 'processing' "
+            f"AND task_id IN ({marks})",
+            (now, worker_id, *task_ids)
+        )
+
+    def update_progress(self, task_id: str, progress: Dict, status: Optional[str] = None) -> None:
+        """寫入進度（可同時更新狀態）"""
+        now = time.time()
+        if status:
+            self._conn().execute(
+                "UPDATE jobs SET progress = ?, status = ?, updated_at = ? WHERE task_id = ?",
+                (json.dumps(progress), status, now, task_id)
+            )
+        else:
+            self._conn().execute(
+                "UPDATE jobs SET progress = ?, updated_at = ? WHERE task_id = ?",
+                (json.dumps(progress), now, task_id)
+            )
+
+    def add_events(self, task_id: str, events: List[Dict]) -> None:
+        """寫入步驟事件（批次）"""
+        if not events:
+            return
+        now = time.time()
+        self._conn().executemany(
+            "INSERT INTO job_events (task_id, event, created_at) VALUES (?, ?, ?)",
+            [(task_id, json.dumps(event), now) for event in events]
+        )
+
+    def get_events(self, task_id: str, after_seq: int = 0) -> List[Dict]:
+        """讀取 after_seq 之後的步驟事件"""
+        rows = self._conn().execute(
+            "SELECT seq, event FROM job_events WHERE task_id = ? AND seq > ? ORDER BY seq",
+            (task_id, after_seq)
+        ).fetchall()
+        return [{"seq": row["seq"], **json.loads(row["event"])} for row in rows]
+
+    def complete(self, task_id: str, result_path: str, progress: Dict, result_size: int = 0) -> None:
+        """標記完成並記錄結果檔案位置（保留期限從完成時起算）"""
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET status = 'done', result_path = ?, result_size = ?, progress = ?, "
+            "worker_id = NULL, updated_at = ?, expires_at = ? WHERE task_id = ?",
+            (result_path, result_size, json.dumps(progress), now, now + TASK_TTL_SECONDS, task_id)
+        )
+
+    def fail(self, task_id: str, error: str, progress: Optional[Dict] = None) -> None:
+        """標記失敗（保留期限從失敗時起算）"""
+        now = time.time()
+        if progress is None:
+            self._conn().execute(
+                "UPDATE jobs SET status = 'failed', error = ?, worker_id = NULL, updated_at = ?, "
+                "expires_at = ? WHERE task_id = ?",
+                (error, now, now + TASK_TTL_SECONDS, task_id)
+            )
+        else:
+            self._conn().execute(
+                "UPDATE jobs SET status = 'failed', error = ?, progress = ?, worker_id = NULL, "
+                "updated_at = ?, expires_at = ? WHERE task_id = ?",
+                (error, json.dumps(progress), now, now + TASK_TTL_SECONDS, task_id)
+            )
+
+    def release(self, task_id: str, worker_id: str) -> None:
+        """worker 正常關閉時歸還任務（不計入嘗試次數）"""
+        self._conn().execute(
+            "UPDATE jobs SET status = 'pending', worker_id = NULL, attempts = MAX(0, attempts - 1), "
+            "updated_at = ? WHERE task_id = ? AND worker_id = ? AND status = 'processing'",
+            (time.time(), task_id, worker_id)
+        )
+
+    def requeue_stale(self) -> int:
+        """將 heartbeat 逾時的任務重新排入佇列，超過嘗試次數則標記失敗"""
+        conn = self._conn()
+        now = time.time()
+        deadline = now - HEARTBEAT_TIMEOUT
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            failed = conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, worker_id = NULL, updated_at = ?, expires_at = ? "
+                "WHERE status = 'processing' AND heartbeat_at < ? AND attempts >= ?",
+                ("Worker 中斷次數過多", now, now + TASK_TTL_SECONDS, deadline, MAX_ATTEMPTS)
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'pending', worker_id = NULL, updated_at = ? "
+                "WHERE status = 'processing' AND heartbeat_at < ?",
+                (now, deadline)
+            ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if requeued or failed:
+            logger.warning(f"Stale jobs: {requeued} requeued, {failed} failed")
+        return requeued
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        """查詢任務"""
+        row = self._conn().execute(
+            "SELECT task_id, status, progress, error, result_path, attempts, created_at, updated_at "
+            "FROM jobs WHERE task_id = ?",
+            (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["progress"] = json.loads(job["progress"])
+        return job
+
+    def delete_expired(self, batch_size: int = 500) -> List[Dict]:
+        """
+        刪除已到期且已結束（done / failed）的任務
+        （依 expires_at 索引做範圍查詢，成本與到期數量成正比；排隊中的任務不會被刪除）
+        
+        Returns:
+            被刪除的任務 [{task_id, result_path}]，由呼叫端清理結果檔案
+        """
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT task_id, result_path FROM jobs WHERE expires_at < ? AND status IN ('done', 'failed') "
+            "ORDER BY expires_at LIMIT ?",
+            (time.time(), batch_size)
+        ).fetchall()
+        if rows:
+            ids = [(row["task_id"],) for row in rows]
+            conn.executemany("DELETE FROM jobs WHERE task_id = ?", ids)
+            conn.executemany("DELETE FROM job_events WHERE task_id = ?", ids)
+        return [dict(row) for row in rows]
+
+    def report_worker(self, worker_id: str, stats: Dict) -> None:
+        """worker 隨 heartbeat 回報行程內狀態（速率限制等），供 API 行程查詢"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO workers (worker_id, stats, updated_at) VALUES (?, ?, ?)",
+            (worker_id, json.dumps(stats), now)
+        )
+        conn.execute("DELETE FROM workers WHERE updated_at < ?", (now - HEARTBEAT_TIMEOUT,))
+
+    def remove_worker(self, worker_id: str) -> None:
+        self._conn().execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    def worker_stats(self) -> Dict[str, Dict]:
+        """仍在 heartbeat 的 worker 最近回報的狀態"""
+        rows = self._conn().execute(
+            "SELECT worker_id, stats FROM workers WHERE updated_at >= ? ORDER BY worker_id",
+            (time.time() - HEARTBEAT_TIMEOUT,)
+        ).fetchall()
+        return {row["worker_id"]: json.loads(row["stats"]) for row in rows}
+
+    def stats(self) -> Dict:
+        """任務數量（依狀態）與結果檔案總大小"""
+        conn = self._conn()
+        counts = {
+            row["status"]: row["n"]
+            for row in conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        }
+        result_bytes = conn.execute(
+            "SELECT COALESCE(SUM(result_size), 0) FROM jobs WHERE status = 'done'"
+        ).fetchone()[0]
+        return {
+            "tasks": sum(counts.values()),
+            "by_status": counts,
+            "result_bytes": result_bytes,
+        }
+
+
+_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """取得行程內共用的 JobQueue"""
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
@@ -0,0 +1,106 @@
+"""串流 JSON 掃描 - 逐段讀取模型輸出，追蹤巢狀層級，取出已完成的文字區塊並偵測最外層物件結束"""
+import json
+from typing import Dict, List, Optional
+
+
+class JsonStreamScanner:
+    """
+    增量掃描模型輸出的 JSON（如 {"texts": [{...}, {...}]}）
+
+    - 第一個 { 之前的文字（markdown code block 開頭、思考標籤等）略過
+    - 最外層容器內的陣列元素物件（文字區塊）一結束就解析，加入 blocks
+    - 最外層物件結束時 complete 為 True，之後的輸出可以捨棄
+    """
+
+    def __init__(self):
+        self._text: List[str] = []
+        self._length = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._start = -1
+        self._end = -1
+        self._block_start = -1
+        self.blocks: List[Dict] = []
+
+    @property
+    def complete(self) -> bool:
+        return self._end >= 0
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """加入一段輸出，返回這段輸出中完成的文字區塊"""
+        if self.complete or not chunk:
+            return []
+        offset = self._length
+        self._text.append(chunk)
+        self._length += len(chunk)
+        new_blocks = []
+
+        for i, char in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if self._start < 0:
+                if char == "{":
+                    self._start = offset + i
+                    self._depth = 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                # 最外層物件 → 陣列 → 區塊物件
+                if char == "{" and self._depth == 2:
+                    self._block_start = offset + i
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if char == "}" and self._depth == 2 and self._block_start >= 0:
+                    block = self._parse(self._block_start, offset + i + 1)
+                    self._block_start = -1
+                    if block is not None:
+                        self.blocks.append(block)
+                        new_blocks.append(block)
+                elif self._depth == 0:
+                    self._end = offset + i + 1
+                    break
+        return new_blocks
+
+    def document(self) -> Optional[str]:
+        """最外層物件的完整文字（尚未結束時為 None）"""
+        if not self.complete:
+            return None
+        return self.text()[self._start:self._end]
+
+    def text(self) -> str:
+        """目前收到的所有輸出"""
+        if len(self._text) > 1:
+            self._text = ["".join(self._text)]
+        return self._text[0] if self._text else ""
+
+    def repeating(self, limit: int) -> bool:
+        """最後 limit 個區塊完全相同（模型陷入重複輸出）"""
+        if limit <= 1 or len(self.blocks) < limit:
+            return False
+        last = self.blocks[-1]
+        return all(block == last for block in self.blocks[-limit:])
+
+    def salvage(self) -> str:
+        """輸出未正常結束（截斷或重複）時，以已完成且不重複的區塊組成結果"""
+        unique = []
+        for block in self.blocks:
+            if block not in unique:
+                unique.append(block)
+        return json.dumps({"texts": unique}, ensure_ascii=False)
+
+    def _parse(self, start: int, end: int) -> Optional[Dict]:
+        try:
+            block = json.loads(self.text()[start:end])
+        except json.JSONDecodeError:
+            return None
+        return block if isinstance(block, dict) else None
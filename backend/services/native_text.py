@@ -0,0 +1,229 @@
+"""
+原生文字擷取 - 有文字層的頁面直接從 PDF 取得文字、位置、字型大小與顏色
+
+輸出與 OCR 相同的 texts 結構（座標為頁面圖片的像素），這些頁面不需要呼叫視覺模型。
+"""
+import math
+import threading
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 寬度估計：全形字約 1 em，其餘約 0.55 em
+_WIDE_CHAR_START = 0x2E80
+_NARROW_EM = 0.55
+# 行高（相對字型大小）
+_LINE_HEIGHT = 1.2
+# 同一行的文字片段合併條件：基線差距與水平間距（相對字型大小）
+_BASELINE_TOLERANCE = 0.3
+_MERGE_GAP = 1.0
+# 片段間距超過此值（相對字型大小）才視為字詞間的空格；pypdf 常把同一個字拆成多個片段
+_WORD_GAP = 0.2
+
+
+class NativeTextExtractor:
+    """
+    以同一個 PdfReader 擷取多頁文字（任務期間開啟一次）
+
+    pypdf 的 reader 不是執行緒安全，擷取時以 lock 保護
+    """
+
+    def __init__(self, path: str, meta: Dict, slide_height: Optional[float] = None):
+        """
+        Args:
+            path: PDF 檔案路徑
+            meta: 上傳時建立的中繼資料（判斷哪些頁面有文字層）
+            slide_height: 投影片高度（points），字型大小依頁面高度等比換算；None 表示不換算
+        """
+        from services.pdf_service import open_pdf
+
+        self.meta = meta
+        self.slide_height = slide_height
+        self._lock = threading.Lock()
+        self._context = open_pdf(path)
+        self._reader = self._context.__enter__()
+
+    def close(self) -> None:
+        self._context.__exit__(None, None, None)
+
+    def texts(self, page_number: int, width: int, height: int) -> Optional[List[Dict]]:
+        """
+        擷取頁面文字（頁碼從 1 開始），width / height 為頁面圖片的像素尺寸
+
+        Returns:
+            texts 列表；頁面沒有文字層或無法可靠擷取（旋轉頁面）時返回 None，改走 OCR
+        """
+        from services.text_layer import page_has_text
+
+        info = self.meta["pages"][page_number - 1]
+        if info["rotation"]:
+            return None
+
+        with self._lock:
+            page = self._reader.pages[page_number - 1]
+            has_text = info["has_text"]
+            if has_text is None:
+                # 抽樣模式下未偵測過的頁面
+                has_text = page_has_text(page)
+            if not has_text:
+                return None
+            runs = _collect_runs(page)
+
+        x0, y0, x1, y1 = info["mediabox"]
+        scale_x = width / (x1 - x0)
+        scale_y = height / (y1 - y0)
+        # 背景圖片會拉伸填滿投影片，字型大小依相同比例換算
+        font_scale = self.slide_height / (y1 - y0) if self.slide_height else 1.0
+
+        texts = []
+        for run in _merge_lines(runs):
+            size = run["size"]
+            top = y1 - (run["y"] + size)
+            texts.append({
+                "content": run["content"],
+                "x": round((run["x"] - x0) * scale_x),
+                "y": round(top * scale_y),
+                "width": max(1, round(run["width"] * scale_x)),
+                "height": max(1, round(size * _LINE_HEIGHT * scale_y)),
+                "font_size": round(size * font_scale, 1),
+                "font_weight": "bold" if run["bold"] else "normal",
+                "color": run["color"],
+                "confidence": 1.0,
+            })
+        return texts
+
+
+def _collect_runs(page) -> List[Dict]:
+    """以 pypdf visitor 收集文字片段（頁面座標，原點在左下）"""
+    runs: List[Dict] = []
+    # 填色狀態（q / Q 會保存與還原）
+    state = {"color": "#000000"}
+    stack: List[str] = []
+
+    def before(op: bytes, args: list, cm: list, tm: list) -> None:
+        if op == b"q":
+            stack.append(state["color"])
+        elif op == b"Q" and stack:
+            state["color"] = stack.pop()
+        elif op in (b"rg", b"g", b"k", b"sc", b"scn"):
+            color = _fill_color(args)
+            if color:
+                state["color"] = color
+
+    def visit(text: str, cm: list, tm: list, font: Optional[Dict], font_size: float) -> None:
+        content = text.strip()
+        if not content:
+            return
+        m = _multiply(tm, cm)
+        # 有效字型大小 = Tf 大小 × 文字矩陣與 CTM 的垂直縮放
+        size = font_size * math.hypot(m[2], m[3])
+        if size <= 0:
+            return
+        runs.append({
+            "content": content,
+            # 原始片段前後的空白（strip 後保留為合併時的分隔依據）
+            "space_before": text[:1].isspace(),
+            "space_after": text[-1:].isspace(),
+            "x": m[4],
+            "y": m[5],
+            "size": size,
+            "width": _estimate_width(content, size),
+            "bold": _is_bold(font),
+            "color": state["color"],
+        })
+
+    page.extract_text(visitor_text=visit, visitor_operand_before=before)
+    return runs
+
+
+def _merge_lines(runs: List[Dict]) -> List[Dict]:
+    """合併同一行、樣式相同且相鄰的片段"""
+    merged: List[Dict] = []
+    for run in runs:
+        last = merged[-1] if merged else None
+        if (
+            last
+            and abs(last["y"] - run["y"]) <= _BASELINE_TOLERANCE * run["size"]
+            and abs(last["size"] - run["size"]) < 0.5
+            and last["bold"] == run["bold"]
+            and last["color"] == run["color"]
+            and 0 <= run["x"] - (last["x"] + last["width"]) <= _MERGE_GAP * run["size"]
+        ):
+            last["content"] += _separator(last, run) + run["content"]
+            last["width"] = run["x"] + run["width"] - last["x"]
+            last["space_after"] = run["space_after"]
+        else:
+            merged.append(dict(run))
+    return merged
+
+
+def _separator(left: Dict, right: Dict) -> str:
+    """
+    相鄰片段之間的分隔：CJK 字元之間不加空格；其餘只在原文有空白、
+    或間距明顯大於字距（_WORD_GAP em）時加空格，避免拆開同一個英文字
+    """
+    if _is_wide(left["content"][-1]) and _is_wide(right["content"][0]):
+        return ""
+    gap = right["x"] - (left["x"] + left["width"])
+    if left["space_after"] or right["space_before"] or gap > _WORD_GAP * right["size"]:
+        return " "
+    return ""
+
+
+def _is_wide(ch: str) -> bool:
+    """全形字（CJK 等）"""
+    return ord(ch) >= _WIDE_CHAR_START
+
+
+def _multiply(a: list, b: list) -> list:
+    """3x3 仿射矩陣相乘（PDF 的 6 元素表示）"""
+    return [
+        a[0] * b[0] + a[1] * b[2],
+        a[0] * b[1] + a[1] * b[3],
+        a[2] * b[0] + a[3] * b[2],
+        a[2] * b[1] + a[3] * b[3],
+        a[4] * b[0] + a[5] * b[2] + b[4],
+        a[4] * b[1] + a[5] * b[3] + b[5],
+    ]
+
+
+def _estimate_width(content: str, size: float) -> float:
+    """依字元寬度估計文字寬度（points）"""
+    ems = sum(1.0 if _is_wide(ch) else _NARROW_EM for ch in content)
+    return ems * size
+
+
+def _is_bold(font: Optional[Dict]) -> bool:
+    """由字型名稱或 FontDescriptor 判斷粗體"""
+    if not font:
+        return False
+    name = str(font.get("/BaseFont", "")).lower()
+    if any(word in name for word in ("bold", "black", "heavy", "semibold")):
+        return True
+    try:
+        descriptor = font.get("/FontDescriptor")
+        if descriptor:
+            weight = descriptor.get_object().get("/FontWeight")
+            return bool(weight and float(weight) >= 600)
+    except Exception:
+        pass
+    return False
+
+
+def _fill_color(args: list) -> Optional[str]:
+    """將填色運算元（灰階 / RGB / CMYK）轉為 hex"""
+    try:
+        values = [float(v) for v in args]
+    except (TypeError, ValueError):
+        return None  # 圖樣（pattern）等非數值色彩
+    if len(values) == 1:
+        r = g = b = values[0]
+    elif len(values) == 3:
+        r, g, b = values
+    elif len(values) == 4:
+        c, m, y, k = values
+        r, g, b = (1 - c) * (1 - k), (1 - m) * (1 - k), (1 - y) * (1 - k)
+    else:
+        return None
+    return "#{:02x}{:02x}{:02x}".format(*(max(0, min(255, round(v * 255))) for v in (r, g, b)))
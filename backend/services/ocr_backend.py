@@ -0,0 +1,305 @@
+"""
+OCR 後端介面與註冊表
+
+每個後端繼承 OcrBackend，只需實作 generate()（送出 prompt 與圖片、返回模型文字輸出），
+並以 capabilities 宣告並行上限、批次、圖片尺寸與編碼、每頁成本；
+prompt、JSON 解析與背景填補由基底類別共用。
+
+新增後端只需註冊（register_backend，或環境變數 OCR_BACKENDS="名稱=模組:類別,..."），
+處理 API 與管線依名稱取得後端，不需修改。
+"""
+import io
+import os
+import abc
+import json
+import asyncio
+import inspect
+import importlib
+import logging
+from contextvars import ContextVar
+from typing import Dict, List, NamedTuple, Optional, Tuple, Type, Union
+
+logger = logging.getLogger(__name__)
+
+# OCR prompt 或輸出格式變更時遞增，使快取失效
+PROMPT_VERSION = "2"
+# 預設後端（use_local 對應）
+DEFAULT_LOCAL_BACKEND = "ollama"
+DEFAULT_CLOUD_BACKEND = "gemini"
+
+
+# 目前任務的生成統計（管線設定，後端以 record_generation() 累加；未設定時不記錄）
+generation_stats: ContextVar[Optional[Dict]] = ContextVar("generation_stats", default=None)
+
+
+def record_generation(tokens: int, seconds: float, early_stop: bool = False) -> None:
+    """累加一次生成的輸出 token 數與解碼秒數（任務進度的 tokens/s 用）"""
+    stats = generation_stats.get()
+    if stats is None:
+        return
+    stats["tokens"] = stats.get("tokens", 0) + tokens
+    stats["seconds"] = stats.get("seconds", 0.0) + seconds
+    if early_stop:
+        stats["early_stops"] = stats.get("early_stops", 0) + 1
+
+
+class OcrResponseError(Exception):
+    """模型輸出無法解析（重試可能成功，但不代表後端故障）"""
+    retryable = True
+
+
+class OcrCapabilities(NamedTuple):
+    """後端能力，管線依此決定並行數、批次與圖片前處理"""
+    max_concurrency: int = 1      # 每個行程同時進行中的請求上限
+    batch_size: int = 1           # 一次請求可處理的頁數（1 表示不支援批次）
+    max_image_side: int = 0       # 送出圖片的最長邊上限（px，0 不限制）
+    max_pixels: int = 0           # 送出圖片的像素預算（寬 x 高，0 不限制）
+    image_format: str = "PNG"     # 偏好的圖片編碼（PNG / JPEG / WEBP）
+    image_quality: int = 0        # 有損編碼品質（0 使用預設）
+    cost_per_page: float = 0.0    # 每頁預估費用（USD）
+    local: bool = True            # 是否在本機執行（進度中的 mode）
+
+    def to_dict(self) -> Dict:
+        return self._asdict()
+
+
+def build_ocr_prompt(width: int, height: int) -> str:
+    """OCR prompt（所有後端共用）"""
+    return f"""分析這張投影片圖片，辨識所有文字。
+
+對每個文字區塊，輸出：
+- content: 文字內容
+- x, y: 左上角座標（像素，圖片尺寸 {width}x{height}）
+- width, height: 區塊尺寸（像素）
+- font_size: 字體大小估計
+- font_weight: "bold" 或 "normal"
+- color: 顏色 hex 格式（如 #333333）
+- confidence: 辨識信心度（0-1）
+
+確保座標位置精確，只輸出 JSON，格式：{{"texts": [...]}}
+"""
+
+
+ANALYZE_PROMPT = """分析這張投影片圖片，請判斷：
+
+1. is_notebooklm: 是否像是 NotebookLM/Nano Banana Pro 生成的（布局、風格判斷）
+2. has_watermark: 是否有右下角的星星浮水印
+3. background_type: 背景類型（"solid", "gradient", "image", "pattern"）
+4. dominant_colors: 主要顏色（hex 格式，最多 3 個）
+5. layout_type: 版面類型（"title", "content", "two_column", "image_heavy"）
+
+只輸出 JSON 格式：
+{"is_notebooklm": true/false, "has_watermark": true/false, "background_type": "...", "dominant_colors": [...], "layout_type": "..."}
+"""
+
+
+def parse_json_response(text: str) -> Dict:
+    """
+    解析模型輸出的 JSON（處理 markdown code block 與前後多餘文字）
+
+    Raises:
+        json.JSONDecodeError: 無法解析
+    """
+    text = text.strip()
+    if "```" in text:
+        for part in text.split("```"):
+            part = part.strip()
+            if part.startswith("json"):
+                part = part[4:].strip()
+            if part.startswith("{"):
+                text = part
+                break
+
+    start = text.find("{")
+    end = text.rfind("}") + 1
+    if start >= 0 and end > start:
+        text = text[start:end]
+    return json.loads(text)
+
+
+class OcrBackend(abc.ABC):
+    """OCR 後端基底類別（未實作 generate() 的子類別無法註冊或建立實例）"""
+
+    name: str = ""
+    model_name: str = ""
+    prompt_version: str = PROMPT_VERSION
+    capabilities: OcrCapabilities = OcrCapabilities()
+    # 加在 prompt 結尾的後端專用指示（例如關閉思考模式）
+    prompt_suffix: str = ""
+    # OCR 輸出 token 上限
+    max_output_tokens: int = 4096
+
+    @property
+    def fingerprint(self) -> str:
+        """後端、模型、prompt 版本與送出圖片設定（快取 key 用）"""
+        caps = self.capabilities
+        return (f"{self.name}:{self.model_name}:{self.prompt_version}:"
+                f"{caps.max_image_side}:{caps.max_pixels}:{caps.image_format}:{caps.image_quality}")
+
+    @abc.abstractmethod
+    async def generate(self, prompt: str, image_bytes: bytes, width: int, height: int,
+                       max_tokens: Optional[int] = None) -> str:
+        """送出 prompt 與一張圖片，返回模型的文字輸出（各後端實作）"""
+
+    async def health(self) -> Dict:
+        """後端是否可用：{"ok": bool, "detail": str}"""
+        return {"ok": True, "detail": ""}
+
+    async def close(self) -> None:
+        """釋放後端資源（共用連線由應用程式生命週期管理）"""
+
+    async def recognize(self, image_bytes: bytes, width: int, height: int) -> Dict:
+        """
+        OCR 辨識圖片中的文字，失敗時拋出例外（由管線重試或切換後端）
+
+        Returns:
+            {
+                "texts": [
+                    {
+                        "content": "文字內容",
+                        "x": 100, "y": 50,
+                        "width": 400, "height": 60,
+                        "font_size": 36,
+                        "font_weight": "bold",
+                        "color": "#333333",
+                        "confidence": 0.95
+                    }
+                ]
+            }
+        Raises:
+            OcrResponseError: 模型輸出無法解析
+        """
+        prompt = build_ocr_prompt(width, height) + self.prompt_suffix
+        result_text = await self.generate(prompt, image_bytes, width, height, self.max_output_tokens)
+        try:
+            return parse_json_response(result_text)
+        except json.JSONDecodeError as e:
+            logger.debug(f"Raw response: {result_text[:500]}")
+            raise OcrResponseError(f"JSON parse error: {str(e)}") from e
+
+    async def ocr_image(self, image_bytes: bytes, width: int, height: int) -> Dict:
+        """同 recognize()，但失敗時返回 {"texts": [], "error": ...}（不重試，單次呼叫用）"""
+        try:
+            return await self.recognize(image_bytes, width, height)
+        except Exception as e:
+            logger.error(f"{self.name} OCR Error: {e}")
+            return {"texts": [], "error": str(e)}
+
+    async def ocr_batch(self, images: List[Tuple[bytes, int, int]]) -> List[Dict]:
+        """批次 OCR，任一頁失敗即拋出例外（支援批次的後端覆寫為單次請求；預設逐頁並行）"""
+        return list(await asyncio.gather(*(self.recognize(*image) for image in images)))
+
+    async def analyze_slide(self, image_bytes: bytes) -> Dict:
+        """分析投影片，判斷是否為 NotebookLM 生成、是否有浮水印等"""
+        from PIL import Image
+
+        try:
+            # 只讀取檔頭取得尺寸
+            width, height = Image.open(io.BytesIO(image_bytes)).size
+            result_text = await self.generate(ANALYZE_PROMPT + self.prompt_suffix, image_bytes, width, height)
+            return parse_json_response(result_text)
+        except Exception as e:
+            logger.error(f"{self.name} Analyze Error: {e}")
+            return {
+                "is_notebooklm": False,
+                "has_watermark": False,
+                "background_type": "unknown",
+                "dominant_colors": [],
+                "layout_type": "unknown",
+                "error": str(e)
+            }
+
+    async def inpaint_background(self, image_bytes: bytes, text_regions: List[Dict],
+                                 remove_watermark: bool = False) -> bytes:
+        """
+        用背景色填補文字區域（於行程池執行）；remove_watermark 時一併擦除本地偵測到的右下角浮水印
+        """
+        from services.executor_service import run_cpu
+        from services.image_service import inpaint_regions
+
+        return await run_cpu(inpaint_regions, image_bytes, text_regions, remove_watermark)
+
+
+# 名稱 → 類別或 "模組:類別"（延遲匯入，未使用的後端不載入其相依套件）
+_registry: Dict[str, Union[str, Type[OcrBackend]]] = {
+    "ollama": "services.ollama_service:OllamaService",
+    "gemini": "services.gemini_service:GeminiService",
+}
+_instances: Dict[str, OcrBackend] = {}
+
+
+def register_backend(name: str, backend: Union[str, Type[OcrBackend]]) -> None:
+    """
+    註冊後端（類別或 "模組:類別" 字串），同名時取代
+
+    Raises:
+        TypeError: 類別仍有未實作的抽象方法（字串在第一次取得類別時檢查）
+    """
+    if not isinstance(backend, str):
+        _check_backend_class(name, backend)
+    _registry[name] = backend
+    _instances.pop(name, None)
+
+
+def _register_from_env() -> None:
+    for entry in os.getenv("OCR_BACKENDS", "").split(","):
+        if "=" in entry:
+            name, target = entry.split("=", 1)
+            register_backend(name.strip(), target.strip())
+
+
+_register_from_env()
+
+
+def backend_names() -> List[str]:
+    return list(_registry)
+
+
+def resolve_backend_name(name: Optional[str] = None, use_local: bool = True) -> str:
+    """
+    請求參數對應的後端名稱（未指定名稱時依 use_local 選預設後端）
+
+    Raises:
+        KeyError: 沒有這個後端
+    """
+    name = name or (DEFAULT_LOCAL_BACKEND if use_local else DEFAULT_CLOUD_BACKEND)
+    if name not in _registry:
+        raise KeyError(name)
+    return name
+
+
+def get_backend_class(name: str) -> Type[OcrBackend]:
+    """取得後端類別（不建立實例，讀取 capabilities 等類別屬性用）"""
+    target = _registry[name]
+    if isinstance(target, str):
+        module_name, class_name = target.split(":")
+        target = getattr(importlib.import_module(module_name), class_name)
+        _check_backend_class(name, target)
+        _registry[name] = target
+    return target
+
+
+def _check_backend_class(name: str, backend: Type[OcrBackend]) -> None:
+    if inspect.isabstract(backend):
+        missing = ", ".join(sorted(backend.__abstractmethods__))
+        raise TypeError(f"OCR backend {name!r} ({backend.__name__}) does not implement: {missing}")
+
+
+def get_backend(name: str) -> OcrBackend:
+    """取得行程內共用的後端實例"""
+    if name not in _instances:
+        _instances[name] = get_backend_class(name)()
+    return _instances[name]
+
+
+async def check_backends() -> List[Dict]:
+    """所有後端的能力與健康狀態"""
+    async def check(name: str) -> Dict:
+        try:
+            backend = get_backend(name)
+            health = await backend.health()
+        except Exception as e:
+            return {"name": name, "ok": False, "detail": str(e), "capabilities": None}
+        return {"name": name, **health, "capabilities": backend.capabilities.to_dict()}
+
+    return list(await asyncio.gather(*(check(name) for name in backend_names())))
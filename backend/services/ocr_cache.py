@@ -0,0 +1,71 @@
+"""逐頁 OCR 結果快取 - 相同頁面圖片不重複呼叫視覺模型"""
+import os
+import json
+import hashlib
+import tempfile
+import logging
+from typing import Dict, Optional
+
+from services.cache_service import TieredCache
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_DIR = os.getenv(
+    "OCR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "94repdf_cache", "ocr")
+)
+OCR_CACHE_MEMORY_MB = int(os.getenv("OCR_CACHE_MEMORY_MB", "16"))
+OCR_CACHE_DISK_MB = int(os.getenv("OCR_CACHE_DISK_MB", "256"))
+OCR_CACHE_MAX_AGE = int(os.getenv("OCR_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+
+
+def ocr_cache_key(image_bytes: bytes, ocr_service, variant: str = "") -> str:
+    """頁面圖片 hash + 後端、模型、prompt 版本與送出圖片設定（variant 區分分塊等辨識方式）"""
+    h = hashlib.sha256(image_bytes)
+    h.update(ocr_service.fingerprint.encode())
+    if variant:
+        h.update(variant.encode())
+    return h.hexdigest()
+
+
+class OcrCache:
+    """以 JSON 儲存 {"texts": [...]}，格式與 OCR 服務回傳相同"""
+
+    def __init__(self):
+        self.cache = TieredCache(
+            "ocr",
+            OCR_CACHE_DIR,
+            memory_budget=OCR_CACHE_MEMORY_MB * 1024 * 1024,
+            disk_budget=OCR_CACHE_DISK_MB * 1024 * 1024,
+            max_age=OCR_CACHE_MAX_AGE,
+            suffix=".json",
+        )
+
+    def get(self, key: str) -> Optional[Dict]:
+        data = self.cache.get(key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            logger.warning(f"Invalid OCR cache entry: {key}")
+            return None
+
+    def put(self, key: str, result: Dict) -> None:
+        """只快取成功的結果"""
+        if result.get("error"):
+            return
+        self.cache.put(key, json.dumps({"texts": result.get("texts", [])}, ensure_ascii=False).encode())
+
+    def stats(self) -> Dict:
+        return self.cache.stats()
+
+
+_cache: Optional[OcrCache] = None
+
+
+def get_ocr_cache() -> OcrCache:
+    """取得行程內共用的 OCR 快取"""
+    global _cache
+    if _cache is None:
+        _cache = OcrCache()
+    return _cache
@@ -0,0 +1,227 @@
+"""
+分塊 OCR - 將高解析度頁面切成重疊方塊分別辨識，再把各塊的文字框換算回頁面並合併
+
+- 相鄰方塊重疊 OCR_TILE_OVERLAP 像素，跨越切線的文字至少在一塊中完整出現
+- 合併以均勻網格空間索引查詢鄰近方框（不做兩兩比對）：
+  重複辨識的文字保留較完整的一個（未被切線截斷、內容較長），同一行被切開的片段接回一個文字框
+- 輸出與單次 OCR 相同的 texts 結構（頁面像素座標）
+"""
+import os
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# 方塊邊長（頁面像素，0 表示依後端像素預算：sqrt(max_pixels)，未設定時 1024）
+OCR_TILE_SIZE = int(os.getenv("OCR_TILE_SIZE", "0"))
+# 相鄰方塊重疊的像素（需大於最大的文字行高）
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "160"))
+# 分塊或合併規則變更時遞增，使分塊 OCR 的快取失效
+TILING_VERSION = "1"
+
+# 文字框距離方塊內側邊緣在此像素內，視為被切線截斷
+EDGE_MARGIN = 4
+# 重疊面積佔較小方框的比例達此值，且內容相符，視為同一段文字
+DUPLICATE_OVERLAP = 0.5
+# 同一行：垂直重疊佔較矮方框高度的比例
+SAME_LINE_OVERLAP = 0.5
+
+Tile = Tuple[int, int, int, int]  # (x, y, 寬, 高)
+
+
+def tile_size_for(capabilities) -> int:
+    """後端適用的方塊邊長：每塊送出時不需再縮小"""
+    if OCR_TILE_SIZE:
+        return OCR_TILE_SIZE
+    if capabilities.max_pixels:
+        return int(math.sqrt(capabilities.max_pixels))
+    return capabilities.max_image_side or 1024
+
+
+def tiling_variant(tile_size: int, overlap: int = OCR_TILE_OVERLAP) -> str:
+    """分塊設定（OCR 快取 key 用）"""
+    return f"tiles:{tile_size}:{overlap}:{TILING_VERSION}"
+
+
+def plan_tiles(width: int, height: int, tile_size: int, overlap: int = OCR_TILE_OVERLAP) -> List[Tile]:
+    """
+    將頁面切成大小相近、相鄰重疊至少 overlap 的方塊（由左至右、由上至下）
+
+    頁面不大於一塊時返回整頁一塊
+    """
+    overlap = min(overlap, tile_size // 2)
+
+    def spans(length: int) -> List[Tuple[int, int]]:
+        if length <= tile_size:
+            return [(0, length)]
+        count = math.ceil((length - overlap) / (tile_size - overlap))
+        # 平均分配：每塊大小相同，重疊不小於 overlap
+        size = math.ceil((length + overlap * (count - 1)) / count)
+        return [(round(i * (length - size) / (count - 1)), size) for i in range(count)]
+
+    return [(x, y, w, h) for y, h in spans(height) for x, w in spans(width)]
+
+
+class GridIndex:
+    """均勻網格空間索引：方框登記在其覆蓋的每個格子，查詢只取得相同格子內的方框"""
+
+    def __init__(self, cell: int):
+        self.cell = max(1, cell)
+        self._cells: Dict[Tuple[int, int], Set[int]] = defaultdict(set)
+
+    def _keys(self, box: Dict) -> Iterable[Tuple[int, int]]:
+        x0, y0 = int(box["x"] // self.cell), int(box["y"] // self.cell)
+        x1 = int((box["x"] + box["width"]) // self.cell)
+        y1 = int((box["y"] + box["height"]) // self.cell)
+        return ((cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1))
+
+    def insert(self, item: int, box: Dict) -> None:
+        for key in self._keys(box):
+            self._cells[key].add(item)
+
+    def remove(self, item: int, box: Dict) -> None:
+        for key in self._keys(box):
+            self._cells[key].discard(item)
+
+    def query(self, box: Dict) -> Set[int]:
+        found: Set[int] = set()
+        for key in self._keys(box):
+            found |= self._cells.get(key, set())
+        return found
+
+
+def _valid(text: Dict) -> bool:
+    return (bool(text.get("content"))
+            and all(isinstance(text.get(k), (int, float)) for k in ("x", "y", "width", "height"))
+            and text["width"] > 0 and text["height"] > 0)
+
+
+def _clipped_sides(text: Dict, tile: Tile, page_width: int, page_height: int) -> Set[str]:
+    """文字框碰到的方塊內側邊緣（頁面邊緣不算）"""
+    x, y, w, h = tile
+    sides = set()
+    if x > 0 and text["x"] <= EDGE_MARGIN:
+        sides.add("left")
+    if y > 0 and text["y"] <= EDGE_MARGIN:
+        sides.add("top")
+    if x + w < page_width and text["x"] + text["width"] >= w - EDGE_MARGIN:
+        sides.add("right")
+    if y + h < page_height and text["y"] + text["height"] >= h - EDGE_MARGIN:
+        sides.add("bottom")
+    return sides
+
+
+def _overlap(a: Dict, b: Dict) -> Tuple[float, float]:
+    """(水平重疊寬度, 垂直重疊高度)"""
+    return (min(a["x"] + a["width"], b["x"] + b["width"]) - max(a["x"], b["x"]),
+            min(a["y"] + a["height"], b["y"] + b["height"]) - max(a["y"], b["y"]))
+
+
+def _normalize(content: str) -> str:
+    return "".join(str(content).split())
+
+
+def _is_duplicate(a: Dict, b: Dict) -> bool:
+    """兩個方框是否為同一段文字（大部分重疊，且內容相同或其中一個是另一個的片段）"""
+    dx, dy = _overlap(a, b)
+    if dx <= 0 or dy <= 0:
+        return False
+    smaller = min(a["width"] * a["height"], b["width"] * b["height"])
+    if dx * dy / smaller < DUPLICATE_OVERLAP:
+        return False
+    ca, cb = _normalize(a["content"]), _normalize(b["content"])
+    return ca in cb or cb in ca
+
+
+def _is_split_line(left: Tuple[Dict, Set[str]], right: Tuple[Dict, Set[str]]) -> bool:
+    """left 與 right 是否為同一行被切線切開的前後兩段"""
+    a, a_sides = left
+    b, b_sides = right
+    if "right" not in a_sides and "left" not in b_sides:
+        return False
+    dx, dy = _overlap(a, b)
+    return dx > 0 and dy >= SAME_LINE_OVERLAP * min(a["height"], b["height"]) and a["x"] < b["x"]
+
+
+def _join_content(left: str, right: str) -> str:
+    """接回切開的文字：去掉兩段在重疊區重複辨識的部分"""
+    for size in range(min(len(left), len(right)), 0, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    separator = " " if left[-1:].isascii() and right[:1].isascii() and left[-1:].isalnum() else ""
+    return left + separator + right
+
+
+def _stitch(left: Tuple[Dict, Set[str]], right: Tuple[Dict, Set[str]]) -> Tuple[Dict, Set[str]]:
+    a, a_sides = left
+    b, b_sides = right
+    x0, y0 = min(a["x"], b["x"]), min(a["y"], b["y"])
+    x1 = max(a["x"] + a["width"], b["x"] + b["width"])
+    y1 = max(a["y"] + a["height"], b["y"] + b["height"])
+    merged = {**a, "content": _join_content(str(a["content"]), str(b["content"])),
+              "x": x0, "y": y0, "width": x1 - x0, "height": y1 - y0}
+    if "confidence" in a or "confidence" in b:
+        merged["confidence"] = min(a.get("confidence", 1), b.get("confidence", 1))
+    sides = (a_sides - {"right"}) | (b_sides - {"left"})
+    return merged, sides
+
+
+def _better(a: Tuple[Dict, Set[str]], b: Tuple[Dict, Set[str]]) -> bool:
+    """a 是否比 b 完整（較少被截斷的邊 → 內容較長 → 面積較大）"""
+    def rank(entry):
+        text, sides = entry
+        return (-len(sides), len(_normalize(text["content"])), text["width"] * text["height"])
+    return rank(a) > rank(b)
+
+
+def merge_tile_texts(tile_texts: List[Tuple[Tile, List[Dict]]], page_width: int, page_height: int,
+                     cell: Optional[int] = None) -> List[Dict]:
+    """
+    合併各方塊的 OCR 結果（texts 座標為方塊內像素）
+
+    Args:
+        tile_texts: [(方塊, 該塊的 texts)]
+        page_width, page_height: 頁面尺寸
+        cell: 空間索引的格子邊長（預設為重疊寬度的兩倍）
+
+    Returns:
+        頁面座標的 texts（依位置由上而下、由左而右排序）
+    """
+    index = GridIndex(cell or OCR_TILE_OVERLAP * 2)
+    kept: Dict[int, Tuple[Dict, Set[str]]] = {}
+    next_id = 0
+
+    for tile, texts in tile_texts:
+        for text in texts:
+            if not _valid(text):
+                continue
+            sides = _clipped_sides(text, tile, page_width, page_height)
+            entry = ({**text, "x": text["x"] + tile[0], "y": text["y"] + tile[1]}, sides)
+
+            # 與鄰近方框比對，直到沒有可合併的對象
+            merged = True
+            while merged:
+                merged = False
+                for other_id in index.query(entry[0]):
+                    other = kept[other_id]
+                    if _is_duplicate(entry[0], other[0]):
+                        if not _better(entry, other):
+                            entry = None
+                    elif _is_split_line(other, entry):
+                        entry = _stitch(other, entry)
+                    elif _is_split_line(entry, other):
+                        entry = _stitch(entry, other)
+                    else:
+                        continue
+                    index.remove(other_id, other[0])
+                    del kept[other_id]
+                    if entry is None:
+                        # 已有較完整的方框：放回原本的
+                        entry = other
+                    merged = True
+                    break
+
+            kept[next_id] = entry
+            index.insert(next_id, entry[0])
+            next_id += 1
+
+    return sorted((text for text, _ in kept.values()), key=lambda t: (round(t["y"]), t["x"]))
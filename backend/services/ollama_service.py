@@ -1,230 +1,188 @@
 """Ollama 本地視覺模型服務 - OCR"""
+import os
 import json
+import time
 import base64
 import httpx
 import logging
-from typing import Dict, List
-from PIL import Image
-import io
+from typing import Dict, Optional
+
+from services.json_stream import JsonStreamScanner
+from services.ocr_backend import OcrBackend, OcrCapabilities, record_generation
 
 logger = logging.getLogger(__name__)
 
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen3-vl:8b")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# 每個行程同時進行中的 OCR 請求上限
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "2"))
+# 送出圖片的最長邊（px，0 不縮小）；視覺模型本身也會縮小大圖，送原尺寸只增加傳輸與編碼時間
+OLLAMA_MAX_IMAGE_SIDE = int(os.getenv("OLLAMA_MAX_IMAGE_SIDE", "1920"))
+# 像素預算（0 不限制）：預設 1280 x 28 x 28，即 Qwen-VL 建議的 1280 個視覺 token
+OLLAMA_MAX_PIXELS = int(os.getenv("OLLAMA_MAX_PIXELS", str(1280 * 28 * 28)))
+# 送出圖片的編碼與品質；JPEG 編碼比 PNG 快得多，base64 後的請求也小得多
+OLLAMA_IMAGE_FORMAT = os.getenv("OLLAMA_IMAGE_FORMAT", "JPEG").upper()
+OLLAMA_IMAGE_QUALITY = int(os.getenv("OLLAMA_IMAGE_QUALITY", "90"))
+# 共用連線池：連線數上限（預設與 OCR 並行數相同）、保持連線數與閒置保留秒數
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", str(OLLAMA_CONCURRENCY)))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", str(OLLAMA_MAX_CONNECTIONS)))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+# 逾時（秒）：建立連線、讀寫（本地模型可能較慢）、等待連線池空出連線
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+OLLAMA_POOL_TIMEOUT = float(os.getenv("OLLAMA_POOL_TIMEOUT", "300"))
+# 串流接收輸出：最外層 JSON 物件結束即停止生成（0 改為等待完整回應）
+OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "1") == "1"
+# 連續輸出相同文字區塊達此次數即視為重複輸出，停止生成（0 不檢查）
+OLLAMA_REPEAT_LIMIT = int(os.getenv("OLLAMA_REPEAT_LIMIT", "3"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+class OllamaStreamError(Exception):
+    """串流中途 Ollama 回報錯誤（例如模型載入失敗），可重試"""
+    retryable = True
+
+
+def get_ollama_client() -> httpx.AsyncClient:
+    """
+    取得行程內共用的 Ollama HTTP 客戶端（連線池跨任務共用，保持連線）
+
+    由 API 的 lifespan 與 worker 啟動時建立、結束時以 close_ollama_client() 關閉；
+    其他情境（腳本）第一次使用時建立
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+                keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                OLLAMA_READ_TIMEOUT,
+                connect=OLLAMA_CONNECT_TIMEOUT,
+                pool=OLLAMA_POOL_TIMEOUT,
+            ),
+        )
+    return _client
+
+
+async def close_ollama_client() -> None:
+    """關閉共用客戶端與其連線"""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
 
-class OllamaService:
+class OllamaService(OcrBackend):
     """Ollama 本地視覺模型服務"""
     
+    name = "ollama"
+    model_name = OLLAMA_MODEL
+    capabilities = OcrCapabilities(
+        max_concurrency=OLLAMA_CONCURRENCY,
+        max_image_side=OLLAMA_MAX_IMAGE_SIDE,
+        max_pixels=OLLAMA_MAX_PIXELS,
+        image_format=OLLAMA_IMAGE_FORMAT,
+        image_quality=OLLAMA_IMAGE_QUALITY,
+        cost_per_page=0.0,
+        local=True,
+    )
+    # 關閉 qwen3 的思考模式
+    prompt_suffix = "\n/no_think"
+    
     def __init__(
         self, 
-        model_name: str = "qwen3-vl:8b",
-        base_url: str = "http://localhost:11434"
+        model_name: str = OLLAMA_MODEL,
+        base_url: str = OLLAMA_BASE_URL
     ):
         self.model = model_name
+        self.model_name = model_name
         self.base_url = base_url
-        self.client = httpx.AsyncClient(timeout=120.0)  # 本地模型可能較慢
     
-    async def ocr_image(self, image_bytes: bytes, width: int, height: int) -> Dict:
-        """
-        使用本地視覺模型 OCR 辨識圖片中的文字
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """所有任務共用同一個連線池，不再每個任務建立客戶端"""
+        return get_ollama_client()
+    
+    async def generate(self, prompt: str, image_bytes: bytes, width: int, height: int,
+                       max_tokens: Optional[int] = None) -> str:
+        """以 /api/generate 送出 prompt 與圖片"""
+        options = {"temperature": 0.1}  # 低溫度，更精確
+        if max_tokens:
+            options["num_predict"] = max_tokens
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "images": [base64.b64encode(image_bytes).decode('utf-8')],
+            "stream": OLLAMA_STREAM,
+            "options": options
+        }
+        if OLLAMA_STREAM:
+            return await self._generate_stream(payload)
         
-        Returns:
-            {
-                "texts": [
-                    {
-                        "content": "文字內容",
-                        "x": 100, "y": 50,
-                        "width": 400, "height": 60,
-                        "font_size": 36,
-                        "font_weight": "bold",
-                        "color": "#333333",
-                        "confidence": 0.95
-                    }
-                ]
-            }
+        response = await self.client.post(f"{self.base_url}/api/generate", json=payload)
+        response.raise_for_status()
+        data = response.json()
+        if data.get("eval_count"):
+            record_generation(data["eval_count"], data.get("eval_duration", 0) / 1e9)
+        return data.get("response", "").strip()
+    
+    async def _generate_stream(self, payload: Dict) -> str:
         """
-        prompt = f"""分析這張投影片圖片，辨識所有文字。
-
-對每個文字區塊，輸出：
-- content: 文字內容
-- x, y: 左上角座標（像素，圖片尺寸 {width}x{height}）
-- width, height: 區塊尺寸（像素）
-- font_size: 字體大小估計
-- font_weight: "bold" 或 "normal"
-- color: 顏色 hex 格式
-
-只輸出 JSON，格式：{{"texts": [...]}}
-
-/no_think"""
+        逐行讀取 NDJSON 串流並增量掃描 JSON：
+        - 最外層物件結束即關閉連線（Ollama 隨之停止生成），不等模型輸出結尾的多餘內容
+        - 重複輸出相同區塊時停止，以不重複的區塊作為結果
+        - 串流結束但 JSON 未結束（達 token 上限）時，保留已完成的區塊
+        """
+        scanner = JsonStreamScanner()
+        tokens = 0
+        first_token = None
+        done = None
         
-        # Base64 編碼圖片
-        image_b64 = base64.b64encode(image_bytes).decode('utf-8')
+        async with self.client.stream("POST", f"{self.base_url}/api/generate", json=payload) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise OllamaStreamError(chunk["error"])
+                if chunk.get("response"):
+                    tokens += 1
+                    first_token = first_token or time.monotonic()
+                    scanner.feed(chunk["response"])
+                if chunk.get("done"):
+                    done = chunk
+                    break
+                if scanner.complete or scanner.repeating(OLLAMA_REPEAT_LIMIT):
+                    break
         
-        try:
-            response = await self.client.post(
-                f"{self.base_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "images": [image_b64],
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.1,  # 低溫度，更精確
-                        "num_predict": 4096
-                    }
-                }
-            )
-            response.raise_for_status()
-            
-            result = response.json()
-            result_text = result.get("response", "").strip()
-            
-            # 解析 JSON（處理 markdown code block）
-            if "```" in result_text:
-                # 找到 JSON 部分
-                parts = result_text.split("```")
-                for part in parts:
-                    part = part.strip()
-                    if part.startswith("json"):
-                        part = part[4:].strip()
-                    if part.startswith("{"):
-                        result_text = part
-                        break
-            
-            # 找到 JSON 開始位置
-            json_start = result_text.find("{")
-            json_end = result_text.rfind("}") + 1
-            if json_start >= 0 and json_end > json_start:
-                result_text = result_text[json_start:json_end]
-            
-            return json.loads(result_text)
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON Parse Error: {e}")
-            logger.debug(f"Raw response: {result_text[:500]}")
-            return {"texts": [], "error": f"JSON parse error: {str(e)}"}
-        except Exception as e:
-            logger.error(f"Ollama OCR Error: {e}")
-            return {"texts": [], "error": str(e)}
-    
-    async def analyze_slide(self, image_bytes: bytes) -> Dict:
-        """分析投影片特徵"""
-        prompt = """分析這張投影片：
-
-1. is_notebooklm: 是否像 NotebookLM 生成的
-2. has_watermark: 是否有浮水印
-3. background_type: 背景類型 (solid/gradient/image/pattern)
-4. dominant_colors: 主要顏色 (hex 格式，最多3個)
-5. layout_type: 版面類型 (title/content/two_column/image_heavy)
-
-只輸出 JSON：{"is_notebooklm": bool, "has_watermark": bool, "background_type": "...", "dominant_colors": [...], "layout_type": "..."}
-
-/no_think"""
-        
-        image_b64 = base64.b64encode(image_bytes).decode('utf-8')
+        if done and done.get("eval_count"):
+            record_generation(done["eval_count"], done.get("eval_duration", 0) / 1e9)
+        elif first_token:
+            record_generation(tokens, time.monotonic() - first_token, early_stop=not done)
         
+        if scanner.complete:
+            return scanner.document()
+        if scanner.blocks:
+            reason = "重複輸出" if scanner.repeating(OLLAMA_REPEAT_LIMIT) else "輸出未結束"
+            logger.warning(f"Ollama {reason}，保留已完成的 {len(scanner.blocks)} 個區塊")
+            return scanner.salvage()
+        return scanner.text().strip()
+    
+    async def health(self) -> Dict:
+        """Ollama 是否在執行，且已下載設定的模型"""
         try:
-            response = await self.client.post(
-                f"{self.base_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "images": [image_b64],
-                    "stream": False,
-                    "options": {"temperature": 0.1}
-                }
-            )
+            response = await self.client.get(f"{self.base_url}/api/tags")
             response.raise_for_status()
-            
-            result = response.json()
-            result_text = result.get("response", "").strip()
-            
-            # 解析 JSON
-            json_start = result_text.find("{")
-            json_end = result_text.rfind("}") + 1
-            if json_start >= 0 and json_end > json_start:
-                result_text = result_text[json_start:json_end]
-            
-            return json.loads(result_text)
-            
         except Exception as e:
-            logger.error(f"Analyze Error: {e}")
-            return {
-                "is_notebooklm": False,
-                "has_watermark": False,
-                "background_type": "unknown",
-                "dominant_colors": [],
-                "layout_type": "unknown",
-                "error": str(e)
-            }
-    
-    async def inpaint_background(self, image_bytes: bytes, text_regions: List[Dict]) -> bytes:
-        """用背景色填補文字區域（同 GeminiService）"""
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        for region in text_regions:
-            x = int(region.get('x', 0))
-            y = int(region.get('y', 0))
-            w = int(region.get('width', 0))
-            h = int(region.get('height', 0))
-            
-            if w <= 0 or h <= 0:
-                continue
-            
-            bg_color = self._sample_background_color(img, x, y, w, h)
-            
-            for px in range(max(0, x), min(img.width, x + w)):
-                for py in range(max(0, y), min(img.height, y + h)):
-                    img.putpixel((px, py), bg_color)
-        
-        output = io.BytesIO()
-        img.save(output, format='PNG')
-        return output.getvalue()
-    
-    def _sample_background_color(self, img, x: int, y: int, w: int, h: int) -> tuple:
-        """從區域周圍取樣背景顏色"""
-        samples = []
-        
-        if y > 5:
-            for px in range(max(0, x), min(img.width, x + w), 10):
-                samples.append(img.getpixel((px, y - 5)))
-        if y + h + 5 < img.height:
-            for px in range(max(0, x), min(img.width, x + w), 10):
-                samples.append(img.getpixel((px, y + h + 5)))
-        if x > 5:
-            for py in range(max(0, y), min(img.height, y + h), 10):
-                samples.append(img.getpixel((x - 5, py)))
-        if x + w + 5 < img.width:
-            for py in range(max(0, y), min(img.height, y + h), 10):
-                samples.append(img.getpixel((x + w + 5, py)))
-        
-        if not samples:
-            return (255, 255, 255)
-        
-        if isinstance(samples[0], tuple):
-            r = sum(s[0] for s in samples) // len(samples)
-            g = sum(s[1] for s in samples) // len(samples)
-            b = sum(s[2] for s in samples) // len(samples)
-            return (r, g, b)
-        return (255, 255, 255)
-    
-    async def close(self):
-        """關閉 HTTP 客戶端"""
-        await self.client.aclose()
-
-
-async def test_ollama():
-    """測試 Ollama 連接"""
-    service = OllamaService()
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get("http://localhost:11434/api/tags")
-            models = response.json().get("models", [])
-            logger.info(f"Available models: {[m['name'] for m in models]}")
-            return True
-    except Exception as e:
-        logger.error(f"Ollama test failed: {e}")
-        return False
-
-
-if __name__ == "__main__":
-    import asyncio
-    asyncio.run(test_ollama())
+            return {"ok": False, "detail": f"Ollama 無法連線: {e}"}
+        models = [m.get("name", "") for m in response.json().get("models", [])]
+        if self.model not in models and f"{self.model}:latest" not in models:
+            return {"ok": False, "detail": f"模型 {self.model} 尚未下載"}
+        return {"ok": True, "detail": ""}
@@ -0,0 +1,230 @@
+"""文件中繼資料 - 上傳時解析一次，存成檔案旁的 JSON，分析與處理直接查詢"""
+import os
+import json
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 中繼資料內容或判斷方式變更時遞增，舊的 JSON 會自動重建
+METADATA_VERSION = 3
+METADATA_SUFFIX = ".meta.json"
+# 圖片檔視為 96 DPI（與分析 API 相同）
+IMAGE_DPI = 96
+# 整頁圖片判斷：內容串流大小上限（bytes）與覆蓋頁面的容許誤差（比例）
+FULL_PAGE_STREAM_LIMIT = 4096
+FULL_PAGE_TOLERANCE = 0.01
+# 只有這些運算子（加上一次 Do）的頁面才視為單張整頁圖片
+_FULL_PAGE_OPERATORS = {b"q", b"Q", b"cm", b"gs", b"re", b"W", b"W*", b"n"}
+# 頁數超過此值時只抽樣偵測文字層並估計（0 表示一律逐頁偵測）
+TEXT_SAMPLE_THRESHOLD = int(os.getenv("TEXT_SAMPLE_THRESHOLD", "0"))
+TEXT_SAMPLE_SIZE = int(os.getenv("TEXT_SAMPLE_SIZE", "100"))
+
+
+def metadata_path(path: str) -> str:
+    """中繼資料 JSON 路徑（與檔案放在一起）"""
+    return f"{path}{METADATA_SUFFIX}"
+
+
+def get_metadata(path: str) -> Dict:
+    """
+    讀取檔案的中繼資料，不存在或版本不符時重新建立
+
+    Returns:
+        {
+            "version", "kind": "pdf" | "image", "encrypted", "page_count",
+            "pages": [{"width", "height", "mediabox", "rotation", "has_text", "images", "full_page_image"}],
+            "text_estimate": 抽樣模式才有，{"pages_with_text", "low", "high"}
+        }
+        width / height 單位為 points（1/72 inch）；抽樣模式下未抽到的頁面 has_text 為 None
+        full_page_image：頁面只有一張填滿頁面的圖片時為 {"name", "placement": [x, y, 寬, 高]}
+        （圖片在頁面座標中的位置，points），否則為 None
+    """
+    meta = _load(metadata_path(path))
+    if meta is None:
+        meta = build_metadata(path)
+    return meta
+
+
+def build_metadata(path: str) -> Dict:
+    """解析檔案並寫入中繼資料 JSON"""
+    if path.lower().endswith(".pdf"):
+        meta = _build_pdf_metadata(path)
+    else:
+        meta = _build_image_metadata(path)
+
+    target = metadata_path(path)
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, target)
+    return meta
+
+
+def _load(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if meta.get("version") != METADATA_VERSION:
+        return None
+    return meta
+
+
+def _build_pdf_metadata(path: str) -> Dict:
+    from services.pdf_service import open_pdf
+    from services import text_layer
+
+    with open_pdf(path) as reader:
+        meta = {
+            "version": METADATA_VERSION,
+            "kind": "pdf",
+            "encrypted": bool(reader.is_encrypted),
+            "page_count": 0,
+            "pages": [],
+        }
+        # 加密的 PDF 無法讀取頁面內容，只記錄加密狀態
+        if reader.is_encrypted:
+            return meta
+
+        page_count = len(reader.pages)
+        # 小文件直接在同一個 reader 逐頁偵測；大文件並行或抽樣（見下方）
+        inline = page_count < text_layer.PARALLEL_MIN_PAGES
+        for page in reader.pages:
+            box = [float(v) for v in page.mediabox]
+            images = _page_images(page)
+            meta["pages"].append({
+                "width": box[2] - box[0],
+                "height": box[3] - box[1],
+                "mediabox": box,
+                "rotation": page.rotation % 360,
+                "has_text": text_layer.page_has_text(page) if inline else None,
+                "images": images,
+                "full_page_image": _full_page_image(page, box, images),
+            })
+        meta["page_count"] = page_count
+
+    if inline:
+        return meta
+    if TEXT_SAMPLE_THRESHOLD and page_count > TEXT_SAMPLE_THRESHOLD:
+        estimate = text_layer.estimate_text_pages(path, page_count, TEXT_SAMPLE_SIZE)
+        for number, flag in estimate.pop("sampled").items():
+            meta["pages"][number - 1]["has_text"] = flag
+        meta["text_estimate"] = estimate
+    else:
+        for info, flag in zip(meta["pages"], text_layer.classify_pages(path)):
+            info["has_text"] = flag
+    return meta
+
+
+def _build_image_metadata(path: str) -> Dict:
+    from PIL import Image
+
+    # 只讀取檔頭取得尺寸
+    with Image.open(path) as img:
+        width, height = img.size
+        fmt = img.format
+    page_width = width * 72 / IMAGE_DPI
+    page_height = height * 72 / IMAGE_DPI
+    return {
+        "version": METADATA_VERSION,
+        "kind": "image",
+        "encrypted": False,
+        "page_count": 1,
+        "pages": [{
+            "width": page_width,
+            "height": page_height,
+            "mediabox": [0.0, 0.0, page_width, page_height],
+            "rotation": 0,
+            "has_text": False,
+            "images": [{"name": None, "width": width, "height": height, "filter": fmt}],
+        }],
+    }
+
+
+def _page_images(page) -> List[Dict]:
+    """頁面資源中的圖片 XObject（名稱、像素尺寸、壓縮方式）"""
+    images = []
+    try:
+        resources = page.get("/Resources")
+        xobjects = resources.get_object().get("/XObject") if resources else None
+        if not xobjects:
+            return images
+        for name, ref in xobjects.get_object().items():
+            obj = ref.get_object()
+            if obj.get("/Subtype") != "/Image":
+                continue
+            filters = obj.get("/Filter")
+            if isinstance(filters, list):
+                filters = filters[-1] if filters else None
+            images.append({
+                "name": str(name),
+                "width": int(obj.get("/Width", 0)),
+                "height": int(obj.get("/Height", 0)),
+                "filter": str(filters) if filters else None,
+                # 透明遮罩或模板遮罩無法單獨作為頁面背景
+                "masked": "/SMask" in obj or bool(obj.get("/ImageMask")),
+            })
+    except Exception as e:
+        logger.warning(f"Image resource scan failed: {e}")
+    return images
+
+
+def _full_page_image(page, box: List[float], images: List[Dict]) -> Optional[Dict]:
+    """
+    頁面是否只有一張填滿頁面的圖片（NotebookLM 匯出常見）
+
+    內容串流只能有 q/Q/cm/gs/裁切路徑與一次 Do，且圖片經 CTM 後覆蓋整個 mediabox；
+    有文字或向量內容的頁面仍需渲染
+    """
+    from services.text_layer import content_streams, page_fonts
+
+    if len(images) != 1 or images[0]["masked"] or page_fonts(page):
+        return None
+    try:
+        if sum(len(data) for data in content_streams(page)) > FULL_PAGE_STREAM_LIMIT:
+            return None
+        operations = page.get_contents().operations
+    except Exception as e:
+        logger.debug(f"Content stream parse failed: {e}")
+        return None
+
+    ctm = [1.0, 0.0, 0.0, 1.0, 0.0, 0.0]
+    stack = []
+    drawn = None
+    for operands, operator in operations:
+        if operator == b"q":
+            stack.append(ctm)
+        elif operator == b"Q":
+            ctm = stack.pop() if stack else ctm
+        elif operator == b"cm":
+            m = [float(v) for v in operands]
+            ctm = [
+                m[0] * ctm[0] + m[1] * ctm[2],
+                m[0] * ctm[1] + m[1] * ctm[3],
+                m[2] * ctm[0] + m[3] * ctm[2],
+                m[2] * ctm[1] + m[3] * ctm[3],
+                m[4] * ctm[0] + m[5] * ctm[2] + ctm[4],
+                m[4] * ctm[1] + m[5] * ctm[3] + ctm[5],
+            ]
+        elif operator == b"Do":
+            if drawn is not None or str(operands[0]) != images[0]["name"]:
+                return None
+            drawn = ctm
+        elif operator not in _FULL_PAGE_OPERATORS:
+            return None
+
+    # 不處理旋轉或翻轉的圖片
+    if drawn is None or drawn[1] or drawn[2] or drawn[0] <= 0 or drawn[3] <= 0:
+        return None
+    x0, y0, x1, y1 = box
+    tol_x = (x1 - x0) * FULL_PAGE_TOLERANCE
+    tol_y = (y1 - y0) * FULL_PAGE_TOLERANCE
+    covers = (
+        drawn[4] <= x0 + tol_x and drawn[5] <= y0 + tol_y
+        and drawn[4] + drawn[0] >= x1 - tol_x and drawn[5] + drawn[3] >= y1 - tol_y
+    )
+    if not covers:
+        return None
+    return {"name": images[0]["name"], "placement": [drawn[4], drawn[5], drawn[0], drawn[3]]}
@@ -1,78 +1,257 @@
 """PDF 處理服務"""
+import os
+import mmap
 import logging
-from typing import List
+import tempfile
+from contextlib import ExitStack, contextmanager
+from itertools import groupby
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from PIL import Image
 import io
 
 logger = logging.getLogger(__name__)
 
+# PDF 來源：檔案路徑（建議）或 bytes
+PdfSource = Union[str, bytes]
+
+# 連續頁面合併為一次 poppler 渲染的頁數上限（同一區段的圖片會同時在記憶體中）
+RENDER_WINDOW = int(os.getenv("PDF_RENDER_WINDOW", "4"))
+
+
+@contextmanager
+def open_pdf(source: PdfSource):
+    """
+    開啟 PdfReader
+    
+    路徑以 memory map 讀取（由 OS 分頁載入，不會整份複製到記憶體）；
+    PdfReader(path) 會把整個檔案讀進 BytesIO，因此不直接傳路徑。
+    """
+    from pypdf import PdfReader
+    
+    if isinstance(source, (bytes, bytearray)):
+        yield PdfReader(io.BytesIO(source))
+        return
+    with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        yield PdfReader(m)
+
+
+def extract_page_image(reader, page_number: int, info: Dict) -> Image.Image:
+    """
+    取出整頁圖片頁面的內嵌圖片（原始解析度）
+    
+    Args:
+        reader: PdfReader
+        page_number: 頁碼（從 1 開始）
+        info: 中繼資料中的頁面資訊（含 full_page_image 與 mediabox）
+    """
+    full_page = info["full_page_image"]
+    page = reader.pages[page_number - 1]
+    img = page.images[full_page["name"]].image
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    # 圖片超出頁面（出血）時裁掉頁面外的部分
+    x, y, w, h = full_page["placement"]
+    x0, y0, x1, y1 = info["mediabox"]
+    sx, sy = img.width / w, img.height / h
+    crop = (
+        max(0, round((x0 - x) * sx)),
+        max(0, round((y + h - y1) * sy)),
+        min(img.width, round((x1 - x) * sx)),
+        min(img.height, round((y + h - y0) * sy)),
+    )
+    if crop != (0, 0, img.width, img.height):
+        img = img.crop(crop)
+    
+    # /Rotate 為順時針角度
+    if info["rotation"]:
+        img = img.rotate(-info["rotation"], expand=True)
+    return img
+
+
+def group_page_runs(pages: List[int], window: int = 1) -> List[Tuple[int, int]]:
+    """
+    將頁碼列表分組為連續區段 (first, last)，保留原本順序
+    
+    例：[3, 4, 5, 9, 1], window=2 → [(3, 4), (5, 5), (9, 9), (1, 1)]
+    
+    Args:
+        pages: 頁碼列表（從 1 開始）
+        window: 每個區段最多頁數
+    """
+    runs: List[Tuple[int, int]] = []
+    for page in pages:
+        if runs:
+            first, last = runs[-1]
+            if page == last + 1 and last - first + 1 < window:
+                runs[-1] = (first, page)
+                continue
+        runs.append((page, page))
+    return runs
+
 
 class PdfService:
     """PDF 處理服務類"""
     
     def __init__(self, dpi: int = 150):
         self.dpi = dpi
+        # 渲染失敗而以空白圖片替代的頁碼（結果不完整，呼叫端不應快取）
+        self.fallback_pages: List[int] = []
     
-    def pdf_to_images(self, pdf_bytes: bytes) -> List[Image.Image]:
+    def pdf_to_images(self, pdf_bytes: PdfSource) -> List[Image.Image]:
         """
         將 PDF 轉換為圖片列表
         
         Args:
-            pdf_bytes: PDF 檔案的 bytes
+            pdf_bytes: PDF 檔案的 bytes 或路徑
             
         Returns:
             PIL Image 列表
         """
+        return list(self.iter_images(pdf_bytes))
+    
+    def iter_images(self, pdf_bytes: PdfSource, window: int = 1, pages: Optional[List[int]] = None,
+                    meta: Optional[Dict] = None) -> Iterator[Image.Image]:
+        """
+        逐頁將 PDF 轉換為圖片（generator）
+        
+        連續頁碼最多 window 頁合併為同一次渲染（一個 pdftoppm 行程），
+        記憶體用量不隨頁數增加。指定 pages 時只渲染這些頁面。
+        中繼資料標記為整頁圖片的頁面直接取出內嵌圖片，不經過渲染。
+        
+        Args:
+            pdf_bytes: PDF 檔案的 bytes 或路徑（路徑可省去寫入暫存檔）
+            window: 每次渲染的頁數上限（worker 使用 RENDER_WINDOW）
+            pages: 要渲染的頁碼（從 1 開始，依此順序輸出）；None 表示全部
+            meta: 上傳時建立的中繼資料（提供時不再解析 PDF 取得頁數與尺寸）
+            
+        Yields:
+            依頁面順序的 PIL Image
+        """
+        total = meta["page_count"] if meta else self.get_page_count(pdf_bytes)
+        if pages is None:
+            pages = list(range(1, total + 1))
+        else:
+            pages = [p for p in pages if 0 < p <= total]
+        
+        # 只有一張整頁圖片的頁面直接取出內嵌圖片（原始解析度，不需渲染）
+        direct = {}
+        if meta:
+            direct = {p: meta["pages"][p - 1]["full_page_image"] for p in pages
+                      if meta["pages"][p - 1].get("full_page_image")}
+        
         try:
-            from pdf2image import convert_from_bytes
-            images = convert_from_bytes(pdf_bytes, dpi=self.dpi)
-            return images
+            from pdf2image import convert_from_path
         except ImportError:
+            convert_from_path = None
+        
+        # bytes 只寫一次暫存檔，之後每個區段都從同一個檔案渲染
+        tmp_path = None
+        pdf_path = pdf_bytes if isinstance(pdf_bytes, str) else None
+        if pdf_path is None and convert_from_path and len(direct) < len(pages):
+            fd, tmp_path = tempfile.mkstemp(suffix=".pdf")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_bytes)
+            pdf_path = tmp_path
+        
+        with ExitStack() as stack:
+            if tmp_path:
+                stack.callback(os.unlink, tmp_path)
+            reader = stack.enter_context(open_pdf(pdf_bytes)) if direct else None
+            
+            # 依序處理連續的「直接取出」與「需要渲染」區段
+            for is_direct, group in groupby(pages, key=lambda p: p in direct):
+                group = list(group)
+                if not is_direct:
+                    runs = group_page_runs(group, max(1, window))
+                    yield from self._render_runs(convert_from_path, pdf_bytes, pdf_path, runs, meta)
+                    continue
+                for page in group:
+                    info = meta["pages"][page - 1]
+                    try:
+                        img = extract_page_image(reader, page, info)
+                    except Exception as e:
+                        logger.warning(f"整頁圖片擷取失敗 (頁 {page})，改用渲染: {e}")
+                        yield from self._render_runs(convert_from_path, pdf_bytes, pdf_path, [(page, page)], meta)
+                        continue
+                    yield img
+    
+    def _render_runs(self, convert_from_path, pdf_bytes: PdfSource, pdf_path: Optional[str],
+                     runs: List[Tuple[int, int]], meta: Optional[Dict]) -> Iterator[Image.Image]:
+        """
+        以 poppler 渲染各區段，失敗或沒有 poppler 時使用 fallback（記錄於 fallback_pages）
+        
+        Raises:
+            FileNotFoundError: 來源檔案在渲染途中被刪除（不以空白頁替代）
+        """
+        if convert_from_path is None:
             # 如果沒有 poppler，使用 pypdf + PIL 的方式
-            return self._pdf_to_images_fallback(pdf_bytes)
-        except Exception as e:
-            logger.error(f"PDF 轉圖片錯誤: {e}")
-            # 嘗試 fallback 方法
-            return self._pdf_to_images_fallback(pdf_bytes)
+            for first, last in runs:
+                self.fallback_pages.extend(range(first, last + 1))
+                yield from self._pdf_to_images_fallback(pdf_bytes, first, last, meta)
+            return
+        
+        for first, last in runs:
+            try:
+                images = convert_from_path(
+                    pdf_path, dpi=self.dpi, first_page=first, last_page=last
+                )
+            except Exception as e:
+                if isinstance(pdf_bytes, str) and not os.path.exists(pdf_bytes):
+                    raise FileNotFoundError(f"PDF 檔案已不存在: {pdf_bytes}") from e
+                logger.error(f"PDF 轉圖片錯誤 (頁 {first}-{last}): {e}")
+                # 嘗試 fallback 方法
+                self.fallback_pages.extend(range(first, last + 1))
+                images = list(self._pdf_to_images_fallback(pdf_bytes, first, last, meta))
+            
+            while images:
+                yield images.pop(0)
     
-    def _pdf_to_images_fallback(self, pdf_bytes: bytes) -> List[Image.Image]:
+    def _pdf_to_images_fallback(self, pdf_bytes: PdfSource, first_page: int = 1, last_page: int = None,
+                                meta: Optional[Dict] = None) -> Iterator[Image.Image]:
         """
         備用方法：使用 pypdf 提取頁面
         注意：這個方法品質較差，但不需要額外依賴
         """
-        from pypdf import PdfReader
+        if meta:
+            last_page = last_page or meta["page_count"]
+            sizes = [(p["width"], p["height"]) for p in meta["pages"][first_page - 1:last_page]]
+        else:
+            sizes = self._page_sizes(pdf_bytes, first_page, last_page)
         
-        images = []
-        reader = PdfReader(io.BytesIO(pdf_bytes))
-        
-        for page in reader.pages:
+        for width_pt, height_pt in sizes:
             # 建立空白圖片作為替代
             # 實際上 pypdf 不支援直接轉圖片，需要 pdf2image + poppler
-            width = int(float(page.mediabox.width) * self.dpi / 72)
-            height = int(float(page.mediabox.height) * self.dpi / 72)
+            width = int(width_pt * self.dpi / 72)
+            height = int(height_pt * self.dpi / 72)
             
             # 建立白色背景圖片
-            img = Image.new('RGB', (width, height), 'white')
-            images.append(img)
-        
-        return images
+            yield Image.new('RGB', (width, height), 'white')
     
-    def get_page_count(self, pdf_bytes: bytes) -> int:
+    def _page_sizes(self, pdf_bytes: PdfSource, first_page: int, last_page: Optional[int]) -> List[Tuple[float, float]]:
+        """頁面尺寸（points）"""
+        with open_pdf(pdf_bytes) as reader:
+            last_page = last_page or len(reader.pages)
+            return [
+                (float(page.mediabox.width), float(page.mediabox.height))
+                for page in reader.pages[first_page - 1:last_page]
+            ]
+    
+    def get_page_count(self, pdf_bytes: PdfSource) -> int:
         """取得 PDF 頁數"""
-        from pypdf import PdfReader
-        reader = PdfReader(io.BytesIO(pdf_bytes))
-        return len(reader.pages)
+        with open_pdf(pdf_bytes) as reader:
+            return len(reader.pages)
     
-    def extract_page(self, pdf_bytes: bytes, page_num: int) -> bytes:
+    def extract_page(self, pdf_bytes: PdfSource, page_num: int) -> bytes:
         """提取單頁 PDF"""
-        from pypdf import PdfReader, PdfWriter
-        
-        reader = PdfReader(io.BytesIO(pdf_bytes))
-        writer = PdfWriter()
-        
-        if 0 < page_num <= len(reader.pages):
-            writer.add_page(reader.pages[page_num - 1])
+        from pypdf import PdfWriter
         
-        output = io.BytesIO()
-        writer.write(output)
-        return output.getvalue()
+        with open_pdf(pdf_bytes) as reader:
+            writer = PdfWriter()
+            
+            if 0 < page_num <= len(reader.pages):
+                writer.add_page(reader.pages[page_num - 1])
+            
+            output = io.BytesIO()
+            writer.write(output)
+            return output.getvalue()
@@ -0,0 +1,383 @@
+"""頁面處理管線 - 並行 OCR、依序組裝投影片"""
+import os
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from PIL import Image
+
+from services.executor_service import PagePayload, run_cpu, run_io
+from services.image_prep import needs_prep, prepare_ocr_image, prepare_ocr_tiles, scale_texts
+from services.image_service import encode_png
+from services.ocr_backend import generation_stats
+from services.ocr_cache import get_ocr_cache, ocr_cache_key
+from services.ocr_tiling import merge_tile_texts, plan_tiles, tile_size_for, tiling_variant
+from services.resilience import CircuitOpenError, call_with_resilience, failover_chain
+
+logger = logging.getLogger(__name__)
+
+# 支援批次的後端：等待湊滿一批的最長時間（秒）
+OCR_BATCH_LINGER = float(os.getenv("OCR_BATCH_LINGER_MS", "50")) / 1000
+
+_ocr_semaphores: Dict[str, asyncio.Semaphore] = {}
+_ocr_batchers: Dict[str, "OcrBatcher"] = {}
+
+
+def get_ocr_semaphore(backend: str, limit: int = 1) -> asyncio.Semaphore:
+    """取得後端共用的 OCR 並行限制（跨任務共用，上限取自後端能力）"""
+    if backend not in _ocr_semaphores:
+        _ocr_semaphores[backend] = asyncio.Semaphore(max(1, limit))
+    return _ocr_semaphores[backend]
+
+
+def get_ocr_batcher(ocr_service) -> "OcrBatcher":
+    """取得後端共用的批次收集器（跨任務共用）"""
+    if ocr_service.name not in _ocr_batchers:
+        _ocr_batchers[ocr_service.name] = OcrBatcher(ocr_service)
+    return _ocr_batchers[ocr_service.name]
+
+
+class OcrBatcher:
+    """
+    將同時等待 OCR 的頁面合併為一次批次請求（後端 batch_size > 1 時使用）
+    - 湊滿 batch_size 或等待 OCR_BATCH_LINGER 秒後送出
+    - 每個批次佔用一個後端並行名額
+    - 批次失敗時每頁的 submit() 都拋出該錯誤（由呼叫端各自重試）
+    """
+
+    def __init__(self, ocr_service, linger: float = OCR_BATCH_LINGER):
+        self.ocr_service = ocr_service
+        self.linger = linger
+        self._pending: List[Tuple[Tuple[bytes, int, int], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, image_bytes: bytes, width: int, height: int) -> Dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(((image_bytes, width, height), future))
+        if len(self._pending) >= self.ocr_service.capabilities.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        size = self.ocr_service.capabilities.batch_size
+        while self._pending:
+            batch, self._pending = self._pending[:size], self._pending[size:]
+            asyncio.create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[Tuple[bytes, int, int], asyncio.Future]]) -> None:
+        caps = self.ocr_service.capabilities
+        try:
+            async with get_ocr_semaphore(self.ocr_service.name, caps.max_concurrency):
+                results = await self.ocr_service.ocr_batch([images for images, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+class PagePipeline:
+    """
+    頁面層級管線：
+    - 每頁獨立執行 PNG 編碼 → OCR → Inpainting（編碼與填補在行程池執行，可一併擦除浮水印）
+    - 有文字層的頁面由 native_text 直接取得文字，不呼叫 OCR
+    - OCR 受後端 semaphore 限制（支援批次的後端合併多頁），其餘步驟與其他頁的 OCR 重疊
+    - 送出 OCR 的圖片依後端能力縮小 / 轉換格式，結果座標換算回頁面圖片
+    - OCR 失敗時重試、斷路並可切換備援後端（services.resilience）；仍失敗的頁面只保留背景圖，
+      記錄在 progress["failed_pages"]，不中止整個任務
+    - tile_ocr 時大於一塊的頁面切成重疊方塊並行 OCR，文字框換算回頁面後合併（services.ocr_tiling）
+    - 投影片依頁碼順序加入 PptxService（在執行緒池逐張加入，不阻塞 event loop）
+    """
+
+    def __init__(self, ocr_service, pptx, progress: dict, window: Optional[int] = None,
+                 on_step: Optional[Callable[[int, str], None]] = None,
+                 native_text: Optional[Callable[[int, int, int], Optional[List[Dict]]]] = None,
+                 remove_watermark: bool = False, tile_ocr: bool = False,
+                 page_numbers: Optional[List[int]] = None):
+        """
+        Args:
+            ocr_service: OCR 後端（OcrBackend），並行數、批次與圖片前處理依其 capabilities
+            pptx: PptxService
+            progress: 任務的 progress dict（就地更新）
+            window: 同時在處理中的頁數上限（預設為 OCR 並行數 x 批次大小 x 2）
+            on_step: 每頁步驟轉換時呼叫 on_step(頁碼, 步驟)
+            native_text: native_text(頁面索引, 寬, 高) 返回原生文字（texts 結構），
+                         None 表示該頁需要 OCR；在執行緒池呼叫
+            remove_watermark: 在填補文字區域時一併擦除右下角浮水印（本地偵測，不呼叫模型）
+            tile_ocr: 分塊 OCR（小字密集的高解析度頁面；請求數隨方塊數增加）
+            page_numbers: 各頁在原始文件中的頁碼（只處理部分頁面時；預設為 1..N），
+                          failed_pages 與步驟事件回報此頁碼
+        """
+        self.ocr_service = ocr_service
+        self.capabilities = ocr_service.capabilities
+        self.pptx = pptx
+        self.progress = progress
+        self.window = window or max(1, self.capabilities.max_concurrency) * max(1, self.capabilities.batch_size) * 2
+        self.on_step = on_step
+        self.native_text = native_text
+        self.remove_watermark = remove_watermark
+        self.tile_ocr = tile_ocr
+        self.page_numbers = page_numbers
+
+        self._slots: Optional[asyncio.Semaphore] = None
+        # 投影片依序組裝，同一時間只有一個 task 寫入 PptxService
+        self._assembly_lock: Optional[asyncio.Lock] = None
+        self._done: Dict[int, tuple] = {}
+        self._next_slide = 0
+        self._pages_done = 0
+        self._total = 0
+        self.ocr_errors = 0
+        self.native_pages = 0
+        self.failed_pages: List[Dict] = []
+        self._counters: Dict[str, int] = {}
+        # 後端回報的輸出 token 數與解碼秒數（tokens/s）
+        self._generation: Dict = {}
+
+    async def run(self, images: Iterable[Image.Image], total_pages: int) -> None:
+        """處理所有頁面，images 依頁面順序提供"""
+        self._total = total_pages
+        self.progress["pages_done"] = 0
+
+        # 頁面在組裝進 PPTX 後才釋放名額，避免等待前頁時累積過多結果
+        self._slots = asyncio.Semaphore(self.window)
+        self._assembly_lock = asyncio.Lock()
+        # 頁面 task 建立時複製 context，後端的生成統計累加到本任務
+        stats_token = generation_stats.set(self._generation)
+        tasks: List[asyncio.Task] = []
+        # 渲染（pdf2image 呼叫 poppler）在執行緒池進行，不阻塞 event loop
+        iterator = iter(images)
+        index = 0
+        try:
+            while True:
+                await self._slots.acquire()
+                img = await run_io(next, iterator, None)
+                if img is None:
+                    self._slots.release()
+                    break
+                # 已有頁面失敗就不再送出新頁
+                for finished in tasks:
+                    if finished.done() and not finished.cancelled() and finished.exception():
+                        raise finished.exception()
+                task = asyncio.create_task(self._process_page(index, img))
+                task.add_done_callback(self._release_on_failure)
+                tasks.append(task)
+                index += 1
+            # 任一頁失敗即中止整個任務
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            generation_stats.reset(stats_token)
+            # 提早結束時也要讓 generator 清理暫存檔
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+
+    async def _process_page(self, index: int, img: Image.Image) -> None:
+        """處理單頁：編碼 → OCR → Inpainting，完成後嘗試依序組裝"""
+        # 轉換圖片為 bytes（原始像素傳入行程池編碼）
+        width, height = img.size
+        img_bytes = await run_cpu(encode_png, PagePayload.from_image(img))
+        del img
+
+        # Step 1: 有文字層的頁面直接擷取；其餘 OCR（本地或雲端，受後端並行上限控制；相同頁面使用快取）
+        texts = None
+        if self.native_text:
+            self._set_step(index, "native_text")
+            texts = await run_io(self.native_text, index, width, height)
+        if texts is not None:
+            self.native_pages += 1
+            self.progress["native_pages"] = self.native_pages
+        else:
+            self._set_step(index, "ocr")
+            ocr_result = await self._ocr(img_bytes, width, height)
+            texts = ocr_result.get("texts", [])
+            if ocr_result.get("error"):
+                self.ocr_errors += 1
+                self.failed_pages.append({"page": self._page_number(index), "error": ocr_result["error"]})
+                self.progress["ocr_errors"] = self.ocr_errors
+                self.progress["failed_pages"] = sorted(self.failed_pages, key=lambda p: p["page"])
+                self._set_step(index, "ocr_failed")
+
+        # Step 2: Inpainting（移除文字區域與浮水印）
+        self._set_step(index, "inpainting")
+        if texts or self.remove_watermark:
+            bg_bytes = await self.ocr_service.inpaint_background(img_bytes, texts, self.remove_watermark)
+        else:
+            bg_bytes = img_bytes
+
+        self._done[index] = (bg_bytes, texts)
+        self._pages_done += 1
+        await self._assemble()
+
+    async def _ocr(self, img_bytes: bytes, width: int, height: int) -> Dict:
+        """
+        依序嘗試主要後端與備援後端（查詢各自的 OCR 快取，未命中才呼叫）
+
+        Returns:
+            OCR 結果；所有後端都失敗時為 {"texts": [], "error": ...}
+        """
+        from services.ocr_backend import get_backend
+
+        errors = []
+        for name in failover_chain(self.ocr_service.name):
+            backend = self.ocr_service if name == self.ocr_service.name else get_backend(name)
+            try:
+                result = await self._ocr_with(backend, img_bytes, width, height)
+            except CircuitOpenError as e:
+                errors.append(str(e))
+                continue
+            except Exception as e:
+                logger.error(f"{name} OCR 失敗: {type(e).__name__}: {e}")
+                # httpx 等錯誤訊息附有說明行，只保留第一行
+                errors.append(f"{name}: {(str(e).splitlines() or [type(e).__name__])[0]}")
+                continue
+            if backend is not self.ocr_service:
+                self._count("failovers")
+            return result
+        self._publish_counters()
+        return {"texts": [], "error": "；".join(errors)}
+
+    async def _ocr_with(self, backend, img_bytes: bytes, width: int, height: int) -> Dict:
+        """以單一後端 OCR（快取 → 前處理 → 重試 / hedging / 斷路，可分塊），失敗時拋出例外"""
+        caps = backend.capabilities
+        tiles, variant = [], ""
+        if self.tile_ocr:
+            tile_size = tile_size_for(caps)
+            tiles = plan_tiles(width, height, tile_size)
+            if len(tiles) > 1:
+                variant = tiling_variant(tile_size)
+
+        cache = get_ocr_cache()
+        key = ocr_cache_key(img_bytes, backend, variant)
+        cached = await run_io(cache.get, key)
+        if cached is not None:
+            self._count("cache_hits")
+            return cached
+
+        if variant:
+            result = await self._ocr_tiles(backend, img_bytes, tiles, width, height)
+        else:
+            result = await self._ocr_page(backend, img_bytes, width, height)
+        await run_io(cache.put, key, result)
+        return result
+
+    async def _ocr_page(self, backend, img_bytes: bytes, width: int, height: int) -> Dict:
+        """整頁 OCR"""
+        # 依後端能力（最長邊、像素預算、編碼與品質）縮小與重新編碼（行程池）
+        caps = backend.capabilities
+        ocr_bytes, ocr_width, ocr_height = img_bytes, width, height
+        if needs_prep(width, height, caps.max_image_side, caps.image_format, caps.max_pixels):
+            ocr_bytes, ocr_width, ocr_height = await run_cpu(
+                prepare_ocr_image, img_bytes, caps.max_image_side, caps.image_format,
+                caps.max_pixels, caps.image_quality
+            )
+
+        result = await self._recognize(backend, ocr_bytes, ocr_width, ocr_height)
+        if (ocr_width, ocr_height) != (width, height) and result.get("texts"):
+            result = {**result, "texts": scale_texts(result["texts"], width / ocr_width, height / ocr_height)}
+        return result
+
+    async def _ocr_tiles(self, backend, img_bytes: bytes, tiles: List[Tuple[int, int, int, int]],
+                         width: int, height: int) -> Dict:
+        """分塊 OCR：裁切編碼（行程池）→ 各塊並行辨識（任一塊失敗即整頁失敗）→ 換算回頁面並合併"""
+        caps = backend.capabilities
+        prepared = await run_cpu(
+            prepare_ocr_tiles, img_bytes, tiles, caps.max_image_side, caps.image_format,
+            caps.max_pixels, caps.image_quality
+        )
+        tasks = [asyncio.ensure_future(self._recognize(backend, *tile_image)) for tile_image in prepared]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        self._count("tiles", len(tiles))
+
+        tile_texts = []
+        for tile, (_, tile_width, tile_height), result in zip(tiles, prepared, results):
+            texts = result.get("texts", [])
+            if (tile_width, tile_height) != tile[2:]:
+                texts = scale_texts(texts, tile[2] / tile_width, tile[3] / tile_height)
+            tile_texts.append((tile, texts))
+        return {"texts": merge_tile_texts(tile_texts, width, height)}
+
+    async def _recognize(self, backend, image_bytes: bytes, width: int, height: int) -> Dict:
+        """送出一張圖片（支援批次的後端經批次收集器，否則受後端並行上限控制）"""
+        caps = backend.capabilities
+        if caps.batch_size > 1:
+            batcher = get_ocr_batcher(backend)
+            result = await call_with_resilience(
+                backend.name, lambda: batcher.submit(image_bytes, width, height),
+                counters=self._counters,
+            )
+        else:
+            result = await call_with_resilience(
+                backend.name, lambda: backend.recognize(image_bytes, width, height),
+                limit=get_ocr_semaphore(backend.name, caps.max_concurrency), counters=self._counters,
+            )
+        self._publish_counters()
+        return result
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        self._counters[key] = self._counters.get(key, 0) + amount
+        self._publish_counters()
+
+    def _publish_counters(self) -> None:
+        """將快取命中、重試、hedging、備援、分塊次數與生成速度寫入進度"""
+        for key, value in self._counters.items():
+            self.progress[f"ocr_{key}"] = value
+        generation = self._generation
+        if generation.get("tokens"):
+            self.progress["ocr_tokens"] = generation["tokens"]
+            self.progress["ocr_tokens_per_second"] = round(generation["tokens"] / max(generation["seconds"], 1e-3), 1)
+            self.progress["ocr_early_stops"] = generation.get("early_stops", 0)
+
+    async def _assemble(self) -> None:
+        """
+        Step 3: 將已完成且順序連續的頁面加入 PPTX
+
+        加入投影片會讀取圖片檔頭、計算 hash 並複製圖片到套件中，在執行緒池進行；
+        持有鎖的 task 依序處理所有可組裝的頁面（包含等待期間完成的頁面）
+        """
+        async with self._assembly_lock:
+            while self._next_slide in self._done:
+                bg_bytes, texts = self._done.pop(self._next_slide)
+                self._set_step(self._next_slide, "pptx")
+                await run_io(self.pptx.add_slide_with_background, bg_bytes, texts)
+                self._next_slide += 1
+                self._slots.release()
+
+        self.progress["pages_done"] = self._pages_done
+        self.progress["current_page"] = self._next_slide
+        self.progress["percent"] = int((self._pages_done / max(1, self._total)) * 90)
+
+    def _release_on_failure(self, task: asyncio.Task) -> None:
+        """失敗的頁面不會被組裝，需自行釋放名額"""
+        if task.cancelled() or task.exception():
+            self._slots.release()
+
+    def _page_number(self, index: int) -> int:
+        """頁面索引對應的原始頁碼（從 1 開始）"""
+        if self.page_numbers and index < len(self.page_numbers):
+            return self.page_numbers[index]
+        return index + 1
+
+    def _set_step(self, index: int, step: str) -> None:
+        """更新目前步驟（回報原始文件的頁碼）"""
+        page = self._page_number(index)
+        self.progress["current_step"] = step
+        self.progress["step_page"] = page
+        if self.on_step:
+            self.on_step(page, step)
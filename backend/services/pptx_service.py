@@ -1,6 +1,6 @@
 """PPTX 生成服務"""
 import logging
-from typing import List, Dict
+from typing import List, Dict, Union
 from pptx import Presentation
 from pptx.util import Inches, Pt, Emu
 from pptx.dml.color import RGBColor
@@ -30,22 +30,30 @@ class PptxService:
             self.prs.slide_width = Inches(10)
             self.prs.slide_height = Inches(7.5)
     
-    def add_slide_with_background(self, background_image: Image.Image, texts: List[Dict]) -> None:
+    def add_slide_with_background(self, background_image: Union[Image.Image, bytes], texts: List[Dict]) -> None:
         """
         新增一張投影片，包含背景圖和文字
         
         Args:
-            background_image: 背景圖片
+            background_image: 背景圖片（PIL Image 或已編碼的 PNG/JPEG bytes）
             texts: 文字資料列表 [{content, x, y, width, height, font_size, color, ...}]
         """
         # 使用空白版面
         blank_layout = self.prs.slide_layouts[6]
         slide = self.prs.slides.add_slide(blank_layout)
         
-        # 儲存背景圖到 bytes
-        img_bytes = io.BytesIO()
-        background_image.save(img_bytes, format='PNG')
-        img_bytes.seek(0)
+        if isinstance(background_image, bytes):
+            # 已編碼的圖片直接使用，只讀取檔頭取得尺寸
+            img_bytes = io.BytesIO(background_image)
+            with Image.open(img_bytes) as header:
+                img_width, img_height = header.size
+            img_bytes.seek(0)
+        else:
+            # 儲存背景圖到 bytes
+            img_bytes = io.BytesIO()
+            background_image.save(img_bytes, format='PNG')
+            img_bytes.seek(0)
+            img_width, img_height = background_image.size
         
         # 添加背景圖（填滿整個投影片）
         slide.shapes.add_picture(
@@ -55,8 +63,8 @@ class PptxService:
         )
         
         # 計算縮放比例
-        scale_x = self.prs.slide_width / Emu(background_image.width * 914400 / 96)
-        scale_y = self.prs.slide_height / Emu(background_image.height * 914400 / 96)
+        scale_x = self.prs.slide_width / Emu(img_width * 914400 / 96)
+        scale_y = self.prs.slide_height / Emu(img_height * 914400 / 96)
         
         # 添加文字框
         for text_data in texts:
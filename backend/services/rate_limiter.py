@@ -0,0 +1,117 @@
+"""速率限制 - 每分鐘請求數（RPM）與 token 數（TPM）的 token bucket，額度不足時排隊等待
+
+bucket 只在單一行程內有效；多個行程共用同一組配額時，由呼叫端將配額平均分配（見 budget_share）
+"""
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucketLimiter:
+    """
+    雙 token bucket：請求數與 token 數各自以每分鐘額度連續補充
+    - acquire() 依到達順序排隊（asyncio.Lock 先到先服務），額度足夠才放行
+    - 送出前以估計值扣除 token，回應後以 settle() 依實際用量補正
+    - 遇到伺服器端配額錯誤時以 pause() 暫停放行
+    rpm / tpm 為 0 表示不限制該項
+    """
+
+    def __init__(self, rpm: int, tpm: int, name: Optional[str] = None):
+        """name：登記名稱，stats 由 limiter_stats() 一併回報"""
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._waiting = 0
+        self._counters = {"requests": 0, "queued": 0, "wait_seconds": 0.0, "paused": 0}
+        if name:
+            _limiters[name] = self
+
+    async def acquire(self, tokens: int) -> None:
+        """等待直到有一個請求與 tokens 個 token 的額度"""
+        # 單次請求超過整個 bucket 時只要求 bucket 全滿，避免永遠等不到
+        tokens = min(tokens, self.tpm) if self.tpm else 0
+        start = time.monotonic()
+        self._waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    delay = self._delay(tokens)
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+                if self.rpm:
+                    self._requests -= 1
+                if self.tpm:
+                    self._tokens -= tokens
+        finally:
+            self._waiting -= 1
+
+        waited = time.monotonic() - start
+        self._counters["requests"] += 1
+        if waited > 0.01:
+            self._counters["queued"] += 1
+            self._counters["wait_seconds"] += waited
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """以實際 token 用量補正送出前的估計（可能使 bucket 暫時為負）"""
+        if self.tpm:
+            self._refill()
+            self._tokens = min(self.tpm, self._tokens + min(estimated, self.tpm) - actual)
+
+    def pause(self, seconds: float) -> None:
+        """暫停放行 seconds 秒（伺服器回報配額用盡時）"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._counters["paused"] += 1
+
+    def stats(self) -> Dict:
+        self._refill()
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "available_requests": round(self._requests, 2) if self.rpm else None,
+            "available_tokens": round(self._tokens) if self.tpm else None,
+            "waiting": self._waiting,
+            **{k: round(v, 3) if isinstance(v, float) else v for k, v in self._counters.items()},
+        }
+
+    def _delay(self, tokens: int) -> float:
+        """距離額度足夠還需等待的秒數（0 表示可立即放行）"""
+        self._refill()
+        now = time.monotonic()
+        delay = self._paused_until - now
+        if self.rpm and self._requests < 1:
+            delay = max(delay, (1 - self._requests) * 60 / self.rpm)
+        if self.tpm and self._tokens < tokens:
+            delay = max(delay, (tokens - self._tokens) * 60 / self.tpm)
+        return delay
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+
+_limiters: Dict[str, TokenBucketLimiter] = {}
+
+
+def budget_share(limit: int, shares: int) -> int:
+    """多個行程平分每分鐘額度時每個行程的額度（0 維持不限制，至少為 1）"""
+    if not limit:
+        return 0
+    return max(1, limit // max(1, shares))
+
+
+def limiter_stats() -> Dict[str, Dict]:
+    """本行程已建立的具名 limiter 狀態"""
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
@@ -0,0 +1,268 @@
+"""
+OCR 呼叫韌性 - 重試（指數退避 + jitter）、hedged request、各後端的 circuit breaker 與備援後端
+
+- 可重試的錯誤（逾時、連線失敗、408 / 429 / 5xx、模型輸出無法解析）以 full jitter 指數退避重試；
+  Gemini 的配額錯誤（429）由 gemini_service 依速率限制器暫停並重新排隊，這裡不再重試
+- 同一後端連續故障達門檻即斷路，期間直接失敗（不送出請求），逾時後放行一個探測請求；
+  配額錯誤、模型輸出異常與不可重試的錯誤（如 4xx、驗證失敗）不改變斷路狀態
+- OCR_HEDGE_QUANTILE > 0 時，請求超過近期延遲的該分位數仍未完成，就再送出一次，取先完成者
+- OCR_FAILOVER 設定後端失敗（或斷路）時改用的後端，預設不切換（雲端後端有費用與隱私考量）
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 每次呼叫失敗後最多重試次數
+OCR_RETRIES = int(os.getenv("OCR_RETRIES", "3"))
+# 退避時間：random(0, min(OCR_BACKOFF_MAX, OCR_BACKOFF_BASE * 2^n)) 秒
+OCR_BACKOFF_BASE = float(os.getenv("OCR_BACKOFF_BASE", "0.5"))
+OCR_BACKOFF_MAX = float(os.getenv("OCR_BACKOFF_MAX", "8"))
+# hedged request 的延遲分位數（如 0.95；0 表示關閉）與所需的最少延遲樣本數
+OCR_HEDGE_QUANTILE = float(os.getenv("OCR_HEDGE_QUANTILE", "0"))
+OCR_HEDGE_MIN_SAMPLES = int(os.getenv("OCR_HEDGE_MIN_SAMPLES", "20"))
+# circuit breaker：連續失敗次數門檻與斷路秒數
+OCR_CIRCUIT_FAILURES = int(os.getenv("OCR_CIRCUIT_FAILURES", "5"))
+OCR_CIRCUIT_RESET = float(os.getenv("OCR_CIRCUIT_RESET", "30"))
+# 備援後端："ollama=gemini,gemini=ollama"（失敗的後端=改用的後端）
+OCR_FAILOVER = os.getenv("OCR_FAILOVER", "")
+
+# 用於計算 hedging 延遲的近期成功請求數
+_LATENCY_SAMPLES = 200
+
+
+class CircuitOpenError(Exception):
+    """後端斷路中，未送出請求"""
+
+    def __init__(self, backend: str):
+        super().__init__(f"{backend} 暫停使用（連續失敗，斷路中）")
+        self.backend = backend
+
+
+def is_quota_error(exc: BaseException) -> bool:
+    """配額 / 速率限制錯誤（429）：後端正常，只是請求太多"""
+    import httpx
+
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429
+    try:
+        from google.api_core import exceptions as google_exceptions
+        return isinstance(exc, (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted))
+    except ImportError:
+        return False
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """錯誤是否值得重試（暫時性錯誤或模型輸出異常）"""
+    import httpx
+
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status in (408, 429) or status >= 500
+    try:
+        from google.api_core import exceptions as google_exceptions
+        # Gemini 的 429 已在 gemini_service 依速率限制器重新排隊，重試用盡才會拋出
+        if isinstance(exc, (google_exceptions.ServerError, google_exceptions.DeadlineExceeded)):
+            return True
+    except ImportError:
+        pass
+    try:
+        import requests
+        if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+            return True
+    except ImportError:
+        pass
+    return getattr(exc, "retryable", False)
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """錯誤是否代表後端故障（計入 circuit breaker；模型輸出異常與配額錯誤不算）"""
+    from services.ocr_backend import OcrResponseError
+
+    return is_retryable(exc) and not isinstance(exc, OcrResponseError) and not is_quota_error(exc)
+
+
+def backoff_delay(attempt: int) -> float:
+    """第 attempt 次重試前的等待秒數（full jitter，attempt 從 0 開始）"""
+    return random.uniform(0, min(OCR_BACKOFF_MAX, OCR_BACKOFF_BASE * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    單一後端的斷路器（closed → open → half_open → closed）
+    - closed：正常放行，連續 failure_threshold 次後端故障後斷路
+    - open：reset_timeout 秒內直接拒絕
+    - half_open：只放行一個探測請求，成功則恢復，失敗則再次斷路
+    """
+
+    def __init__(self, name: str, failure_threshold: int = OCR_CIRCUIT_FAILURES,
+                 reset_timeout: float = OCR_CIRCUIT_RESET):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._counters = {"opened": 0, "rejected": 0}
+
+    def allow(self) -> bool:
+        """是否可以送出請求"""
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self._counters["rejected"] += 1
+        return False
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info(f"OCR 後端 {self.name} 恢復")
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def release(self) -> None:
+        """請求結束但無法判斷後端是否正常：不改變狀態，只讓出探測名額"""
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            logger.warning(f"OCR 後端 {self.name} 斷路 {self.reset_timeout:.0f} 秒（連續 {self.failures} 次失敗）")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._counters["opened"] += 1
+
+    def stats(self) -> Dict:
+        return {"state": self.state, "failures": self.failures, **self._counters}
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[str, deque] = {}
+
+
+def get_circuit_breaker(backend: str) -> CircuitBreaker:
+    """取得後端的斷路器（行程內共用）"""
+    if backend not in _breakers:
+        _breakers[backend] = CircuitBreaker(backend)
+    return _breakers[backend]
+
+
+def failover_chain(backend: str) -> List[str]:
+    """依序嘗試的後端名稱（主要後端在前，接著是 OCR_FAILOVER 設定的備援）"""
+    failover = {}
+    for entry in OCR_FAILOVER.split(","):
+        if "=" in entry:
+            name, target = entry.split("=", 1)
+            failover[name.strip()] = target.strip()
+
+    chain = [backend]
+    while chain[-1] in failover and failover[chain[-1]] not in chain:
+        chain.append(failover[chain[-1]])
+    return chain
+
+
+def hedge_delay(backend: str) -> Optional[float]:
+    """送出 hedged request 前的等待秒數（None 表示不 hedge）"""
+    samples = _latencies.get(backend)
+    if OCR_HEDGE_QUANTILE <= 0 or not samples or len(samples) < OCR_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * OCR_HEDGE_QUANTILE))]
+
+
+async def _hedged(attempt: Callable[[], Awaitable], delay: Optional[float],
+                  on_hedge: Optional[Callable[[], None]] = None):
+    """執行 attempt()；超過 delay 秒仍未完成時並行送出第二次，返回先成功者並取消另一個"""
+    if delay is None:
+        return await attempt()
+
+    tasks = {asyncio.ensure_future(attempt())}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            tasks.add(asyncio.ensure_future(attempt()))
+            if on_hedge:
+                on_hedge()
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def call_with_resilience(backend: str, call: Callable[[], Awaitable[Dict]],
+                               limit: Optional[asyncio.Semaphore] = None,
+                               counters: Optional[Dict] = None) -> Dict:
+    """
+    以重試、hedging 與 circuit breaker 呼叫後端
+
+    Args:
+        backend: 後端名稱（斷路器與延遲統計依此區分）
+        call: 送出一次請求的 coroutine function
+        limit: 每次嘗試時持有的並行名額（退避等待期間不佔用）
+        counters: 就地累加 retries / hedged 次數（任務進度用）
+
+    Raises:
+        CircuitOpenError: 後端斷路中
+        Exception: 不可重試的錯誤，或重試用盡時的最後一個錯誤
+    """
+    breaker = get_circuit_breaker(backend)
+    samples = _latencies.setdefault(backend, deque(maxlen=_LATENCY_SAMPLES))
+    counters = counters if counters is not None else {}
+
+    async def timed():
+        start = time.monotonic()
+        result = await call()
+        samples.append(time.monotonic() - start)
+        return result
+
+    async def attempt():
+        if limit is None:
+            return await timed()
+        async with limit:
+            return await timed()
+
+    def on_hedge():
+        counters["hedged"] = counters.get("hedged", 0) + 1
+
+    for retry in range(OCR_RETRIES + 1):
+        if not breaker.allow():
+            raise CircuitOpenError(backend)
+        try:
+            result = await _hedged(attempt, hedge_delay(backend), on_hedge)
+        except Exception as e:
+            if is_backend_failure(e):
+                breaker.record_failure()
+            else:
+                # 輸出格式錯誤、配額或請求本身的錯誤：不代表後端故障，也不代表已恢復
+                breaker.release()
+            if not is_retryable(e) or retry == OCR_RETRIES:
+                raise
+            delay = backoff_delay(retry)
+            counters["retries"] = counters.get("retries", 0) + 1
+            logger.warning(f"{backend} OCR 失敗（{type(e).__name__}: {e}），{delay:.1f} 秒後重試 {retry + 1}/{OCR_RETRIES}")
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
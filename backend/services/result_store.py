@@ -0,0 +1,153 @@
+"""轉換結果儲存 - 磁碟為主，熱門結果在記憶體預算內快取"""
+import os
+import time
+import heapq
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from services.cache_service import link_or_copy
+from services.job_queue import RESULT_DIR
+
+logger = logging.getLogger(__name__)
+
+# 記憶體層總預算；超過時最久未使用的結果只留在磁碟
+RESULT_MEMORY_BUDGET = int(os.getenv("RESULT_MEMORY_BUDGET_MB", "64")) * 1024 * 1024
+# 超過此大小的結果一律只放磁碟
+RESULT_SPILL_THRESHOLD = int(os.getenv("RESULT_SPILL_THRESHOLD_MB", "8")) * 1024 * 1024
+# 記憶體層保留時間（秒）
+RESULT_MEMORY_TTL = int(os.getenv("RESULT_MEMORY_TTL", "600"))
+
+
+class ResultStore:
+    """
+    結果分兩層：
+    - 磁碟：所有結果（worker 寫入，API 行程共用）
+    - 記憶體：小型且近期下載的結果，LRU + 到期 heap
+    """
+
+    def __init__(self, result_dir: str = RESULT_DIR, memory_budget: int = RESULT_MEMORY_BUDGET,
+                 spill_threshold: int = RESULT_SPILL_THRESHOLD, memory_ttl: int = RESULT_MEMORY_TTL):
+        self.result_dir = result_dir
+        self.memory_budget = memory_budget
+        self.spill_threshold = spill_threshold
+        self.memory_ttl = memory_ttl
+        os.makedirs(result_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._expires: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._memory_bytes = 0
+        self._counters = {"hits": 0, "misses": 0, "spilled": 0, "expired": 0, "deleted": 0}
+
+    def path_for(self, task_id: str) -> str:
+        """結果檔案路徑"""
+        return os.path.join(self.result_dir, f"{task_id}.pptx")
+
+    def save(self, task_id: str, data: bytes) -> str:
+        """寫入結果檔案（先寫暫存檔再改名，避免讀到不完整檔案）"""
+        path = self.path_for(task_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def link(self, task_id: str, src_path: str) -> str:
+        """由既有檔案（例如轉換快取）建立結果，優先使用 hard link"""
+        path = self.path_for(task_id)
+        tmp_path = f"{path}.tmp"
+        link_or_copy(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    def get(self, task_id: str, path: Optional[str] = None) -> Optional[bytes]:
+        """取得結果：先查記憶體，否則讀磁碟並視預算放入記憶體"""
+        with self._lock:
+            data = self._memory.get(task_id)
+            if data is not None:
+                self._memory.move_to_end(task_id)
+                self._counters["hits"] += 1
+                return data
+            self._counters["misses"] += 1
+
+        try:
+            with open(path or self.path_for(task_id), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        if len(data) <= self.spill_threshold:
+            self._remember(task_id, data)
+        return data
+
+    def delete(self, task_id: str, path: Optional[str] = None) -> None:
+        """刪除結果（記憶體與磁碟）"""
+        with self._lock:
+            self._drop(task_id)
+        try:
+            os.unlink(path or self.path_for(task_id))
+            self._counters["deleted"] += 1
+        except FileNotFoundError:
+            pass
+
+    def sweep(self) -> int:
+        """移除記憶體層中到期的結果（heap 依到期時間排序，每次 O(log n)）"""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, task_id = heapq.heappop(self._heap)
+                # 已被淘汰或重新放入（到期時間不同）的項目直接略過
+                if self._expires.get(task_id) == expires_at:
+                    self._drop(task_id)
+                    self._counters["expired"] += 1
+                    removed += 1
+        return removed
+
+    def stats(self) -> Dict:
+        """記憶體層使用量與計數器"""
+        with self._lock:
+            return {
+                "memory_results": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_budget": self.memory_budget,
+                **self._counters,
+            }
+
+    def _remember(self, task_id: str, data: bytes) -> None:
+        """放入記憶體層，超過預算時淘汰最久未使用的結果（仍保留在磁碟）"""
+        with self._lock:
+            self._drop(task_id)
+            while self._memory and self._memory_bytes + len(data) > self.memory_budget:
+                oldest, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                self._expires.pop(oldest, None)
+                self._counters["spilled"] += 1
+            if len(data) > self.memory_budget:
+                return
+            expires_at = time.time() + self.memory_ttl
+            self._memory[task_id] = data
+            self._memory_bytes += len(data)
+            self._expires[task_id] = expires_at
+            heapq.heappush(self._heap, (expires_at, task_id))
+
+    def _drop(self, task_id: str) -> None:
+        """從記憶體層移除（需持有 lock）"""
+        data = self._memory.pop(task_id, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+        self._expires.pop(task_id, None)
+
+
+_store: Optional[ResultStore] = None
+
+
+def get_result_store() -> ResultStore:
+    """取得行程內共用的 ResultStore"""
+    global _store
+    if _store is None:
+        _store = ResultStore()
+    return _store
@@ -0,0 +1,245 @@
+"""
+文字層偵測 - 判斷頁面是否有超過 10 個字元的文字層
+
+不呼叫 extract_text：先看 /Font 資源（沒有字型就不可能有文字），
+再掃描內容串流中 BT…ET 區塊內的字串運算元，累計足夠字元即停止。
+無法確定時（字元數接近門檻、文字在 Form XObject 中）才退回 extract_text，
+因此判斷結果與原本逐頁 extract_text 相同。
+"""
+import os
+import math
+import random
+import logging
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# 與分析 API 原本的判斷相同：去除空白後超過 10 個字元
+MIN_TEXT_CHARS = 10
+# 頁數超過此值時分散到行程池並行偵測
+PARALLEL_MIN_PAGES = int(os.getenv("TEXT_SCAN_PARALLEL_MIN_PAGES", "64"))
+
+_WHITESPACE = frozenset(b" \t\r\n\f\x00")
+_DELIMITERS = frozenset(b" \t\r\n\f\x00()<>[]{}/%")
+
+
+def page_has_text(page) -> bool:
+    """單頁是否有文字層"""
+    fonts = page_fonts(page)
+    if not fonts and not _has_form_xobjects(page):
+        return False
+
+    if fonts:
+        # CID 字型（Type0）每個字元至少 2 bytes，以保守值估計字元數
+        bytes_per_char = 2 if any(f == "/Type0" for f in fonts) else 1
+        limit = (MIN_TEXT_CHARS + 1) * bytes_per_char - 1
+        try:
+            if _count_text_bytes(b"\n".join(content_streams(page)), limit) > limit:
+                return True
+        except Exception as e:
+            logger.debug(f"Content stream scan failed: {e}")
+
+    # 無法確定：退回完整的文字擷取
+    return _extract_text_check(page)
+
+
+def classify_pages(path: str, pages: Optional[Sequence[int]] = None) -> List[bool]:
+    """
+    逐頁偵測文字層（頁碼從 1 開始，None 表示全部）
+
+    頁數多時切成區段交給行程池，每個行程各自以 mmap 開啟檔案
+    """
+    from services.executor_service import CPU_WORKERS, get_process_pool
+    from services.pdf_service import open_pdf
+
+    if pages is None:
+        with open_pdf(path) as reader:
+            pages = list(range(1, len(reader.pages) + 1))
+    else:
+        pages = list(pages)
+
+    if len(pages) < PARALLEL_MIN_PAGES or CPU_WORKERS <= 1:
+        return _classify_range(path, pages)
+
+    size = math.ceil(len(pages) / CPU_WORKERS)
+    chunks = [pages[i:i + size] for i in range(0, len(pages), size)]
+    results = get_process_pool().map(_classify_range, [path] * len(chunks), chunks)
+    return [flag for chunk in results for flag in chunk]
+
+
+def estimate_text_pages(path: str, page_count: int, sample_size: int,
+                        z: float = 1.96, seed: Optional[int] = None) -> Dict:
+    """
+    抽樣估計有文字層的頁數（大型文件用）
+
+    Returns:
+        {"pages_with_text", "low", "high", "sampled": {頁碼: 是否有文字}}
+        low / high 為 Wilson 信賴區間（z=1.96 約 95%）換算成頁數
+    """
+    rng = random.Random(seed)
+    # 分層抽樣：每個區段抽一頁，避免樣本集中在文件某一段
+    n = min(sample_size, page_count)
+    edges = [round(i * page_count / n) for i in range(n + 1)]
+    sample = [rng.randint(edges[i] + 1, edges[i + 1]) for i in range(n)]
+
+    flags = classify_pages(path, sample)
+    hits = sum(flags)
+    p = hits / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+
+    # 已抽到的頁面是確定值，區間只套用在未抽樣的頁面
+    rest = page_count - n
+    return {
+        "pages_with_text": hits + round(p * rest),
+        "low": hits + math.floor(max(0.0, center - margin) * rest),
+        "high": hits + math.ceil(min(1.0, center + margin) * rest),
+        "sampled": dict(zip(sample, flags)),
+    }
+
+
+def _classify_range(path: str, pages: List[int]) -> List[bool]:
+    from services.pdf_service import open_pdf
+
+    with open_pdf(path) as reader:
+        return [page_has_text(reader.pages[i - 1]) for i in pages]
+
+
+def _resources(obj) -> Dict:
+    resources = obj.get("/Resources")
+    return resources.get_object() if resources else {}
+
+
+def page_fonts(page) -> List[str]:
+    """頁面字型資源的 /Subtype"""
+    fonts = _resources(page).get("/Font")
+    if not fonts:
+        return []
+    return [str(ref.get_object().get("/Subtype")) for ref in fonts.get_object().values()]
+
+
+def _has_form_xobjects(page) -> bool:
+    xobjects = _resources(page).get("/XObject")
+    if not xobjects:
+        return False
+    return any(ref.get_object().get("/Subtype") == "/Form" for ref in xobjects.get_object().values())
+
+
+def content_streams(page):
+    """逐一取得頁面內容串流（解壓縮後的 bytes）"""
+    contents = page.get("/Contents")
+    if contents is None:
+        return
+    contents = contents.get_object()
+    streams = contents if isinstance(contents, list) else [contents]
+    for stream in streams:
+        yield stream.get_object().get_data()
+
+
+def _count_text_bytes(data: bytes, limit: int) -> int:
+    """
+    累計 BT…ET 內字串運算元的非空白 bytes，超過 limit 即返回
+
+    字面字串 (…) 處理跳脫與巢狀括號；十六進位字串 <…> 解碼後同樣只計非空白 bytes
+    """
+    total = 0
+    in_text = False
+    i = 0
+    n = len(data)
+    while i < n:
+        c = data[i]
+        if c == 0x25:  # % 註解
+            while i < n and data[i] not in (0x0A, 0x0D):
+                i += 1
+        elif c == 0x28:  # (
+            i, count = _scan_literal(data, i + 1)
+            if in_text:
+                total += count
+                if total > limit:
+                    return total
+            continue
+        elif c == 0x3C:  # <
+            if i + 1 < n and data[i + 1] == 0x3C:  # << 字典
+                i += 2
+                continue
+            end = data.find(b">", i + 1)
+            if end < 0:
+                break
+            if in_text:
+                total += _hex_text_bytes(data[i + 1:end])
+                if total > limit:
+                    return total
+            i = end + 1
+            continue
+        elif c not in _DELIMITERS:
+            # 讀取一個 token，只需辨識 BT / ET / 行內圖片
+            start = i
+            while i < n and data[i] not in _DELIMITERS:
+                i += 1
+            token = data[start:i]
+            if token == b"BT":
+                in_text = True
+            elif token == b"ET":
+                in_text = False
+            elif token == b"ID":
+                # 行內圖片的二進位資料，跳到 EI
+                end = data.find(b"EI", i)
+                i = n if end < 0 else end + 2
+            continue
+        i += 1
+    return total
+
+
+def _hex_text_bytes(hex_data: bytes) -> int:
+    """十六進位字串解碼後的非空白 bytes（奇數位數時最後補 0；格式錯誤時不計入）"""
+    digits = bytes(b for b in hex_data if b not in _WHITESPACE)
+    if len(digits) % 2:
+        digits += b"0"
+    try:
+        decoded = bytes.fromhex(digits.decode("ascii"))
+    except ValueError:
+        return 0
+    return sum(1 for b in decoded if b not in _WHITESPACE)
+
+
+def _scan_literal(data: bytes, i: int):
+    """掃描字面字串，返回 (結束位置, 非空白 bytes 數)"""
+    depth = 1
+    count = 0
+    n = len(data)
+    while i < n:
+        c = data[i]
+        if c == 0x5C:  # 反斜線跳脫
+            i += 1
+            if i < n and data[i] in b"01234567":
+                # 八進位跳脫最多 3 位數
+                j = i
+                while j < n and j - i < 3 and data[j] in b"01234567":
+                    j += 1
+                count += int(data[i:j], 8) not in _WHITESPACE
+                i = j
+                continue
+            if i < n and data[i] not in b"\r\n":
+                count += data[i] not in b"nrtbf"
+            i += 1
+            continue
+        if c == 0x28:
+            depth += 1
+        elif c == 0x29:
+            depth -= 1
+            if depth == 0:
+                return i + 1, count
+        if c not in _WHITESPACE:
+            count += 1
+        i += 1
+    return i, count
+
+
+def _extract_text_check(page) -> bool:
+    try:
+        text = page.extract_text()
+    except Exception as e:
+        logger.warning(f"Text extraction failed: {e}")
+        return False
+    return bool(text and len(text.strip()) > MIN_TEXT_CHARS)
@@ -0,0 +1,410 @@
+"""上傳檔案儲存 - 有到期時間與總容量上限，淘汰時一併刪除磁碟檔案
+
+登記與分段上傳工作階段存在任務佇列的 SQLite 資料庫，多個 API 行程 / 實例共用，
+任何一個行程都能以 file_id / upload_id 找到其他行程收到的上傳
+"""
+import os
+import time
+import tempfile
+import threading
+import logging
+from typing import Dict, List, Optional
+
+from services.job_queue import JOB_DB_PATH, connect, init_schema
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "94repdf_uploads"))
+# 上傳檔案總容量上限（Cloud Run 的 /tmp 佔用記憶體）
+UPLOAD_STORE_BUDGET = int(os.getenv("UPLOAD_STORE_BUDGET_MB", "512")) * 1024 * 1024
+# 最後一次使用後保留的時間（秒）
+UPLOAD_TTL = int(os.getenv("UPLOAD_TTL", "3600"))
+# 最近使用過的檔案（可能正在排隊或處理中）不因容量不足而淘汰（秒）
+UPLOAD_MIN_RETAIN = int(os.getenv("UPLOAD_MIN_RETAIN", "600"))
+# 中斷的上傳暫存檔（含分段上傳工作階段）閒置多久後刪除（秒）
+PARTIAL_UPLOAD_TTL = int(os.getenv("UPLOAD_SESSION_TTL", "3600"))
+# 同時進行中的分段上傳上限（所有行程合計；被放棄的工作階段在逾時前仍計入）
+UPLOAD_MAX_SESSIONS = int(os.getenv("UPLOAD_MAX_SESSIONS", "32"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    file_id   TEXT PRIMARY KEY,
+    sha256    TEXT NOT NULL UNIQUE,
+    path      TEXT NOT NULL,
+    filename  TEXT NOT NULL,
+    size      INTEGER NOT NULL,
+    pages     INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_last_used ON uploads (last_used);
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    upload_id    TEXT PRIMARY KEY,
+    path         TEXT NOT NULL,
+    filename     TEXT NOT NULL,
+    size         INTEGER NOT NULL,
+    sha256       TEXT,
+    chunk_size   INTEGER NOT NULL,
+    total_chunks INTEGER NOT NULL,
+    last_used    REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    upload_id TEXT NOT NULL,
+    idx       INTEGER NOT NULL,
+    PRIMARY KEY (upload_id, idx)
+);
+"""
+
+_FILE_COLUMNS = "file_id, sha256, path, filename, size, pages, last_used"
+# 排隊或處理中的任務仍在讀取的上傳檔案（worker 逐頁重新開啟路徑），不因容量或到期而刪除
+_NOT_IN_USE = (
+    "NOT EXISTS (SELECT 1 FROM jobs WHERE jobs.status IN ('pending', 'processing') "
+    "AND json_extract(jobs.params, '$.path') = uploads.path)"
+)
+_SESSION_COLUMNS = "upload_id, path, filename, size, sha256, chunk_size, total_chunks, last_used"
+
+
+class CapacityExhausted(Exception):
+    """容量不足，且沒有可淘汰的檔案"""
+
+
+class TooManySessions(CapacityExhausted):
+    """進行中的分段上傳已達上限"""
+
+
+class UploadStore:
+    """
+    file_id → 檔案資訊（path、filename、size、pages、sha256）
+    - 依最後使用時間做 LRU，總大小不超過 budget
+    - 超過 ttl 未使用的檔案由 sweep() 刪除
+    - 相同內容（sha256）只存一份
+    - 分段上傳工作階段預先保留完整大小（即暫存檔 .part 的大小），完成或逾時後釋放；
+      同時進行的工作階段數量有上限，放棄的上傳不會無限累積
+    - 登記存在共用 SQLite，容量檢查與淘汰在同一個交易內完成（多行程不會超出 budget）
+    - 排隊或處理中的任務使用的檔案（同一資料庫的 jobs 表）不淘汰也不到期
+    """
+
+    def __init__(self, upload_dir: str = UPLOAD_DIR, budget: int = UPLOAD_STORE_BUDGET,
+                 ttl: int = UPLOAD_TTL, min_retain: int = UPLOAD_MIN_RETAIN,
+                 db_path: str = JOB_DB_PATH):
+        self.upload_dir = upload_dir
+        self.budget = budget
+        self.ttl = ttl
+        self.min_retain = min_retain
+        self.db_path = db_path
+        os.makedirs(upload_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+
+        self._local = threading.local()
+        # 計數器只統計本行程的操作
+        self._counter_lock = threading.Lock()
+        self._counters = {"added": 0, "deduplicated": 0, "expired": 0, "evicted": 0, "rejected": 0}
+        conn = self._conn()
+        init_schema(conn)
+        conn.executescript(_SCHEMA)
+        self._remove_orphans()
+
+    def _conn(self):
+        """每個執行緒一個連線"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.db_path)
+            self._local.conn = conn
+        return conn
+
+    def path_for(self, sha256: str, ext: str) -> str:
+        """以內容 hash 命名的檔案路徑"""
+        return os.path.join(self.upload_dir, f"{sha256}{ext}")
+
+    def temp_path(self, name: str) -> str:
+        """上傳中的暫存檔路徑"""
+        return os.path.join(self.upload_dir, f".{name}.part")
+
+    def has_room(self, size: int = 0) -> bool:
+        """淘汰可淘汰的檔案後，是否放得下 size bytes"""
+        return self._available(self._conn(), time.time()) >= size
+
+    def begin_session(self, upload_id: str, session: Dict) -> None:
+        """
+        建立分段上傳工作階段並保留 session["size"] bytes
+
+        Raises:
+            TooManySessions: 進行中的工作階段已達上限
+            CapacityExhausted: 容量不足
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT COUNT(*) FROM upload_sessions").fetchone()[0] >= UPLOAD_MAX_SESSIONS:
+                conn.execute("COMMIT")
+                self._count("rejected")
+                raise TooManySessions()
+            if self._available(conn, now) < session["size"]:
+                conn.execute("COMMIT")
+                self._count("rejected")
+                raise CapacityExhausted()
+            conn.execute(
+                f"INSERT INTO upload_sessions ({_SESSION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (upload_id, session["path"], session["filename"], session["size"], session.get("sha256"),
+                 session["chunk_size"], session["total_chunks"], now)
+            )
+            conn.execute("COMMIT")
+        except CapacityExhausted:
+            raise
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_session(self, upload_id: str) -> Optional[Dict]:
+        """取得工作階段（received 為已收到的分段索引）並更新最後使用時間"""
+        conn = self._conn()
+        if not conn.execute(
+            "UPDATE upload_sessions SET last_used = ? WHERE upload_id = ?", (time.time(), upload_id)
+        ).rowcount:
+            return None
+        row = conn.execute(
+            f"SELECT {_SESSION_COLUMNS} FROM upload_sessions WHERE upload_id = ?", (upload_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        session = dict(row)
+        session["received"] = {
+            r["idx"] for r in conn.execute("SELECT idx FROM upload_chunks WHERE upload_id = ?", (upload_id,))
+        }
+        return session
+
+    def mark_received(self, upload_id: str, index: int) -> bool:
+        """記錄已寫入的分段，工作階段已不存在時返回 False"""
+        conn = self._conn()
+        if not conn.execute(
+            "UPDATE upload_sessions SET last_used = ? WHERE upload_id = ?", (time.time(), upload_id)
+        ).rowcount:
+            return False
+        conn.execute("INSERT OR IGNORE INTO upload_chunks (upload_id, idx) VALUES (?, ?)", (upload_id, index))
+        return True
+
+    def end_session(self, upload_id: str) -> Optional[Dict]:
+        """結束工作階段並釋放保留的容量（暫存檔由呼叫端處理）"""
+        conn = self._conn()
+        session = self.get_session(upload_id)
+        if session is None:
+            return None
+        # 只有刪除成功的行程取得工作階段（同時完成時另一個視為不存在）
+        if not conn.execute("DELETE FROM upload_sessions WHERE upload_id = ?", (upload_id,)).rowcount:
+            return None
+        conn.execute("DELETE FROM upload_chunks WHERE upload_id = ?", (upload_id,))
+        return session
+
+    def find(self, sha256: str) -> Optional[str]:
+        """相同內容已存在時返回其 file_id"""
+        conn = self._conn()
+        row = conn.execute("SELECT file_id, path FROM uploads WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is None:
+            return None
+        if not os.path.exists(row["path"]):
+            conn.execute("DELETE FROM uploads WHERE file_id = ?", (row["file_id"],))
+            return None
+        self._touch(row["file_id"])
+        self._count("deduplicated")
+        return row["file_id"]
+
+    def add(self, file_id: str, info: Dict) -> str:
+        """
+        登記已寫入磁碟的檔案，容量不足時淘汰最久未使用的檔案
+
+        Returns:
+            實際使用的 file_id（相同內容同時上傳時返回先登記的那一個）
+        Raises:
+            CapacityExhausted: 淘汰後仍放不下（呼叫端負責刪除檔案）
+        """
+        size = info["size"]
+        conn = self._conn()
+        now = time.time()
+        evicted: List[Dict] = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = conn.execute("SELECT file_id FROM uploads WHERE sha256 = ?", (info["sha256"],)).fetchone()
+            if existing is not None:
+                conn.execute("UPDATE uploads SET last_used = ? WHERE file_id = ?", (now, existing["file_id"]))
+                conn.execute("COMMIT")
+                self._count("deduplicated")
+                return existing["file_id"]
+
+            if size > self.budget or self._available(conn, now) < size:
+                conn.execute("COMMIT")
+                self._count("rejected")
+                raise CapacityExhausted()
+            excess = self._used(conn) + size - self.budget
+            if excess > 0:
+                # 最久未使用、且超過 min_retain 的檔案依序淘汰（任務使用中的除外）
+                for row in conn.execute(
+                    f"SELECT {_FILE_COLUMNS} FROM uploads WHERE last_used <= ? AND {_NOT_IN_USE} "
+                    "ORDER BY last_used",
+                    (now - self.min_retain,)
+                ):
+                    if excess <= 0:
+                        break
+                    evicted.append(dict(row))
+                    excess -= row["size"]
+                conn.executemany("DELETE FROM uploads WHERE file_id = ?", [(old["file_id"],) for old in evicted])
+            conn.execute(
+                f"INSERT INTO uploads ({_FILE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_id, info["sha256"], info["path"], info["filename"], size, info["pages"], now)
+            )
+            conn.execute("COMMIT")
+        except CapacityExhausted:
+            raise
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._count("added")
+        self._count("evicted", len(evicted))
+        for old in evicted:
+            self._unlink(old["path"])
+            logger.info(f"Evicted upload {old['filename']} ({old['size']} bytes)")
+        return file_id
+
+    def get(self, file_id: str) -> Optional[Dict]:
+        """取得檔案資訊並更新最後使用時間"""
+        if not self._touch(file_id):
+            return None
+        row = self._conn().execute(f"SELECT {_FILE_COLUMNS} FROM uploads WHERE file_id = ?", (file_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def sweep(self) -> int:
+        """刪除超過 ttl 未使用的檔案與閒置的分段上傳，返回刪除的檔案數量"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 依 last_used 索引只取已到期的範圍；任務使用中的檔案在任務結束後的下一次清理才刪除
+            expired = [dict(row) for row in conn.execute(
+                f"SELECT {_FILE_COLUMNS} FROM uploads WHERE last_used < ? AND {_NOT_IN_USE}", (now - self.ttl,)
+            )]
+            abandoned = [dict(row) for row in conn.execute(
+                "SELECT upload_id, path, filename FROM upload_sessions WHERE last_used < ?",
+                (now - PARTIAL_UPLOAD_TTL,)
+            )]
+            conn.executemany("DELETE FROM uploads WHERE file_id = ?", [(info["file_id"],) for info in expired])
+            conn.executemany("DELETE FROM upload_sessions WHERE upload_id = ?",
+                             [(session["upload_id"],) for session in abandoned])
+            conn.executemany("DELETE FROM upload_chunks WHERE upload_id = ?",
+                             [(session["upload_id"],) for session in abandoned])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._count("expired", len(expired))
+        for info in expired:
+            self._unlink(info["path"])
+            logger.info(f"Cleaned up expired upload: {info['filename']}")
+        for session in abandoned:
+            self._unlink(session["path"])
+            logger.info(f"Cleaned up abandoned chunked upload: {session['filename']}")
+        self._remove_partials()
+        return len(expired)
+
+    def stats(self) -> Dict:
+        """使用量（所有行程）與計數器（本行程）"""
+        conn = self._conn()
+        files, used = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads").fetchone()
+        sessions, reserved = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM upload_sessions"
+        ).fetchone()
+        with self._counter_lock:
+            counters = dict(self._counters)
+        return {
+            "files": files,
+            "bytes": used,
+            "sessions": sessions,
+            "reserved_bytes": reserved,
+            "budget": self.budget,
+            **counters,
+        }
+
+    def discard(self, path: str) -> None:
+        """刪除未登記（或已移除登記）的檔案與其中繼資料"""
+        self._unlink(path)
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        if amount:
+            with self._counter_lock:
+                self._counters[name] += amount
+
+    def _touch(self, file_id: str) -> bool:
+        """更新最後使用時間，檔案未登記時返回 False"""
+        return self._conn().execute(
+            "UPDATE uploads SET last_used = ? WHERE file_id = ?", (time.time(), file_id)
+        ).rowcount > 0
+
+    @staticmethod
+    def _used(conn) -> int:
+        """已登記的檔案與工作階段保留的總大小"""
+        return conn.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM uploads) "
+            "+ (SELECT COALESCE(SUM(size), 0) FROM upload_sessions)"
+        ).fetchone()[0]
+
+    def _available(self, conn, now: float) -> int:
+        """淘汰可淘汰的檔案後的剩餘容量"""
+        reclaimable = conn.execute(
+            f"SELECT COALESCE(SUM(size), 0) FROM uploads WHERE last_used <= ? AND {_NOT_IN_USE}",
+            (now - self.min_retain,)
+        ).fetchone()[0]
+        return self.budget - self._used(conn) + reclaimable
+
+    def _remove_orphans(self) -> None:
+        """啟動時刪除未登記、且已超過 ttl 的檔案（例如登記已被其他行程清除）"""
+        from services.pdf_metadata import METADATA_SUFFIX
+
+        registered = {row["path"] for row in self._conn().execute("SELECT path FROM uploads")}
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for entry in os.scandir(self.upload_dir):
+            path = entry.path[:-len(METADATA_SUFFIX)] if entry.path.endswith(METADATA_SUFFIX) else entry.path
+            if path in registered or entry.name.endswith(".part"):
+                continue
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    self._unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            logger.info(f"Removed {removed} orphaned upload files")
+
+    def _remove_partials(self) -> None:
+        """刪除中斷上傳留下的暫存檔（進行中的分段上傳除外）"""
+        active = {row["path"] for row in self._conn().execute("SELECT path FROM upload_sessions")}
+        cutoff = time.time() - PARTIAL_UPLOAD_TTL
+        for entry in os.scandir(self.upload_dir):
+            if entry.name.endswith(".part") and entry.path not in active:
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        self._unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        from services.pdf_metadata import metadata_path
+
+        # 上傳檔案旁的中繼資料 JSON 一併刪除
+        for target in (path, metadata_path(path)):
+            try:
+                os.unlink(target)
+            except FileNotFoundError:
+                pass
+
+
+_store: Optional[UploadStore] = None
+
+
+def get_upload_store() -> UploadStore:
+    """取得行程內共用的 UploadStore（登記存在共用的 SQLite）"""
+    global _store
+    if _store is None:
+        _store = UploadStore()
+    return _store
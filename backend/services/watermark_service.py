@@ -0,0 +1,144 @@
+"""
+浮水印偵測 - NotebookLM 匯出頁面右下角的四角星標記
+
+只在右下角區域以 numpy 向量運算比對星形模板，每頁只需數毫秒，不呼叫視覺模型。
+模組層級函數，可於行程池執行。
+"""
+import logging
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 搜尋區域：右下角正方形，邊長為頁面短邊的比例
+CORNER_FRACTION = 0.15
+# 與背景色的差異門檻（各色版最大差值）
+DIFF_THRESHOLD = 16
+# 星形大小範圍（相對頁面短邊）與長寬比容許誤差
+MIN_MARK_FRACTION = 0.008
+MAX_MARK_FRACTION = 0.1
+MAX_ASPECT_DEVIATION = 0.35
+# 與模板的 IoU 門檻
+MATCH_THRESHOLD = 0.6
+# 星形模板 |x|^p + |y|^p <= 1 的指數（越小星角越細）
+_TEMPLATE_EXPONENTS = (0.5, 0.6, 0.75)
+# 擦除時向外擴張的比例（涵蓋反鋸齒與壓縮雜訊）
+ERASE_MARGIN = 0.15
+# 分析 API 偵測的頁數
+DETECT_PAGES = 3
+
+
+def find_watermark(arr: np.ndarray) -> Optional[Dict]:
+    """
+    在頁面右下角尋找星形浮水印
+
+    Args:
+        arr: 像素陣列（高 x 寬 x 色版）
+
+    Returns:
+        {"x", "y", "width", "height", "score"}（像素座標，已含擦除邊界），找不到時返回 None
+    """
+    height, width = arr.shape[:2]
+    side = int(min(width, height) * CORNER_FRACTION)
+    if side < 16:
+        return None
+    return _locate(arr[height - side:, width - side:], width, height)
+
+
+def detect_watermark(img: Image.Image) -> Optional[Dict]:
+    """PIL 圖片版本的 find_watermark，只轉換右下角區域"""
+    width, height = img.size
+    side = int(min(width, height) * CORNER_FRACTION)
+    if side < 16:
+        return None
+    corner = img.crop((width - side, height - side, width, height))
+    if corner.mode != 'RGB':
+        corner = corner.convert('RGB')
+    return _locate(np.asarray(corner), width, height)
+
+
+def detect_file_watermark(path: str, meta: Dict, pages: int = DETECT_PAGES) -> bool:
+    """
+    檢查檔案前幾頁是否有浮水印（分析 API 用，於行程池執行）
+
+    整頁圖片頁面直接取出內嵌圖片，其餘頁面需渲染
+    """
+    from services.pdf_service import PdfService
+
+    if meta["kind"] == "image":
+        with Image.open(path) as img:
+            return detect_watermark(img) is not None
+
+    numbers = list(range(1, min(pages, meta["page_count"]) + 1))
+    for img in PdfService().iter_images(path, pages=numbers, meta=meta):
+        if detect_watermark(img) is not None:
+            return True
+    return False
+
+
+def _locate(corner: np.ndarray, width: int, height: int) -> Optional[Dict]:
+    """在右下角區域（corner）中比對星形，座標換算回整頁"""
+    side = corner.shape[0]
+    roi = corner.astype(np.int16)
+    if roi.ndim == 2:
+        roi = roi[:, :, None]
+
+    # 背景色：區域上緣與左緣像素的中位數
+    background = np.median(np.concatenate([roi[0], roi[:, 0]]), axis=0)
+    mask = np.abs(roi - background).max(axis=2) > DIFF_THRESHOLD
+
+    # 取最靠近角落的一塊：列、行投影中最後一段連續區間
+    cols = _last_run(mask.any(axis=0))
+    if cols is None:
+        return None
+    band = mask[:, cols[0]:cols[1]]
+    rows = _last_run(band.any(axis=1))
+    # 內容延伸到搜尋區域外（一般圖文），不是角落標記
+    if rows is None or rows[0] == 0 or cols[0] == 0:
+        return None
+
+    blob = band[rows[0]:rows[1]]
+    blob_h, blob_w = blob.shape
+    short = min(width, height)
+    if not MIN_MARK_FRACTION * short <= max(blob_w, blob_h) <= MAX_MARK_FRACTION * short:
+        return None
+    if abs(blob_w / blob_h - 1) > MAX_ASPECT_DEVIATION:
+        return None
+
+    score = max(_iou(blob, _star_template(blob_h, blob_w, p)) for p in _TEMPLATE_EXPONENTS)
+    if score < MATCH_THRESHOLD:
+        return None
+
+    margin = max(2, round(max(blob_w, blob_h) * ERASE_MARGIN))
+    x0 = max(0, width - side + cols[0] - margin)
+    y0 = max(0, height - side + rows[0] - margin)
+    x1 = min(width, width - side + cols[1] + margin)
+    y1 = min(height, height - side + rows[1] + margin)
+    return {"x": x0, "y": y0, "width": x1 - x0, "height": y1 - y0, "score": round(float(score), 3)}
+
+
+def _last_run(flags: np.ndarray) -> Optional[Tuple[int, int]]:
+    """布林陣列中最後一段連續 True 的 [start, end)"""
+    idx = np.flatnonzero(flags)
+    if idx.size == 0:
+        return None
+    end = idx[-1] + 1
+    gaps = np.flatnonzero(np.diff(idx) > 1)
+    start = idx[gaps[-1] + 1] if gaps.size else idx[0]
+    return int(start), int(end)
+
+
+@lru_cache(maxsize=64)
+def _star_template(height: int, width: int, p: float) -> np.ndarray:
+    """四角星遮罩 |x|^p + |y|^p <= 1（取像素中心）"""
+    ys = (np.arange(height) + 0.5) / height * 2 - 1
+    xs = (np.arange(width) + 0.5) / width * 2 - 1
+    return np.abs(xs)[None, :] ** p + np.abs(ys)[:, None] ** p <= 1
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 0.0
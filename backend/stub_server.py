@@ -0,0 +1,205 @@
+"""
+本地 OCR stub 伺服器 - 模擬 Gemini REST API 與 Ollama，測試時不需要真正的模型或 API 金鑰
+
+    python stub_server.py --port 8790 --latency 0.5 --rpm 30
+
+    GEMINI_API_ENDPOINT=http://localhost:8790 GEMINI_API_KEY=stub OLLAMA_BASE_URL=http://localhost:8790 uvicorn main:app
+
+GET /_stub/stats 可查看收到的請求數、同時處理中的最大請求數與回傳的 429 次數
+
+故障注入（測試重試、斷路與備援）：--fail-rate 依機率回傳 --fail-status，--hang-rate 依機率
+延遲 --hang 秒才回應（觸發逾時），--down 指定完全不可用的後端；執行中可用
+POST /_stub/faults {"fail_rate": 0.3, "down": ["ollama"]} 調整，GET /_stub/faults 查看
+
+Ollama 請求 "stream": true 時以 NDJSON 逐 token 回傳（--token-delay 秒 / token）；
+--runaway trailing 在 JSON 之後繼續輸出多餘文字、repeat 不斷重複同一個區塊，
+用來測試提早停止（stats 的 stream_tokens / stream_aborted）
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import deque
+
+from fastapi import Body, FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="94RePdf OCR stub")
+
+config = {"latency": 0.2, "rpm": 0, "token_delay": 0.005, "runaway": "none", "max_tokens": 4096}
+faults = {"fail_rate": 0.0, "fail_status": 503, "hang_rate": 0.0, "hang": 30.0, "down": []}
+stats = {"gemini": 0, "ollama": 0, "rate_limited": 0, "failed": 0, "hung": 0,
+         "stream_tokens": 0, "stream_aborted": 0, "active": 0, "max_active": 0}
+_recent = deque()
+
+# 固定回傳一個文字區塊（位於左上角）
+_TEXTS = {"texts": [{
+    "content": "Stub",
+    "x": 40, "y": 40, "width": 200, "height": 48,
+    "font_size": 28, "font_weight": "bold", "color": "#333333", "confidence": 0.9,
+}]}
+
+
+async def _handle() -> None:
+    """模擬處理時間並統計同時處理中的請求數"""
+    stats["active"] += 1
+    stats["max_active"] = max(stats["max_active"], stats["active"])
+    try:
+        await asyncio.sleep(config["latency"])
+    finally:
+        stats["active"] -= 1
+
+
+def _rate_limited() -> bool:
+    """超過每分鐘請求數時返回 True（滑動視窗）"""
+    if not config["rpm"]:
+        return False
+    now = time.monotonic()
+    while _recent and now - _recent[0] > 60:
+        _recent.popleft()
+    if len(_recent) >= config["rpm"]:
+        stats["rate_limited"] += 1
+        return True
+    _recent.append(now)
+    return False
+
+
+async def _inject_fault(backend: str):
+    """依故障設定返回錯誤回應，或延遲後照常處理（返回 None）"""
+    if backend in faults["down"] or random.random() < faults["fail_rate"]:
+        stats["failed"] += 1
+        status = faults["fail_status"]
+        return JSONResponse(status_code=status, content={"error": {
+            "code": status, "message": "Injected failure (stub)", "status": "UNAVAILABLE",
+        }})
+    if random.random() < faults["hang_rate"]:
+        stats["hung"] += 1
+        await asyncio.sleep(faults["hang"])
+    return None
+
+
+@app.post("/v1beta/models/{model}:generateContent")
+async def gemini_generate(model: str, request: Request):
+    body = await request.json()
+    fault = await _inject_fault("gemini")
+    if fault:
+        return fault
+    if _rate_limited():
+        return JSONResponse(status_code=429, content={"error": {
+            "code": 429, "message": "Resource has been exhausted (stub)", "status": "RESOURCE_EXHAUSTED",
+        }})
+    stats["gemini"] += 1
+    await _handle()
+    prompt_tokens = sum(len(part.get("text", "")) + 258 * ("inlineData" in part)
+                        for content in body.get("contents", []) for part in content.get("parts", []))
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": json.dumps(_TEXTS)}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0,
+        }],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": 60,
+            "totalTokenCount": prompt_tokens + 60,
+        },
+    }
+
+
+def _tokens(limit: int):
+    """模型輸出切成約 4 字元的 token；runaway 模式在 JSON 之後或區塊之間持續輸出"""
+    text = json.dumps(_TEXTS)
+    if config["runaway"] == "repeat":
+        block = json.dumps(_TEXTS["texts"][0])
+        text = '{"texts": [' + ", ".join([block] * (limit // 10 + 1))
+    elif config["runaway"] == "trailing":
+        text += "\n\n以上是辨識結果。" * (limit // 5 + 1)
+    pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+    return pieces[:limit]
+
+
+async def _ollama_stream(limit: int):
+    """NDJSON 串流；客戶端提早關閉連線時計入 stream_aborted"""
+    stats["active"] += 1
+    stats["max_active"] = max(stats["max_active"], stats["active"])
+    start = time.monotonic()
+    count = 0
+    try:
+        await asyncio.sleep(config["latency"])
+        for piece in _tokens(limit):
+            await asyncio.sleep(config["token_delay"])
+            count += 1
+            stats["stream_tokens"] += 1
+            yield json.dumps({"response": piece, "done": False}) + "\n"
+        yield json.dumps({
+            "response": "", "done": True, "done_reason": "stop" if count < limit else "length",
+            "eval_count": count, "eval_duration": int((time.monotonic() - start) * 1e9),
+        }) + "\n"
+    except (asyncio.CancelledError, GeneratorExit):
+        stats["stream_aborted"] += 1
+        raise
+    finally:
+        stats["active"] -= 1
+
+
+@app.post("/api/generate")
+async def ollama_generate(request: Request):
+    body = await request.json()
+    fault = await _inject_fault("ollama")
+    if fault:
+        return fault
+    stats["ollama"] += 1
+    limit = body.get("options", {}).get("num_predict") or config["max_tokens"]
+    if body.get("stream", True):
+        return StreamingResponse(_ollama_stream(limit), media_type="application/x-ndjson")
+    await _handle()
+    text = "".join(_tokens(limit))
+    return {"response": text, "done": True, "eval_count": len(_tokens(limit)),
+            "eval_duration": int(config["latency"] * 1e9)}
+
+
+@app.get("/api/tags")
+async def ollama_tags():
+    return {"models": [{"name": os.getenv("OLLAMA_MODEL", "qwen3-vl:8b")}]}
+
+
+@app.get("/_stub/stats")
+async def get_stats():
+    return stats
+
+
+@app.get("/_stub/faults")
+async def get_faults():
+    return faults
+
+
+@app.post("/_stub/faults")
+async def set_faults(update: dict = Body(...)):
+    """調整故障設定（也可調整 latency、token_delay、runaway 等 config 項目）"""
+    faults.update({k: v for k, v in update.items() if k in faults})
+    config.update({k: v for k, v in update.items() if k in config})
+    return {**config, **faults}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="94RePdf OCR stub server")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency", type=float, default=config["latency"], help="每個請求的處理秒數")
+    parser.add_argument("--rpm", type=int, default=0, help="每分鐘請求數上限，超過回 429（0 不限制）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="回傳錯誤的機率（0-1）")
+    parser.add_argument("--fail-status", type=int, default=503, help="注入錯誤的 HTTP 狀態碼")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="延遲回應的機率（0-1）")
+    parser.add_argument("--hang", type=float, default=30.0, help="延遲回應的秒數")
+    parser.add_argument("--down", default="", help="完全不可用的後端（逗號分隔：gemini,ollama）")
+    parser.add_argument("--token-delay", type=float, default=config["token_delay"], help="Ollama 串流每個 token 的秒數")
+    parser.add_argument("--runaway", choices=["none", "trailing", "repeat"], default="none",
+                        help="Ollama 在 JSON 之後繼續輸出（trailing）或重複輸出區塊（repeat）")
+    args = parser.parse_args()
+    config.update(latency=args.latency, rpm=args.rpm, token_delay=args.token_delay, runaway=args.runaway)
+    faults.update(fail_rate=args.fail_rate, fail_status=args.fail_status, hang_rate=args.hang_rate,
+                  hang=args.hang, down=[name for name in args.down.split(",") if name])
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
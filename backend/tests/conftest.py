@@ -0,0 +1,5 @@
+"""測試設定：以 backend 目錄作為匯入根目錄（與 test_e2e.py 相同）"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,55 @@
+"""下載 API：Range 標頭解析（RFC 9110）"""
+import pytest
+
+from api.download import etag_matches, parse_range
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-10", (990, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=0-5000", (0, 999)),
+    ("bytes=999-999", (999, 999)),
+    ("bytes= 10-20", (10, 20)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "items=0-1",
+    "bytes=abc",
+    "bytes=-",
+    "bytes=5-2",
+    "bytes=--5",
+    "bytes=1-x",
+    "bytes=0-1,5-9",
+])
+def test_ignored_headers_return_full_file(header):
+    assert parse_range(header, SIZE) is None
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", SIZE),
+    ("bytes=2000-3000", SIZE),
+    ("bytes=-0", SIZE),
+    ("bytes=-5", 0),
+])
+def test_unsatisfiable_ranges(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
+
+
+def test_etag_matches():
+    etag = '"abc-1"'
+    assert etag_matches('"abc-1"', etag)
+    assert etag_matches('W/"abc-1"', etag)
+    assert etag_matches('"x", "abc-1"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"abc-2"', etag)
+    assert not etag_matches(None, etag)
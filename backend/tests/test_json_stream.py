@@ -0,0 +1,71 @@
+"""JsonStreamScanner：巢狀層級、字串跳脫與截斷輸出的補救"""
+import json
+
+from services.json_stream import JsonStreamScanner
+
+DOCUMENT = json.dumps({"texts": [
+    {"content": "括號 } 與 { 在字串內", "x": 1, "y": 2},
+    {"content": 'escaped \\" quote and \\\\ backslash }', "x": 3, "y": 4},
+    {"content": "nested", "style": {"bold": True}, "x": 5, "y": 6},
+]}, ensure_ascii=False)
+
+
+def feed_all(scanner, text, size):
+    blocks = []
+    for i in range(0, len(text), size):
+        blocks += scanner.feed(text[i:i + size])
+    return blocks
+
+
+def test_blocks_and_document_for_any_chunking():
+    expected = json.loads(DOCUMENT)["texts"]
+    for size in (1, 2, 3, 7, len(DOCUMENT)):
+        scanner = JsonStreamScanner()
+        blocks = feed_all(scanner, "```json\n" + DOCUMENT + "\n```", size)
+        assert blocks == expected
+        assert scanner.complete
+        assert json.loads(scanner.document()) == json.loads(DOCUMENT)
+
+
+def test_escape_split_across_chunks():
+    scanner = JsonStreamScanner()
+    assert scanner.feed('{"texts": [{"content": "a\\') == []
+    # 跳脫的引號與字串內的 } 不結束區塊
+    assert scanner.feed('"}"}') == [{"content": 'a"}'}]
+    assert not scanner.complete
+    assert scanner.feed("]}") == []
+    assert scanner.complete
+
+
+def test_output_after_document_is_ignored():
+    scanner = JsonStreamScanner()
+    scanner.feed('{"texts": []} trailing {"texts": [{"content": "x"}]}')
+    assert scanner.complete
+    assert scanner.document() == '{"texts": []}'
+    assert scanner.blocks == []
+    assert scanner.feed('{"more": 1}') == []
+
+
+def test_incomplete_document():
+    scanner = JsonStreamScanner()
+    scanner.feed('<think>先看版面</think> {"texts": [{"content": "a"}, {"content": "b"')
+    assert not scanner.complete
+    assert scanner.document() is None
+    assert scanner.blocks == [{"content": "a"}]
+
+
+def test_repeating_and_salvage():
+    scanner = JsonStreamScanner()
+    scanner.feed('{"texts": [{"content": "a"}, ')
+    assert not scanner.repeating(3)
+    scanner.feed('{"content": "b"}, {"content": "b"}, {"content": "b"}, {"content": "b')
+    assert scanner.repeating(3)
+    assert not scanner.repeating(4)
+    assert json.loads(scanner.salvage()) == {"texts": [{"content": "a"}, {"content": "b"}]}
+
+
+def test_invalid_block_is_skipped():
+    scanner = JsonStreamScanner()
+    blocks = scanner.feed('{"texts": [{"content": nope}, {"content": "ok"}]}')
+    assert blocks == [{"content": "ok"}]
+    assert scanner.complete
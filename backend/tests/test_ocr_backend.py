@@ -0,0 +1,42 @@
+"""OCR 後端註冊：未實作 generate() 的後端在註冊或建立實例時即失敗"""
+import pytest
+
+from services import ocr_backend
+from services.ocr_backend import OcrBackend, backend_names, get_backend, register_backend
+
+
+class IncompleteBackend(OcrBackend):
+    name = "incomplete"
+
+
+class EchoBackend(OcrBackend):
+    name = "echo"
+
+    async def generate(self, prompt, image_bytes, width, height, max_tokens=None):
+        return '{"texts": []}'
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """測試中註冊的後端不留在共用註冊表"""
+    monkeypatch.setattr(ocr_backend, "_registry", dict(ocr_backend._registry))
+    monkeypatch.setattr(ocr_backend, "_instances", {})
+
+
+def test_incomplete_backend_is_rejected():
+    with pytest.raises(TypeError, match="generate"):
+        register_backend("incomplete", IncompleteBackend)
+    assert "incomplete" not in backend_names()
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+
+def test_incomplete_backend_from_string_fails_on_lookup():
+    register_backend("incomplete", f"{__name__}:IncompleteBackend")
+    with pytest.raises(TypeError, match="generate"):
+        get_backend("incomplete")
+
+
+def test_complete_backend_is_registered():
+    register_backend("echo", EchoBackend)
+    assert isinstance(get_backend("echo"), EchoBackend)
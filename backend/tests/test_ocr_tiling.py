@@ -0,0 +1,86 @@
+"""分塊 OCR：方塊規劃與各塊結果的合併（接回切開的行、去除重疊區的重複）"""
+from services.ocr_backend import OcrCapabilities
+from services.ocr_tiling import merge_tile_texts, plan_tiles, tile_size_for
+
+
+def spans(tiles, axis):
+    """方塊在某一軸上的 (起點, 長度)，去除重複"""
+    return sorted({(tile[axis], tile[axis + 2]) for tile in tiles})
+
+
+def test_small_page_is_one_tile():
+    assert plan_tiles(800, 600, 1024, 160) == [(0, 0, 800, 600)]
+
+
+def test_tiles_cover_page_with_overlap():
+    for width, height, size, overlap in [(2400, 1350, 1000, 160), (5000, 3000, 1024, 200), (1025, 2049, 1024, 160)]:
+        tiles = plan_tiles(width, height, size, overlap)
+        for axis, length in ((0, width), (1, height)):
+            runs = spans(tiles, axis)
+            assert runs[0][0] == 0
+            assert runs[-1][0] + runs[-1][1] == length
+            assert all(run_size <= size for _, run_size in runs)
+            for (start, run_size), (next_start, _) in zip(runs, runs[1:]):
+                assert start + run_size - next_start >= overlap
+        # 由左至右、由上至下
+        assert tiles == sorted(tiles, key=lambda t: (t[1], t[0]))
+
+
+def test_overlap_is_capped_to_half_tile():
+    tiles = plan_tiles(3000, 100, 400, 1000)
+    runs = spans(tiles, 0)
+    assert all(run_size <= 400 for _, run_size in runs)
+    assert runs[-1][0] + runs[-1][1] == 3000
+
+
+def test_tile_size_for_capabilities():
+    caps = OcrCapabilities(max_pixels=1024 * 1024, max_image_side=3000)
+    assert tile_size_for(caps) == 1024
+    assert tile_size_for(caps._replace(max_pixels=0)) == 3000
+    assert tile_size_for(caps._replace(max_pixels=0, max_image_side=0)) == 1024
+
+
+def box(content, x, y, width, height):
+    return {"content": content, "x": x, "y": y, "width": width, "height": height}
+
+
+def test_split_line_is_stitched():
+    # 兩塊左右相鄰，重疊區 x = 900..1100；一行文字橫跨切線
+    left, right = (0, 0, 1100, 600), (900, 0, 1100, 600)
+    merged = merge_tile_texts([
+        (left, [box("Quarterly rev", 800, 100, 300, 40)]),
+        (right, [box("revenue grew", 0, 102, 350, 40)]),
+    ], 2000, 600, cell=320)
+    assert len(merged) == 1
+    assert merged[0]["content"] == "Quarterly revenue grew"
+    assert merged[0]["x"] == 800
+    assert merged[0]["x"] + merged[0]["width"] == 900 + 350
+
+
+def test_duplicate_in_overlap_keeps_most_complete():
+    top, bottom = (0, 0, 1000, 700), (0, 500, 1000, 700)
+    merged = merge_tile_texts([
+        # 完整出現在重疊區（y = 500..700）的文字，兩塊都辨識到
+        (top, [box("標題文字", 100, 550, 300, 50), box("上方段落", 100, 100, 400, 40)]),
+        (bottom, [box("標題文", 100, 50, 260, 50), box("下方段落", 100, 400, 400, 40)]),
+    ], 1000, 1200, cell=320)
+    assert [t["content"] for t in merged] == ["上方段落", "標題文字", "下方段落"]
+    assert [t["y"] for t in merged] == [100, 550, 900]
+
+
+def test_clipped_box_replaced_by_complete_one():
+    left, right = (0, 0, 1100, 600), (900, 0, 1100, 600)
+    merged = merge_tile_texts([
+        # 左塊中被切線截斷（碰到右側內緣），右塊中完整
+        (left, [box("Summ", 1000, 300, 100, 40)]),
+        (right, [box("Summary", 100, 300, 150, 40)]),
+    ], 2000, 600, cell=320)
+    assert [(t["content"], t["x"]) for t in merged] == [("Summary", 1000)]
+
+
+def test_invalid_boxes_are_dropped():
+    merged = merge_tile_texts([
+        ((0, 0, 500, 500), [box("", 0, 0, 10, 10), box("ok", 1, 1, 10, 10),
+                            {"content": "no position"}, box("zero", 5, 5, 0, 10)]),
+    ], 500, 500)
+    assert [t["content"] for t in merged] == ["ok"]
@@ -0,0 +1,67 @@
+"""頁面渲染：連續頁碼合併為同一次 poppler 渲染、依指定順序輸出，渲染失敗時回報替代的頁面"""
+import pytest
+from PIL import Image
+
+from services.pdf_service import PdfService, group_page_runs
+
+pdf2image = pytest.importorskip("pdf2image")
+
+
+def make_meta(count):
+    return {"page_count": count, "pages": [{"width": 720, "height": 405} for _ in range(count)]}
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """以假的 convert_from_path 記錄每次渲染的 (first, last)，圖片寬度為頁碼"""
+    calls = []
+
+    def convert_from_path(path, dpi, first_page, last_page):
+        calls.append((first_page, last_page))
+        return [Image.new("RGB", (page, 1)) for page in range(first_page, last_page + 1)]
+
+    monkeypatch.setattr(pdf2image, "convert_from_path", convert_from_path)
+    return calls
+
+
+def test_group_page_runs():
+    assert group_page_runs([3, 4, 5, 9, 1], 2) == [(3, 4), (5, 5), (9, 9), (1, 1)]
+    assert group_page_runs([3, 4, 5], 4) == [(3, 5)]
+    assert group_page_runs([3, 4, 5], 1) == [(3, 3), (4, 4), (5, 5)]
+    assert group_page_runs([5, 4, 3], 4) == [(5, 5), (4, 4), (3, 3)]
+
+
+def test_contiguous_pages_render_as_one_run(renders):
+    images = PdfService().iter_images("doc.pdf", window=4, pages=[3, 4, 5], meta=make_meta(10))
+    assert [img.width for img in images] == [3, 4, 5]
+    assert renders == [(3, 5)]
+
+
+def test_runs_are_bounded_by_window(renders):
+    images = PdfService().iter_images("doc.pdf", window=4, pages=[1, 2, 3, 4, 5, 6, 9, 2], meta=make_meta(10))
+    assert [img.width for img in images] == [1, 2, 3, 4, 5, 6, 9, 2]
+    assert renders == [(1, 4), (5, 6), (9, 9), (2, 2)]
+
+
+def test_failed_render_is_reported(tmp_path, monkeypatch):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(b"%PDF-1.4")
+
+    def convert_from_path(*args, **kwargs):
+        raise RuntimeError("pdftoppm crashed")
+
+    monkeypatch.setattr(pdf2image, "convert_from_path", convert_from_path)
+    service = PdfService(dpi=72)
+    images = list(service.iter_images(str(path), window=4, pages=[2, 3, 7], meta=make_meta(10)))
+    # 以空白圖片替代，頁碼記錄在 fallback_pages
+    assert [img.size for img in images] == [(720, 405)] * 3
+    assert service.fallback_pages == [2, 3, 7]
+
+
+def test_deleted_source_fails_instead_of_blank_pages(tmp_path, monkeypatch):
+    def convert_from_path(*args, **kwargs):
+        raise RuntimeError("Unable to get page count")
+
+    monkeypatch.setattr(pdf2image, "convert_from_path", convert_from_path)
+    with pytest.raises(FileNotFoundError):
+        list(PdfService().iter_images(str(tmp_path / "gone.pdf"), pages=[1], meta=make_meta(1)))
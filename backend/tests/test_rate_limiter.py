@@ -0,0 +1,103 @@
+"""速率限制：token bucket 的放行時間、排隊順序、暫停與額度分配"""
+import asyncio
+import time
+
+from services.rate_limiter import TokenBucketLimiter, budget_share, limiter_stats
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def timed_acquire(limiter, count, tokens=0):
+    """連續取得 count 次額度，返回每次放行的時間（相對開始）"""
+    start = time.monotonic()
+    released = []
+    for _ in range(count):
+        await limiter.acquire(tokens)
+        released.append(time.monotonic() - start)
+    return released
+
+
+def test_burst_then_refill_rate():
+    # 每分鐘 240 次 = 每 0.25 秒補充一次；bucket 起始全滿
+    limiter = TokenBucketLimiter(rpm=240, tpm=0)
+    released = run(timed_acquire(limiter, 242))
+    assert released[239] < 0.1
+    assert 0.2 <= released[240] < 0.35
+    assert 0.45 <= released[241] < 0.6
+
+
+def test_token_budget_waits_for_refill():
+    # 每分鐘 600 token = 每秒 10 個；先用掉 500，下一個 105 token 的請求需補充 5 個（0.5 秒）
+    limiter = TokenBucketLimiter(rpm=0, tpm=600)
+
+    async def scenario():
+        await limiter.acquire(500)
+        return await timed_acquire(limiter, 1, tokens=105)
+
+    assert 0.45 <= run(scenario())[0] < 0.6
+
+
+def test_settle_returns_overestimate():
+    limiter = TokenBucketLimiter(rpm=0, tpm=600)
+
+    async def scenario():
+        await limiter.acquire(600)
+        # 實際只用了 100：退回 500，下一個 400 token 的請求不需等待
+        limiter.settle(600, 100)
+        start = time.monotonic()
+        await limiter.acquire(400)
+        return time.monotonic() - start
+
+    assert run(scenario()) < 0.05
+
+
+def test_requests_are_served_in_arrival_order():
+    limiter = TokenBucketLimiter(rpm=600, tpm=0)
+
+    async def scenario():
+        order = []
+        for _ in range(600):
+            await limiter.acquire(0)
+
+        async def request(i):
+            await limiter.acquire(0)
+            order.append(i)
+
+        await asyncio.gather(*(request(i) for i in range(5)))
+        return order
+
+    assert run(scenario()) == [0, 1, 2, 3, 4]
+
+
+def test_pause_delays_release():
+    limiter = TokenBucketLimiter(rpm=0, tpm=0)
+
+    async def scenario():
+        limiter.pause(0.3)
+        return await timed_acquire(limiter, 1)
+
+    assert 0.28 <= run(scenario())[0] < 0.45
+    assert limiter.stats()["paused"] == 1
+
+
+def test_unlimited():
+    limiter = TokenBucketLimiter(rpm=0, tpm=0)
+    released = run(timed_acquire(limiter, 1000, tokens=10 ** 6))
+    assert released[-1] < 0.2
+    stats = limiter.stats()
+    assert stats["requests"] == 1000
+    assert stats["available_requests"] is None
+
+
+def test_budget_share():
+    assert budget_share(1000, 4) == 250
+    assert budget_share(1000, 0) == 1000
+    assert budget_share(3, 8) == 1
+    assert budget_share(0, 4) == 0
+
+
+def test_named_limiters_are_reported():
+    TokenBucketLimiter(rpm=60, tpm=0, name="test")
+    assert limiter_stats()["test"]["rpm"] == 60
@@ -0,0 +1,70 @@
+"""文字層偵測：內容串流掃描的字元數與 extract_text 一致"""
+import io
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from services.text_layer import _count_text_bytes, _extract_text_check, content_streams, page_has_text
+
+CONTENTS = {
+    "plain": b"BT /F1 12 Tf 72 700 Td (Hello World) Tj ET",
+    "escapes": b"BT /F1 12 Tf 72 700 Td (a\\(b\\)c \\101\\102\\n) Tj ET",
+    "nested": b"BT /F1 12 Tf 72 700 Td (x(y)z) Tj ET",
+    "hex": b"BT /F1 12 Tf 72 700 Td <48656C6C6F 20 576F726C64> Tj ET",
+    "hex_spaces": b"BT /F1 12 Tf 72 700 Td <20202020202020202020202020202020 41> Tj ET",
+    "array": b"BT /F1 12 Tf 72 700 Td [(Hel) -200 (lo) 120 <576F> (rld)] TJ ET",
+    "multiple": b"BT /F1 12 Tf 72 700 Td (one) Tj ET\nBT /F1 12 Tf 72 680 Td (two three) Tj ET",
+    "outside_bt": b"% (comment text)\nq 1 0 0 1 0 0 cm Q\nBT /F1 12 Tf 72 700 Td (inside) Tj ET",
+    "marked": b"/Span << /MCID 0 >> BDC BT /F1 12 Tf 72 700 Td (marked text) Tj ET EMC",
+    "inline_image": b"BI /W 2 /H 1 /BPC 8 /CS /G ID ((\xff EI\nBT /F1 12 Tf 72 700 Td (after image) Tj ET",
+    "short": b"BT /F1 12 Tf 72 700 Td (tiny) Tj ET",
+    "threshold": b"BT /F1 12 Tf 72 700 Td (0123456789) Tj ET",
+    "above_threshold": b"BT /F1 12 Tf 72 700 Td (0123456789A) Tj ET",
+}
+
+
+def make_page(content: bytes):
+    """以 Helvetica（WinAnsi，一個 byte 一個字元）建立單頁 PDF，經寫出再讀回"""
+    writer = PdfWriter()
+    page = writer.add_blank_page(612, 792)
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+        NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+    })
+    page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/Font"): DictionaryObject({NameObject("/F1"): writer._add_object(font)}),
+    })
+    stream = DecodedStreamObject()
+    stream.set_data(content)
+    page[NameObject("/Contents")] = writer._add_object(stream)
+    output = io.BytesIO()
+    writer.write(output)
+    return PdfReader(io.BytesIO(output.getvalue())).pages[0]
+
+
+@pytest.mark.parametrize("name", sorted(CONTENTS))
+def test_count_matches_extract_text(name):
+    page = make_page(CONTENTS[name])
+    data = b"\n".join(content_streams(page))
+    expected = len("".join(page.extract_text().split()))
+    assert _count_text_bytes(data, 10 ** 9) == expected
+
+
+@pytest.mark.parametrize("name", sorted(CONTENTS))
+def test_page_has_text_matches_extract_text(name):
+    page = make_page(CONTENTS[name])
+    assert page_has_text(page) == _extract_text_check(page)
+
+
+def test_count_stops_after_limit():
+    data = b"BT " + b"(abcdefghij) Tj " * 100 + b"ET"
+    assert _count_text_bytes(data, 15) == 20
+
+
+def test_page_without_fonts_has_no_text():
+    writer = PdfWriter()
+    page = writer.add_blank_page(612, 792)
+    assert not page_has_text(page)
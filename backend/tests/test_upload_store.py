@@ -0,0 +1,53 @@
+"""上傳儲存：容量淘汰與到期清理不刪除排隊或處理中任務使用的檔案"""
+import os
+import time
+
+import pytest
+
+from services.job_queue import JobQueue
+from services.upload_store import CapacityExhausted, UploadStore
+
+
+def make_store(tmp_path, budget=250, ttl=3600):
+    db_path = str(tmp_path / "jobs.db")
+    store = UploadStore(str(tmp_path / "uploads"), budget=budget, ttl=ttl, min_retain=0, db_path=db_path)
+    return store, JobQueue(db_path)
+
+
+def add_file(store, name, size=100):
+    path = store.path_for(name, ".pdf")
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    store.add(name, {"sha256": name, "path": path, "filename": f"{name}.pdf", "size": size, "pages": 1})
+    return path
+
+
+def test_eviction_skips_files_of_active_jobs(tmp_path):
+    store, queue = make_store(tmp_path)
+    pinned = add_file(store, "a")
+    queue.enqueue("task-a", {"file_id": "a", "path": pinned})
+    time.sleep(0.01)
+    other = add_file(store, "b")
+    # 需要淘汰 50 bytes：最久未使用的 a 正在排隊，改淘汰 b
+    add_file(store, "c")
+    assert os.path.exists(pinned)
+    assert not os.path.exists(other)
+    assert store.get("a") is not None
+
+    # 只有 c 可淘汰，放不下 200 bytes
+    with pytest.raises(CapacityExhausted):
+        add_file(store, "d", size=200)
+
+
+def test_sweep_keeps_files_until_job_finishes(tmp_path):
+    store, queue = make_store(tmp_path, ttl=0)
+    pinned = add_file(store, "a")
+    queue.enqueue("task-a", {"file_id": "a", "path": pinned})
+    assert queue.claim("worker-1")["task_id"] == "task-a"
+    time.sleep(0.01)
+    assert store.sweep() == 0
+    assert os.path.exists(pinned)
+
+    queue.complete("task-a", "", {})
+    assert store.sweep() == 1
+    assert not os.path.exists(pinned)
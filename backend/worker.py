@@ -0,0 +1,173 @@
+"""
+94RePdf 任務 Worker
+從共用的 SQLite 佇列領取任務並處理
+
+可由 main.py 自動啟動（JOB_WORKERS），或獨立執行：
+    python worker.py
+"""
+import os
+import sys
+import json
+import signal
+import socket
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 每個 worker 同時處理的任務數
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+# 佇列空閒時的輪詢間隔（秒）
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+# heartbeat 與檢查逾時任務的間隔（秒）
+HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "10"))
+# 進度與步驟事件寫回佇列的間隔（秒）
+PROGRESS_FLUSH_INTERVAL = float(os.getenv("JOB_PROGRESS_FLUSH_INTERVAL", "0.25"))
+
+
+class Worker:
+    """領取任務、定期 heartbeat 並寫回進度"""
+
+    def __init__(self, worker_id: Optional[str] = None):
+        from services.job_queue import get_job_queue
+
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.queue = get_job_queue()
+        self.running: Dict[str, asyncio.Task] = {}
+        self.progress: Dict[str, dict] = {}
+        self.events: Dict[str, List[dict]] = {}
+        self._flushed: Dict[str, str] = {}
+        self._stopping: Optional[asyncio.Event] = None
+
+    def stop(self) -> None:
+        """停止領取新任務，處理中的任務歸還佇列"""
+        if self._stopping:
+            self._stopping.set()
+
+    async def run(self) -> None:
+        from services import executor_service, ollama_service
+        from services.executor_service import run_io
+
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+
+        logger.info(f"Worker {self.worker_id} started (concurrency={JOB_CONCURRENCY})")
+        # 行程內所有任務共用同一個 Ollama 連線池
+        ollama_service.get_ollama_client()
+        monitor = asyncio.create_task(self._monitor())
+        try:
+            while not self._stopping.is_set():
+                if len(self.running) < JOB_CONCURRENCY:
+                    job = await run_io(self.queue.claim, self.worker_id)
+                    if job:
+                        self._start(job)
+                        continue
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            monitor.cancel()
+            tasks = dict(self.running)
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            for task_id in tasks:
+                await run_io(self.queue.release, task_id, self.worker_id)
+            await run_io(self.queue.remove_worker, self.worker_id)
+            await ollama_service.close_ollama_client()
+            executor_service.shutdown()
+            logger.info(f"Worker {self.worker_id} stopped")
+
+    def _start(self, job: Dict) -> None:
+        task_id = job["task_id"]
+        logger.info(f"Claimed task {task_id} (attempt {job['attempts']})")
+        self.progress[task_id] = {}
+        self.events[task_id] = []
+        self.running[task_id] = asyncio.create_task(self._run_job(task_id, job["params"]))
+
+    async def _run_job(self, task_id: str, params: Dict) -> None:
+        from api.process import process_pdf_to_pptx
+        from services.executor_service import run_io
+
+        progress = self.progress[task_id]
+        events = self.events[task_id]
+
+        def on_step(page: int, step: str) -> None:
+            events.append({"page": page, "step": step, "at": time.time()})
+
+        try:
+            result_path = await process_pdf_to_pptx(task_id, params, progress, on_step)
+            await self._flush_events(task_id)
+            await run_io(self.queue.complete, task_id, result_path, progress, os.path.getsize(result_path))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Process error for task {task_id}: {e}", exc_info=True)
+            await self._flush_events(task_id)
+            await run_io(self.queue.fail, task_id, str(e), progress)
+        finally:
+            self.running.pop(task_id, None)
+            self.progress.pop(task_id, None)
+            self.events.pop(task_id, None)
+            self._flushed.pop(task_id, None)
+
+    async def _monitor(self) -> None:
+        """定期寫回進度、heartbeat、將其他 worker 的逾時任務重新排入（佇列寫入在執行緒池進行）"""
+        from services.executor_service import run_io
+        from services.rate_limiter import limiter_stats
+
+        elapsed = 0.0
+        while True:
+            await asyncio.sleep(PROGRESS_FLUSH_INTERVAL)
+            elapsed += PROGRESS_FLUSH_INTERVAL
+            try:
+                for task_id, progress in list(self.progress.items()):
+                    await self._flush_events(task_id)
+                    snapshot = json.dumps(progress, sort_keys=True)
+                    if progress and self._flushed.get(task_id) != snapshot and task_id in self.running:
+                        await run_io(self.queue.update_progress, task_id, json.loads(snapshot))
+                        self._flushed[task_id] = snapshot
+
+                if elapsed >= HEARTBEAT_INTERVAL:
+                    elapsed = 0.0
+                    await run_io(self.queue.heartbeat, self.worker_id, list(self.running))
+                    await run_io(self.queue.requeue_stale)
+                    # 速率限制只存在本行程，回報到佇列供 /api/process/stats 查詢
+                    await run_io(self.queue.report_worker, self.worker_id, {"rate_limiters": limiter_stats()})
+            except Exception as e:
+                logger.error(f"Worker monitor error: {e}")
+
+    async def _flush_events(self, task_id: str) -> None:
+        """將累積的步驟事件批次寫入佇列"""
+        from services.executor_service import run_io
+
+        events = self.events.get(task_id)
+        if events:
+            pending = events[:]
+            del events[:]
+            await run_io(self.queue.add_events, task_id, pending)
+
+
+def main() -> None:
+    """Worker 行程進入點"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    asyncio.run(Worker().run())
+
+
+if __name__ == "__main__":
+    main()
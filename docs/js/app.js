@@ -279,17 +279,9 @@ async function handleFile(file) {
     state.uploadedFile = file;
     
     try {
-        const formData = new FormData();
-        formData.append('file', file);
-        
-        const uploadRes = await fetch(`${API_BASE}/upload`, {
-            method: 'POST',
-            body: formData
-        });
-        
-        if (!uploadRes.ok) throw new Error('上傳失敗');
-        
-        const uploadData = await uploadRes.json();
+        const uploadData = file.size > CHUNKED_UPLOAD_THRESHOLD
+            ? await uploadChunked(file)
+            : await uploadSingle(file);
         state.fileId = uploadData.file_id;
         
         const analyzeRes = await fetch(`${API_BASE}/analyze/${state.fileId}`);
@@ -314,6 +306,63 @@ async function handleFile(file) {
     }
 }
 
+// 超過此大小改用分段上傳（網路中斷時只需補送缺少的分段）
+const CHUNKED_UPLOAD_THRESHOLD = 5 * 1024 * 1024;
+const CHUNK_RETRIES = 3;
+
+async function uploadSingle(file) {
+    const formData = new FormData();
+    formData.append('file', file);
+    
+    const uploadRes = await fetch(`${API_BASE}/upload`, {
+        method: 'POST',
+        body: formData
+    });
+    
+    if (!uploadRes.ok) throw new Error('上傳失敗');
+    return uploadRes.json();
+}
+
+async function uploadChunked(file) {
+    const initRes = await fetch(`${API_BASE}/upload/init`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    if (!initRes.ok) throw new Error('上傳失敗');
+    const session = await initRes.json();
+    const uploadUrl = `${API_BASE}/upload/${session.upload_id}`;
+    const received = new Set(session.received);
+    
+    for (let i = 0; i < session.total_chunks; i++) {
+        if (received.has(i)) continue;
+        const offset = i * session.chunk_size;
+        await uploadChunk(`${uploadUrl}?offset=${offset}`, file.slice(offset, offset + session.chunk_size), i);
+    }
+    
+    const completeRes = await fetch(`${uploadUrl}/complete`, { method: 'POST' });
+    if (!completeRes.ok) throw new Error('上傳失敗');
+    return completeRes.json();
+}
+
+// 送出一個分段：網路錯誤、408 / 429 / 5xx 重試，其他錯誤（上傳已過期、分段不正確）立即停止
+async function uploadChunk(url, body, index) {
+    for (let attempt = 0; ; attempt++) {
+        let res = null;
+        try {
+            res = await fetch(url, { method: 'PUT', body });
+        } catch (err) {
+            console.warn(`Chunk ${index} failed:`, err);
+        }
+        if (res && res.ok) return;
+        const retryable = !res || res.status === 408 || res.status === 429 || res.status >= 500;
+        if (!retryable || attempt >= CHUNK_RETRIES) {
+            throw new Error(res ? `上傳失敗（分段 ${index + 1}，HTTP ${res.status}）` : '上傳失敗（網路中斷）');
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+    }
+}
+
 function updateAnalyzeUI(filename, size, analysis) {
     document.getElementById('file-name').textContent = filename;
     document.getElementById('file-meta').textContent = 
@@ -332,6 +381,9 @@ function updateAnalyzeUI(filename, size, analysis) {
     };
     document.getElementById('pdf-type').textContent = typeLabels[analysis.type] || analysis.type;
     
+    // 偵測到右下角浮水印時預設勾選移除
+    document.getElementById('remove-watermark').checked = !!analysis.has_watermark;
+    
     updateCostDisplay();
 }
 
@@ -343,6 +395,7 @@ function initProcess() {
 async function startProcess() {
     const outputRatio = document.getElementById('slide-ratio').value;
     const removeWatermark = document.getElementById('remove-watermark').checked;
+    const tileOcr = document.getElementById('tile-ocr').checked;
     
     showSection('progress-section');
     
@@ -354,7 +407,7 @@ async function startProcess() {
             await processWithTesseract();
             break;
         case 'gemini':
-            await processWithGemini(outputRatio, removeWatermark);
+            await processWithGemini(outputRatio, removeWatermark, tileOcr);
             break;
     }
 }
@@ -471,7 +524,7 @@ async function processWithTesseract() {
 }
 
 // ===== Gemini 雲端 AI 處理 =====
-async function processWithGemini(outputRatio, removeWatermark) {
+async function processWithGemini(outputRatio, removeWatermark, tileOcr) {
     try {
         updateProgressUI(0, 1, 1, '連接雲端 AI...');
         
@@ -482,6 +535,7 @@ async function processWithGemini(outputRatio, removeWatermark) {
                 file_id: state.fileId,
                 output_ratio: outputRatio,
                 remove_watermark: removeWatermark,
+                tile_ocr: tileOcr,
                 use_local: false  // 使用 Gemini
             })
         });
@@ -494,7 +548,7 @@ async function processWithGemini(outputRatio, removeWatermark) {
         const data = await res.json();
         state.taskId = data.task_id;
         
-        pollProgress();
+        watchProgress();
         
     } catch (err) {
         console.error('Gemini process error:', err);
@@ -503,6 +557,63 @@ async function processWithGemini(outputRatio, removeWatermark) {
     }
 }
 
+// SSE 暫時中斷時由瀏覽器自動重連（帶 Last-Event-ID 從斷線處續傳），連續失敗超過此次數改用輪詢
+const SSE_MAX_RECONNECTS = 5;
+
+// 優先使用 SSE 接收進度推送，不支援或無法重連時改用輪詢
+function watchProgress() {
+    if (!window.EventSource) {
+        pollProgress();
+        return;
+    }
+    
+    const source = new EventSource(`${API_BASE}/process/events/${state.taskId}`);
+    let finished = false;
+    let reconnects = 0;
+    
+    source.onopen = () => {
+        reconnects = 0;
+    };
+    
+    source.addEventListener('progress', (e) => {
+        updateProgress(JSON.parse(e.data));
+    });
+    
+    source.addEventListener('step', (e) => {
+        const event = JSON.parse(e.data);
+        updateStep(event.step, event.page);
+    });
+    
+    source.addEventListener('done', () => {
+        finished = true;
+        source.close();
+        showSection('result-section');
+        setupDownloadButtons();
+        warnFailedPages(state.progress);
+    });
+    
+    source.addEventListener('failed', (e) => {
+        finished = true;
+        source.close();
+        const data = JSON.parse(e.data);
+        alert('處理失敗：' + (data.error || '未知錯誤'));
+        showSection('analyze-section');
+    });
+    
+    source.onerror = () => {
+        if (finished) return;
+        // CONNECTING：瀏覽器會自動重連；CLOSED：伺服器拒絕（例如 proxy 不支援 SSE），不會再重連
+        if (source.readyState === EventSource.CONNECTING && ++reconnects <= SSE_MAX_RECONNECTS) {
+            console.warn(`SSE 連線中斷，重新連線中（${reconnects}/${SSE_MAX_RECONNECTS}）`);
+            return;
+        }
+        finished = true;
+        source.close();
+        console.warn('SSE 無法連線，改用輪詢');
+        pollProgress();
+    };
+}
+
 async function pollProgress() {
     try {
         const res = await fetch(`${API_BASE}/process/status/${state.taskId}`);
@@ -516,6 +627,7 @@ async function pollProgress() {
         if (data.status === 'done') {
             showSection('result-section');
             setupDownloadButtons();
+            warnFailedPages(data.progress);
         } else if (data.status === 'failed') {
             alert('處理失敗：' + (data.error || '未知錯誤'));
             showSection('analyze-section');
@@ -529,17 +641,35 @@ async function pollProgress() {
 }
 
 function updateProgress(progress) {
+    state.progress = progress;
     document.getElementById('progress-fill').style.width = `${progress.percent}%`;
     document.getElementById('progress-text').textContent = `${progress.percent}%`;
     document.getElementById('current-page').textContent = progress.current_page;
     document.getElementById('total-pages').textContent = progress.total_pages;
     
+    updateStep(progress.current_step, progress.step_page);
+}
+
+function updateStep(step, page) {
     const stepLabels = {
+        'converting': '頁面轉換中...',
+        'native_text': '擷取文字層...',
         'ocr': 'Gemini AI 辨識中...',
+        'ocr_failed': '文字辨識失敗，保留原圖',
         'inpainting': '背景重建...',
-        'pptx': 'PPTX 生成中...'
+        'pptx': 'PPTX 生成中...',
+        'saving': '儲存檔案...'
     };
-    document.getElementById('current-step').textContent = stepLabels[progress.current_step] || progress.current_step;
+    const label = stepLabels[step] || step;
+    document.getElementById('current-step').textContent = page ? `${label}（第 ${page} 頁）` : label;
+}
+
+// 部分頁面 OCR 重試後仍失敗時，提醒這些頁面只有背景圖
+function warnFailedPages(progress) {
+    const failed = (progress && progress.failed_pages) || [];
+    if (failed.length === 0) return;
+    const pages = failed.map(p => p.page).join('、');
+    alert(`第 ${pages} 頁文字辨識失敗，這些投影片只有原始圖片（沒有可編輯文字），可稍後重新轉換。`);
 }
 
 // ===== 結果顯示 =====